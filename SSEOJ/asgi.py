@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SSEOJ.settings')
 
 application = get_asgi_application()
+
+# 应用加载完成后在后台构建题目检索索引，构建完成之前关键词检索使用数据库查询
+from problem.search import warm_up_problem_search_index  # noqa: E402
+
+warm_up_problem_search_index()
@@ -154,8 +154,47 @@ REST_FRAMEWORK = {
     'DATETIME_FORMAT': "%Y-%m-%d %H:%M:%S",
 }
 
+# 判题服务器注册表、判题槽位、准入控制、限流、配置版本号等都依赖多进程共享的缓存，
+# web进程和dramatiq worker必须使用同一个redis
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',  # 内存缓存
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
     }
 }
+
+
+# dramatiq消息队列，web进程投递任务，worker进程(dramatiq judge.worker)执行
+DRAMATIQ_BROKER = {
+    'BROKER': 'dramatiq.brokers.redis.RedisBroker',
+    'OPTIONS': {'url': REDIS_URL},
+}
+
+# 判题服务器HTTP客户端配置，超时单位为秒
+JUDGE_SERVER_CONNECT_TIMEOUT = 3
+# 需要覆盖最慢的一次判题(编译 + 所有测试点)
+JUDGE_SERVER_READ_TIMEOUT = 300
+# 只在连接阶段失败时重试
+JUDGE_SERVER_MAX_RETRIES = 2
+# 每个判题服务器保持的keep-alive连接数，不小于worker的线程数即可
+JUDGE_SERVER_POOL_SIZE = 8
+
+# 判题模式，sync: 每个判题任务在判题期间占用一个worker线程；
+# async: 判题任务交给worker进程内的事件循环，一个进程可以同时进行JUDGE_ASYNC_MAX_INFLIGHT个判题；
+# 消息交给事件循环时就被确认，进程退出时进行中的判题会丢失，由judge_lease表中的租约过期后重新投递
+JUDGE_DISPATCH_MODE = "sync"
+JUDGE_ASYNC_MAX_INFLIGHT = 64
+# 异步判题模式下执行数据库操作的线程数
+JUDGE_ASYNC_DB_THREADS = 8
+# 异步判题模式下执行数据库操作的线程保持连接的秒数，每次判题有十几次数据库操作，不能每次都重新连接
+JUDGE_ASYNC_CONN_MAX_AGE = 60
+# 异步判题的租约时长(秒)，超过时仍未判完的提交视为丢失，需要大于一次判题的最长耗时
+JUDGE_ASYNC_LEASE_TIMEOUT = 2 * JUDGE_SERVER_READ_TIMEOUT
+
+# 判题结果缓存的过期时间(秒)
+VERDICT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# 判题事件的跨进程传递方式，judge.events.LocalBackend只能在同一进程内传递
+JUDGE_EVENT_BACKEND = "judge.events.CacheBackend"
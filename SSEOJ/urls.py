@@ -24,4 +24,7 @@ urlpatterns = [
     path("api/", include("account.urls.oj")),
     path("api/", include("problem.urls.oj")),
     path("api/", include("forum.urls.oj")),
+    path("api/", include("conf.urls.oj")),
+    path("api/", include("submission.urls.oj")),
+    path("api/admin/", include("judge.urls.admin")),
 ]
@@ -3,8 +3,9 @@ from django.db.models import Q
 from rest_framework.views import APIView
 from rest_framework.exceptions import NotFound
 
-from problem.models import ProblemList
+from problem.models import Problem, ProblemList
 from problem.serializers import ProblemSerializer
+from problem.user_status import UserProblemStatus
 from submission.models import Submission, JudgeStatus
 from ..models import User, Following
 from ..serializers import *
@@ -317,22 +318,13 @@ class UserPasswordForgetAPI(APIView):
 
 class GetTryProblemAPI(APIView):
     def get(self, request, user_id):
-        submissions = Submission.objects.filter(user_id=user_id)
-        problems = []
-        for submission in submissions:
-            problems.append(submission.problem)
-        problems = list(set(problems))
         try:
             user = User.objects.get(id=user_id)
         except User.DoesNotExist:
             return fail('用户不存在！')
-        problems = [{
-            'pass_status': problem.pass_users.contains(user),
-            'id': problem.id,
-            'name': problem.name,
-            'difficulty': problem.difficulty,
-        } for problem in problems]
-        return success(problems)
+        problems = Problem.objects.filter(id__in=Submission.objects.filter(user_id=user_id).values('problem_id')) \
+            .values('id', 'name', 'difficulty')
+        return success(UserProblemStatus(user).annotate(list(problems)))
 
 
 class StarProblemAPI(APIView):
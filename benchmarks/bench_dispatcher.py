@@ -0,0 +1,192 @@
+"""
+端到端的判题调度压测：在测试数据库中创建N个提交，通过dramatiq的StubBroker把judge_task交给进程内的worker执行，
+judge_task经过JudgeDispatcher的完整流程(选择判题机、请求本地判题服务器桩、写回结果、更新计数器)。
+输出吞吐量、调度延迟(judge_task.send到判题服务器收到请求)的p50/p99、每个判题消息的数据库查询数，
+以及判题服务器桩上同时在判题中的请求数峰值
+
+python -m benchmarks.bench_dispatcher -n 500 --workers 8 --cpu-core 4 --latency 20
+# 比较同步和异步判题模式下一个worker进程能同时进行的判题数
+python -m benchmarks.bench_dispatcher -n 500 --workers 8 --cpu-core 64 --latency 200 --mode sync async
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "SSEOJ.settings")
+django.setup()
+
+import dramatiq  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+from dramatiq.brokers.stub import StubBroker  # noqa: E402
+from dramatiq.middleware import default_middleware  # noqa: E402
+
+# judge.tasks中的actor在导入时绑定broker，必须先设置StubBroker；
+# Prometheus中间件需要在process_boot时启动导出服务，压测中不需要
+broker = StubBroker(middleware=[middleware() for middleware in default_middleware
+                                if middleware.__name__ != "Prometheus"])
+dramatiq.set_broker(broker)
+
+from account.models import User  # noqa: E402
+from benchmarks.stub_judge_server import StubJudgeServer, add_config_arguments, config_from_arguments  # noqa: E402
+from judge.async_dispatch import get_async_judge_runner  # noqa: E402
+from judge.dispatcher import process_pending_task  # noqa: E402
+from judge.pending import PendingQueue  # noqa: E402
+from judge.registry import JudgeServerRegistry  # noqa: E402
+from judge.tasks import judge_task  # noqa: E402
+from problem.models import Problem  # noqa: E402
+from submission.models import Submission  # noqa: E402
+
+
+class QueryCounter(dramatiq.Middleware):
+    """
+    统计每个消息在处理过程中执行的SQL数
+    """
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counts = []
+
+    def _count(self, execute, sql, params, many, context):
+        self.local.count += 1
+        return execute(sql, params, many, context)
+
+    def before_process_message(self, broker, message):
+        self.local.count = 0
+        self.local.wrapper = connection.execute_wrapper(self._count)
+        self.local.wrapper.__enter__()
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        self.local.wrapper.__exit__(None, None, None)
+        with self.lock:
+            self.counts.append(self.local.count)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def prepare(n, same_code, name):
+    user = User.objects.create_user(username=name, email=f"{name}@example.com", password="bench")
+    problem = Problem.objects.create(name=name, description="", input_style="", output_style="",
+                                     sample={"input": [], "output": []}, difficulty=1, time_limit=1000,
+                                     memory_limit=256, test_case_id="bench")
+    submissions = [Submission(id=f"{name}-{i}", problem=problem, user_id=user.id, username=user.username,
+                              code=f"// {name}" if same_code else f"// {name} {i}", language="C++")
+                   for i in range(n)]
+    Submission.objects.bulk_create(submissions)
+    return problem, submissions
+
+
+def heartbeat(server, cpu_core, stop):
+    """
+    和真实的判题服务器一样每秒发送一次心跳，否则判题服务器会被当作离线
+    """
+    while True:
+        JudgeServerRegistry.heartbeat({"hostname": "bench", "judger_version": "stub", "cpu_core": cpu_core,
+                                       "memory": 0, "cpu": 0, "action": "heartbeat",
+                                       "service_url": server.service_url})
+        if stop.wait(1):
+            return
+
+
+def wait_all(mode):
+    """
+    等待所有判题结束；最后一批留在等待队列中的任务模拟心跳重新投递
+    """
+    queue = broker.queues[judge_task.queue_name]
+    while True:
+        broker.join(judge_task.queue_name)
+        if mode == "async":
+            get_async_judge_runner().join()
+        if PendingQueue.size():
+            process_pending_task()
+        elif not queue.unfinished_tasks:
+            return
+
+
+def run(args, mode, counter):
+    settings.JUDGE_DISPATCH_MODE = mode
+    settings.JUDGE_ASYNC_MAX_INFLIGHT = args.max_inflight
+    problem, submissions = prepare(args.n, args.same_code, f"bench-{mode}")
+    counter.counts.clear()
+    worker = dramatiq.Worker(broker, worker_threads=args.workers)
+
+    with StubJudgeServer(config=config_from_arguments(args)) as server:
+        stop_heartbeat = threading.Event()
+        heartbeat_thread = threading.Thread(target=heartbeat, args=(server, args.cpu_core, stop_heartbeat))
+        heartbeat_thread.start()
+        worker.start()
+        send_time = {}
+        start = time.perf_counter()
+        for submission in submissions:
+            send_time[submission.code] = time.perf_counter()
+            judge_task.send(submission.id, problem.id)
+        wait_all(mode)
+        elapsed = time.perf_counter() - start
+        worker.stop()
+        stop_heartbeat.set()
+        heartbeat_thread.join()
+        received = list(server.received)
+        peak_active = server.peak_active
+
+    first_received = {}
+    for received_time, data in received:
+        first_received.setdefault(data["src"], received_time)
+    latencies = [(first_received[code] - send_time[code]) * 1000 for code in first_received if code in send_time]
+    results = Counter(Submission.objects.filter(problem=problem).values_list("result", flat=True))
+
+    print(f"mode:                 {mode}")
+    print(f"submissions:          {args.n}")
+    print(f"elapsed:              {elapsed:.2f} s")
+    print(f"throughput:           {args.n / elapsed:.1f} submissions/s")
+    print(f"judge requests:       {len(received)}")
+    print(f"peak in-flight:       {peak_active}")
+    if latencies:
+        print(f"scheduling latency:   p50 {percentile(latencies, 50):.1f} ms, p99 {percentile(latencies, 99):.1f} ms")
+    if counter.counts:
+        print(f"queries per message:  mean {sum(counter.counts) / len(counter.counts):.1f}, "
+              f"p50 {percentile(counter.counts, 50)}, max {max(counter.counts)} ({len(counter.counts)} messages)")
+    print(f"results:              {dict(results)}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200, help="提交数")
+    parser.add_argument("--workers", type=int, default=8, help="worker线程数")
+    parser.add_argument("--cpu-core", type=int, default=4, help="判题服务器桩的cpu核数，槽位数为其2倍")
+    parser.add_argument("--same-code", action="store_true", help="所有提交使用相同的代码(测试判题结果缓存)")
+    parser.add_argument("--mode", nargs="+", choices=["sync", "async"], default=["sync"],
+                        help="判题模式，可以指定多个依次运行")
+    parser.add_argument("--max-inflight", type=int, default=settings.JUDGE_ASYNC_MAX_INFLIGHT,
+                        help="异步判题模式下每个进程同时进行的判题数")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    if connection.vendor == "sqlite":
+        # 内存数据库的共享缓存模式下并发写会直接报table is locked，改用临时文件；
+        # 事务一开始就获取写锁，避免读锁升级为写锁时直接失败
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+        connection.settings_dict["OPTIONS"].update(timeout=60, transaction_mode="IMMEDIATE")
+    old_name = connection.creation.create_test_db(verbosity=0)
+    counter = QueryCounter()
+    broker.add_middleware(counter)
+    try:
+        for mode in args.mode:
+            run(args, mode, counter)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+对比每次新建连接的requests.post和带连接池的JudgeServerClient访问判题服务器的单次请求开销
+
+python -m benchmarks.bench_judge_client -n 2000
+"""
+import argparse
+import os
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "SSEOJ.settings")
+django.setup()
+
+import requests  # noqa: E402
+
+from benchmarks.stub_judge_server import StubJudgeServer  # noqa: E402
+from judge.client import JudgeServerClient  # noqa: E402
+
+DATA = {"language_config": {}, "src": "int main() { return 0; }", "max_cpu_time": 1000,
+        "max_memory": 256 * 1024 * 1024, "test_case_id": "bench", "output": False}
+HEADERS = {"X-Judge-Server-Token": "bench"}
+
+
+def bench(name, func, url, n):
+    # 预热
+    for _ in range(10):
+        func(url)
+    start = time.perf_counter()
+    for _ in range(n):
+        func(url)
+    cost = (time.perf_counter() - start) / n * 1_000_000
+    print(f"{name:<20}{cost:>10.1f} us/request")
+    return cost
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=2000, help="number of requests")
+    args = parser.parse_args()
+
+    client = JudgeServerClient()
+    with StubJudgeServer() as server:
+        url = server.service_url + "/judge"
+        plain = bench("requests.post", lambda u: requests.post(u, headers=HEADERS, json=DATA).json(), url, args.n)
+        pooled = bench("JudgeServerClient", lambda u: client.post(u, headers=HEADERS, json=DATA), url, args.n)
+    client.close()
+    print(f"saved {plain - pooled:.1f} us/request ({(1 - pooled / plain) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+比较判题前准备请求数据的耗时：原来每次在SysConfigs.languages中线性查找语言，现在从LanguageRegistry中按名字取出预先生成的部分
+lookup只测量查找语言配置本身，prep为完整的JudgeDispatcher._judge_data(包含读取SysConfigs时检查配置版本号的开销)
+
+python -m benchmarks.bench_language_registry -n 100000
+"""
+import argparse
+import os
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "SSEOJ.settings")
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+
+from account.models import User  # noqa: E402
+from conf.conf import SysConfigs  # noqa: E402
+from judge.dispatcher import JudgeDispatcher  # noqa: E402
+from problem.models import Problem  # noqa: E402
+from submission.models import Submission  # noqa: E402
+
+
+def linear_judge_data(dispatcher):
+    """
+    改用LanguageRegistry之前的JudgeDispatcher._judge_data
+    """
+    language = dispatcher.submission.language
+    sub_config = list(filter(lambda item: language == item["name"], SysConfigs.languages))[0]
+    return {
+        "language_config": sub_config["config"],
+        "src": dispatcher.submission.code,
+        "max_cpu_time": dispatcher.problem.time_limit,
+        "max_memory": 1024 * 1024 * dispatcher.problem.memory_limit,
+        "test_case_id": dispatcher.problem.test_case_id,
+        "output": not dispatcher.fail_fast,
+        "fail_fast": dispatcher.fail_fast,
+    }
+
+
+def bench(func, arg, n):
+    for _ in range(100):
+        func(arg)
+    start = time.perf_counter()
+    for _ in range(n):
+        func(arg)
+    return (time.perf_counter() - start) / n * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=100000, help="number of iterations")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create_user(username="bench", email="bench@example.com", password="bench")
+        problem = Problem.objects.create(name="bench", description="", input_style="", output_style="",
+                                         sample={"input": [], "output": []}, difficulty=1, time_limit=1000,
+                                         memory_limit=256, test_case_id="bench")
+        languages = SysConfigs.languages
+        registry = SysConfigs.language_registry
+        print(f"{'':<12}{'lookup':>24}{'prep':>24}")
+        print(f"{'language':<12}{'linear':>12}{'registry':>12}{'linear':>12}{'registry':>12}")
+        for item in languages:
+            submission = Submission.objects.create(problem=problem, user_id=user.id, username=user.username,
+                                                   code="int main() { return 0; }\n", language=item["name"])
+            dispatcher = JudgeDispatcher(submission.id, problem.id)
+            assert linear_judge_data(dispatcher) == dispatcher._judge_data()
+            name = item["name"]
+            linear_lookup = bench(lambda n: list(filter(lambda x: n == x["name"], languages))[0]["config"], name,
+                                  args.n)
+            registry_lookup = bench(lambda n: registry[n].judge_payload, name, args.n)
+            linear_prep = bench(linear_judge_data, dispatcher, args.n)
+            registry_prep = bench(JudgeDispatcher._judge_data, dispatcher, args.n)
+            print(f"{name:<12}{linear_lookup:>9.2f} us{registry_lookup:>9.2f} us"
+                  f"{linear_prep:>9.2f} us{registry_prep:>9.2f} us")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+比较题库关键字检索的耗时：原来用name__icontains | description__icontains扫描整张题目表，现在查询进程内的倒排索引
+scan为原来ProblemsetAPI中的count加第一页查询，index为search_problems返回排序后的全部题目id；
+另外给出从数据库构建索引和保存一道题目后增量同步的耗时
+
+python -m benchmarks.bench_problem_search --sizes 10000 100000
+"""
+import argparse
+import os
+import random
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "SSEOJ.settings")
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.models import Q  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+
+from problem.models import Problem  # noqa: E402
+from problem.search import get_problem_search_index, search_problems  # noqa: E402
+
+CJK_WORDS = ["二叉树", "最短路", "动态规划", "字符串", "整数", "数组", "排序", "查询", "区间", "图", "节点", "边权",
+             "深度", "输出", "给定", "长度", "子序列", "最大值", "矩阵", "模拟"]
+ASCII_WORDS = ["tree", "graph", "path", "sum", "array", "query", "string", "integer", "matrix", "modulo",
+               "prime", "binary", "search", "segment", "output", "input"]
+QUERIES = ["二叉树", "最短路 graph", "树", "动态规划 matrix", "segment tre", "不存在的词"]
+# 题面中的其它词，和上面的词一起按Zipf分布出现
+FILLER_WORDS = ["".join(chr(0x4e00 + (i * 7919 + j * 104729) % 20000) for j in range(2 + i % 2)) for i in range(1500)] \
+    + [f"word{i}" for i in range(500)]
+VOCABULARY = CJK_WORDS + ASCII_WORDS + FILLER_WORDS
+WEIGHTS = [1 / (rank + 10) for rank in range(len(VOCABULARY))]
+
+
+def description(rng):
+    return "，".join(rng.choices(VOCABULARY, WEIGHTS, k=60))
+
+
+def bench(func, n):
+    func()
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - start) / n * 1000
+
+
+def scan(keyword):
+    problems = Problem.objects.filter(Q(name__icontains=keyword) | Q(description__icontains=keyword)).order_by("id")
+    problems.count()
+    list(problems[:10])
+
+
+def run(size, n):
+    rng = random.Random(size)
+    Problem.objects.all().delete()
+    Problem.objects.bulk_create([
+        Problem(name=f"P{i} {rng.choice(CJK_WORDS)}", description=description(rng), input_style="",
+                output_style="", sample={"input": [], "output": []}, difficulty=rng.randint(1, 4),
+                time_limit=1000, memory_limit=256) for i in range(size)], batch_size=2000)
+
+    cache.clear()
+    start = time.perf_counter()
+    get_problem_search_index()
+    build = time.perf_counter() - start
+
+    problem = Problem.objects.order_by("id").first()
+
+    def update():
+        problem.description = description(rng)
+        problem.save()
+        get_problem_search_index()
+
+    print(f"size={size}  build={build:.2f} s  update={bench(update, n):.2f} ms")
+    print(f"{'query':<16}{'matches':>10}{'scan':>14}{'index':>14}")
+    for query in QUERIES:
+        matches = len(search_problems(query))
+        # icontains只能匹配整个关键字，多个词的查询结果与索引不同，只比较耗时
+        scan_ms = bench(lambda: scan(query), n)
+        index_ms = bench(lambda: search_problems(query), n)
+        print(f"{query:<16}{matches:>10}{scan_ms:>11.2f} ms{index_ms:>11.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="number of problems")
+    parser.add_argument("-n", type=int, default=20, help="number of iterations")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        for size in args.sizes:
+            run(size, args.n)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+比较判题详情保存在Submission.info中和拆分到submission_test_case/submission_output之后的表大小以及读取完整提交行的耗时：
+在测试数据库中按旧格式写入N个提交，测量后执行submission的0005数据迁移，再测量一次
+
+python -m benchmarks.bench_submission_storage -n 2000 --test-cases 20 --output-size 200
+"""
+import argparse
+import hashlib
+import importlib
+import os
+import random
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "SSEOJ.settings")
+django.setup()
+
+from django.apps import apps  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+
+from account.models import User  # noqa: E402
+from problem.models import Problem  # noqa: E402
+from submission.models import Submission, SubmissionTestCase, SubmissionOutput  # noqa: E402
+
+TABLES = [Submission._meta.db_table, SubmissionTestCase._meta.db_table, SubmissionOutput._meta.db_table]
+
+
+def table_sizes():
+    """
+    返回{表名: 数据和索引占用的字节数}
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("VACUUM")
+            cursor.execute("SELECT m.tbl_name, SUM(s.pgsize) FROM dbstat s JOIN sqlite_master m ON s.name = m.name "
+                           "GROUP BY m.tbl_name")
+        else:
+            for table in TABLES:
+                cursor.execute(f"OPTIMIZE TABLE {table}")
+                cursor.fetchall()
+            cursor.execute("SELECT table_name, data_length + index_length FROM information_schema.tables "
+                           "WHERE table_schema = DATABASE()")
+        sizes = dict(cursor.fetchall())
+    return {table: sizes.get(table, 0) for table in TABLES}
+
+
+def load_time(repeat=3):
+    """
+    读取全部完整提交行的耗时(毫秒)，取多次中最快的一次
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        list(Submission.objects.all())
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def prepare(n, test_case_number, output_size):
+    user = User.objects.create_user(username="bench", email="bench@example.com", password="bench")
+    problem = Problem.objects.create(name="bench", description="", input_style="", output_style="",
+                                     sample={"input": [], "output": []}, difficulty=1, time_limit=1000,
+                                     memory_limit=256, test_case_id="bench")
+    submissions = []
+    for i in range(n):
+        data = []
+        for j in range(1, test_case_number + 1):
+            # 以数字为主的输出，接近真实题目的压缩率
+            output = " ".join(str(random.randint(0, 10 ** 9)) for _ in range(output_size // 10))[:output_size]
+            data.append({"test_case": str(j), "result": 0, "cpu_time": random.randint(0, 1000),
+                         "real_time": random.randint(0, 1000), "memory": random.randint(1, 256) * 1024 * 1024,
+                         "signal": 0, "exit_code": 0, "error": 0,
+                         "output_md5": hashlib.md5(output.encode("utf-8")).hexdigest(), "output": output})
+        submissions.append(Submission(id=f"bench-{i:08d}", problem=problem, user_id=user.id,
+                                      username=user.username, code="int main() { return 0; }\n" * 20,
+                                      language="C++", result=0, info={"err": None, "data": data},
+                                      statistic_info={"time_cost": 1000, "memory_cost": 1024}))
+    Submission.objects.bulk_create(submissions, batch_size=500)
+
+
+def report(title, sizes, elapsed):
+    print(title)
+    for table, size in sizes.items():
+        print(f"  {table:<24}{size / 1024:>12.1f} KB")
+    print(f"  {'total':<24}{sum(sizes.values()) / 1024:>12.1f} KB")
+    print(f"  load all submissions    {elapsed:>12.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=2000, help="提交数")
+    parser.add_argument("--test-cases", type=int, default=20, help="每个提交的测试点数")
+    parser.add_argument("--output-size", type=int, default=200, help="每个测试点的输出长度")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        prepare(args.n, args.test_cases, args.output_size)
+        report("before", table_sizes(), load_time())
+        start = time.perf_counter()
+        importlib.import_module("submission.migrations.0005_move_submission_info").split_info(apps, None)
+        print(f"migration: {time.perf_counter() - start:.1f} s")
+        report("after", table_sizes(), load_time())
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+测量TokenBucketThrottle每个请求的额外开销：匿名请求只检查ip桶，登录用户还要检查user桶
+桶的容量足够大，测量的是放行请求的路径，缓存使用settings中配置的后端
+
+python -m benchmarks.bench_throttling -n 20000
+"""
+import argparse
+import os
+import statistics
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "SSEOJ.settings")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import AnonymousUser  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+
+from account.models import User  # noqa: E402
+from conf.conf import SysConfigs  # noqa: E402
+from utils.throttling import TokenBucketThrottle  # noqa: E402
+
+BUDGET_US = 300
+
+
+def bench(name, request, n):
+    throttle = TokenBucketThrottle()
+    # 预热，同时让SysConfigs.throttling进入线程内的缓存
+    for _ in range(100):
+        throttle.allow_request(request, None)
+    costs = []
+    for _ in range(n):
+        start = time.perf_counter()
+        allowed = throttle.allow_request(request, None)
+        costs.append((time.perf_counter() - start) * 1_000_000)
+        assert allowed
+    costs.sort()
+    mean = statistics.fmean(costs)
+    p99 = costs[int(len(costs) * 0.99)]
+    print(f"{name:<12}mean {mean:>8.1f} us    p50 {costs[len(costs) // 2]:>8.1f} us    p99 {p99:>8.1f} us")
+    return p99
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=20000, help="number of requests")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        cache.clear()
+        capacity = args.n * 10
+        SysConfigs.throttling = {"ip": {"capacity": capacity, "fill_rate": 1, "default_capacity": capacity},
+                                 "user": {"capacity": capacity, "fill_rate": 1, "default_capacity": capacity}}
+        print(f"cache backend: {settings.CACHES['default']['BACKEND']}")
+
+        factory = RequestFactory()
+        anonymous = factory.post("/api/problem/submit/")
+        anonymous.user = AnonymousUser()
+        authenticated = factory.post("/api/problem/submit/")
+        authenticated.user = User.objects.create_user(username="bench", email="bench@example.com", password="bench")
+
+        worst = max(bench("anonymous", anonymous, args.n), bench("user", authenticated, args.n))
+        print(f"p99 {'within' if worst < BUDGET_US else 'over'} the {BUDGET_US} us budget")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+本地的判题服务器桩，实现了JudgeDispatcher使用的/judge接口，只用于压测，不会真正编译运行代码
+可以配置判题耗时、各种判题结果的比例以及请求失败的比例
+
+python -m benchmarks.stub_judge_server --port 12358 --latency 50 --verdicts 0:0.7,-1:0.2,1:0.1 --failure-rate 0.01
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ACCEPTED = 0
+COMPILE_ERROR = -2
+
+
+def parse_verdicts(value):
+    """
+    "0:0.7,-1:0.3" -> {0: 0.7, -1: 0.3}
+    """
+    verdicts = {}
+    for item in value.split(","):
+        result, weight = item.rsplit(":", 1)
+        verdicts[int(result)] = float(weight)
+    return verdicts
+
+
+class StubJudgeConfig:
+    def __init__(self, latency=0, jitter=0, verdicts=None, failure_rate=0, test_case_number=1):
+        # 每次判题的耗时(毫秒)，实际耗时在[latency - jitter, latency + jitter]之间均匀分布
+        self.latency = latency
+        self.jitter = jitter
+        # 判题结果及其比例，COMPILE_ERROR表示编译错误，其余结果作为第一个错误测试点的结果
+        self.verdicts = verdicts or {ACCEPTED: 1}
+        # 返回HTTP 500的比例，模拟判题服务器故障
+        self.failure_rate = failure_rate
+        self.test_case_number = test_case_number
+
+    def choose_verdict(self):
+        return random.choices(list(self.verdicts.keys()), weights=list(self.verdicts.values()))[0]
+
+
+class StubJudgeHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1才会保持连接
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，不关闭Nagle算法时keep-alive连接会遇到40ms的延迟确认
+    disable_nagle_algorithm = True
+
+    def _judge_response(self, data):
+        config = self.server.config
+        verdict = config.choose_verdict()
+        if verdict == COMPILE_ERROR:
+            return {"err": "CompileError", "data": "stub compile error"}
+        cases = []
+        skipped = []
+        for i in range(1, config.test_case_number + 1):
+            if data.get("fail_fast") and cases and cases[-1]["result"] != ACCEPTED:
+                # 快速失败模式下遇到错误的测试点之后不再运行
+                skipped.append(str(i))
+                continue
+            # 第一个测试点给出选中的结果，其余测试点通过
+            result = verdict if i == 1 else ACCEPTED
+            cases.append({"test_case": str(i), "result": result, "cpu_time": 1, "real_time": 1, "memory": 1024,
+                          "signal": 0, "exit_code": 0, "error": 0, "output_md5": "",
+                          "output": f"output {i}" if data.get("output") else None})
+        resp = {"err": None, "data": cases}
+        if data.get("fail_fast"):
+            resp["skipped"] = skipped
+        return resp
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = json.loads(self.rfile.read(length) or b"{}")
+        if self.path != "/judge":
+            self.send_error(404)
+            return
+        self.server.record(data)
+
+        config = self.server.config
+        if config.latency or config.jitter:
+            self.server.enter()
+            time.sleep(max(config.latency + random.uniform(-config.jitter, config.jitter), 0) / 1000)
+            self.server.leave()
+        if random.random() < config.failure_rate:
+            self.send_error(500)
+            return
+
+        body = json.dumps(self._judge_response(data)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, config):
+        super().__init__(address, handler)
+        self.config = config
+        self.lock = threading.Lock()
+        # (收到请求的时间, 请求数据)
+        self.received = []
+        # 同时在判题中的请求数及其峰值
+        self.active = 0
+        self.peak_active = 0
+
+    def record(self, data):
+        with self.lock:
+            self.received.append((time.perf_counter(), data))
+
+    def enter(self):
+        with self.lock:
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+
+
+class StubJudgeServer:
+    """
+    在后台线程中运行的判题服务器桩，port为0时由系统分配端口
+    """
+    def __init__(self, host="127.0.0.1", port=0, config=None, handler=StubJudgeHandler):
+        self.httpd = _HTTPServer((host, port), handler, config or StubJudgeConfig())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def service_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def received(self):
+        return self.httpd.received
+
+    @property
+    def peak_active(self):
+        return self.httpd.peak_active
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0, help="每次判题的耗时(毫秒)")
+    parser.add_argument("--jitter", type=float, default=0, help="判题耗时的抖动(毫秒)")
+    parser.add_argument("--verdicts", type=parse_verdicts, default={ACCEPTED: 1},
+                        help="判题结果及比例，如0:0.7,-1:0.2,-2:0.1")
+    parser.add_argument("--failure-rate", type=float, default=0, help="返回HTTP 500的比例")
+    parser.add_argument("--test-cases", type=int, default=1, help="每次判题返回的测试点数")
+
+
+def config_from_arguments(args):
+    return StubJudgeConfig(latency=args.latency, jitter=args.jitter, verdicts=args.verdicts,
+                           failure_rate=args.failure_rate, test_case_number=args.test_cases)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12358)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    with StubJudgeServer(args.host, args.port, config_from_arguments(args)) as server:
+        print(f"stub judge server listening on {server.service_url}")
+        server.thread.join()
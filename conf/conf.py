@@ -3,10 +3,16 @@ import os
 import threading
 import time
 
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
 from django.db import transaction, IntegrityError
 
+from utils.cache import VersionedSnapshots, bump_version
+from utils.constants import CacheKey
 from utils.shortcuts import rand_str
-from languages import languages
+from conf.language_registry import LanguageRegistry
+from conf.languages import languages
 from .models import SysConfigs as SysConfigsModel
 
 
@@ -84,9 +90,6 @@ class my_property:
         return self
 
 
-DEFAULT_SHORT_TTL = 2
-
-
 def default_token():
     token = os.environ.get("JUDGE_SERVER_TOKEN")
     return token if token else rand_str()
@@ -103,6 +106,8 @@ class ConfigKeys:
     judge_server_token = "judge_server_token"
     throttling = "throttling"
     languages = "languages"
+    judge_server_routing = "judge_server_routing"
+    judge_admission = "judge_admission"
 
 
 class ConfigDefaultValue:
@@ -114,12 +119,37 @@ class ConfigDefaultValue:
     submission_list_show_all = True
     smtp_config = {}
     judge_server_token = default_token
+    # 令牌桶限流，capacity为桶的容量，fill_rate为每秒生成的令牌数，default_capacity为新建的桶中的令牌数，见utils.throttling
     throttling = {"ip": {"capacity": 100, "fill_rate": 0.1, "default_capacity": 50},
                   "user": {"capacity": 20, "fill_rate": 0.03, "default_capacity": 10}}
     languages = languages
+    # 判题服务器路由策略，可选值见judge.routing
+    judge_server_routing = "least_loaded"
+    # 提交的准入控制：单个用户和全站进行中的提交数上限，被拒绝时建议客户端等待的秒数
+    judge_admission = {"user_inflight": 5, "global_inflight": 2000, "retry_after": 5}
+
+
+# 缓存只在进程内有效时(LocMemCache、DummyCache)，其它进程修改配置不会改变当前进程看到的版本号，
+# 快照最多使用这么多秒后重新加载
+LOCAL_CACHE_SNAPSHOT_TTL = 5
+
+
+class _ConfigSnapshot:
+    def __init__(self, values):
+        self.values = values
+        self.derived = {}
+
+
+_snapshots = VersionedSnapshots()
 
 
 class _SysConfigsMeta(type):
+    """
+    配置的读取：每个进程保存一份全部配置的快照，一次查询加载；缓存中保存一个版本号，
+    每次读取只比较版本号，修改配置时更新版本号，所有进程在下一次读取时重新加载。
+    缓存不是多进程共享的时候版本号只在进程内有效，快照另外在LOCAL_CACHE_SNAPSHOT_TTL秒后过期。
+    返回的dict/list是快照中的对象，调用方不能修改
+    """
     @classmethod
     def _get_keys(cls):
         return [key for key in ConfigKeys.__dict__ if not key.startswith("__")]
@@ -137,14 +167,38 @@ class _SysConfigsMeta(type):
                     pass
 
     @classmethod
-    def _get_option(mcs, option_key):
-        try:
-            option = SysConfigsModel.objects.get(key=option_key)
-            value = option.value
-            return value
-        except SysConfigsModel.DoesNotExist:
+    def _bump_version(mcs):
+        bump_version([CacheKey.sys_configs_version])
+
+    @classmethod
+    def _load_snapshot(mcs):
+        values = dict(SysConfigsModel.objects.values_list("key", "value"))
+        if any(key not in values for key in mcs._get_keys()):
             mcs._init_option()
-            return mcs._get_option(option_key)
+            values = dict(SysConfigsModel.objects.values_list("key", "value"))
+        return _ConfigSnapshot(values)
+
+    @classmethod
+    def _snapshot(mcs):
+        """
+        返回当前进程中全部配置的快照，版本号与缓存中的一致时不访问数据库
+        """
+        max_age = LOCAL_CACHE_SNAPSHOT_TTL if isinstance(caches["default"], (LocMemCache, DummyCache)) else None
+        return _snapshots.get(None, CacheKey.sys_configs_version, mcs._load_snapshot, max_age)
+
+    @classmethod
+    def _get_option(mcs, option_key):
+        return mcs._snapshot().values[option_key]
+
+    @classmethod
+    def _derived(mcs, name, func):
+        """
+        由配置计算出的值(如语言的索引)，与快照一起缓存，配置修改后重新计算
+        """
+        derived = mcs._snapshot().derived
+        if name not in derived:
+            derived[name] = func()
+        return derived[name]
 
     @classmethod
     def _set_option(mcs, option_key: str, option_value):
@@ -156,6 +210,8 @@ class _SysConfigsMeta(type):
         except SysConfigsModel.DoesNotExist:
             mcs._init_option()
             mcs._set_option(option_key, option_value)
+        # 外层事务提交前就已经重新加载的进程，在事务提交后再更新一次版本号
+        mcs._bump_version()
 
     @classmethod
     def _increment(mcs, option_key):
@@ -168,6 +224,7 @@ class _SysConfigsMeta(type):
         except SysConfigsModel.DoesNotExist:
             mcs._init_option()
             return mcs._increment(option_key)
+        mcs._bump_version()
 
     @classmethod
     def set_options(mcs, options):
@@ -176,12 +233,10 @@ class _SysConfigsMeta(type):
 
     @classmethod
     def get_options(mcs, keys):
-        result = {}
-        for key in keys:
-            result[key] = mcs._get_option(key)
-        return result
+        values = mcs._snapshot().values
+        return {key: values[key] for key in keys}
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_base_url(cls):
         return cls._get_option(ConfigKeys.website_base_url)
 
@@ -189,7 +244,7 @@ class _SysConfigsMeta(type):
     def website_base_url(cls, value):
         cls._set_option(ConfigKeys.website_base_url, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_name(cls):
         return cls._get_option(ConfigKeys.website_name)
 
@@ -197,7 +252,7 @@ class _SysConfigsMeta(type):
     def website_name(cls, value):
         cls._set_option(ConfigKeys.website_name, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_name_shortcut(cls):
         return cls._get_option(ConfigKeys.website_name_shortcut)
 
@@ -205,7 +260,7 @@ class _SysConfigsMeta(type):
     def website_name_shortcut(cls, value):
         cls._set_option(ConfigKeys.website_name_shortcut, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_footer(cls):
         return cls._get_option(ConfigKeys.website_footer)
 
@@ -221,7 +276,7 @@ class _SysConfigsMeta(type):
     def allow_register(cls, value):
         cls._set_option(ConfigKeys.allow_register, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def submission_list_show_all(cls):
         return cls._get_option(ConfigKeys.submission_list_show_all)
 
@@ -253,7 +308,7 @@ class _SysConfigsMeta(type):
     def throttling(cls, value):
         cls._set_option(ConfigKeys.throttling, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def languages(cls):
         return cls._get_option(ConfigKeys.languages)
 
@@ -261,17 +316,41 @@ class _SysConfigsMeta(type):
     def languages(cls, value):
         cls._set_option(ConfigKeys.languages, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
+    def judge_server_routing(cls):
+        return cls._get_option(ConfigKeys.judge_server_routing)
+
+    @judge_server_routing.setter
+    def judge_server_routing(cls, value):
+        cls._set_option(ConfigKeys.judge_server_routing, value)
+
+    @my_property
+    def judge_admission(cls):
+        return cls._get_option(ConfigKeys.judge_admission)
+
+    @judge_admission.setter
+    def judge_admission(cls, value):
+        cls._set_option(ConfigKeys.judge_admission, value)
+
+    @my_property
+    def language_registry(cls):
+        """
+        按语言名索引的只读语言配置，见conf.language_registry
+        """
+        return cls._derived("language_registry", lambda: LanguageRegistry.build(cls.languages))
+
+    @my_property
     def spj_languages(cls):
-        return [item for item in cls.languages if "spj" in item]
+        return cls.language_registry.spj_languages
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def language_names(cls):
-        return [item["name"] for item in cls.languages]
+        # 集合，提交时校验语言是O(1)的
+        return cls.language_registry.names
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def spj_language_names(cls):
-        return [item["name"] for item in cls.languages if "spj" in item]
+        return cls.language_registry.spj_names
 
     def reset_languages(cls):
         cls.languages = languages
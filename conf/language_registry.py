@@ -0,0 +1,59 @@
+import threading
+from types import MappingProxyType
+
+
+class Language:
+    """
+    一种编程语言的配置，judge_payload是判题请求中只与语言有关的部分，构建时生成，每次判题直接合并
+    """
+    __slots__ = ("name", "description", "content_type", "config", "spj", "judge_payload")
+
+    def __init__(self, item):
+        self.name = item["name"]
+        self.description = item.get("description", "")
+        self.content_type = item.get("content_type", "")
+        self.config = item["config"]
+        self.spj = item.get("spj")
+        self.judge_payload = MappingProxyType({"language_config": self.config})
+
+
+class LanguageRegistry:
+    """
+    SysConfigs.languages按语言名建立的只读索引，查找语言是O(1)的
+    只由SysConfigs.language_registry通过build创建，languages配置不变时复用同一个对象
+    """
+    def __init__(self, languages):
+        self.source = languages
+        self.languages = tuple(Language(item) for item in languages)
+        self._by_name = MappingProxyType({language.name: language for language in self.languages})
+        self.names = frozenset(self._by_name)
+        self.spj_languages = tuple(item for item in languages if "spj" in item)
+        self.spj_names = tuple(language.name for language in self.languages if language.spj)
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def get(self, name, default=None):
+        return self._by_name.get(name, default)
+
+    def __iter__(self):
+        return iter(self.languages)
+
+    def __len__(self):
+        return len(self.languages)
+
+    _last = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def build(cls, languages):
+        """
+        其它配置修改时SysConfigs的快照也会重新加载，languages的内容没有变化时返回上一次构建的对象
+        """
+        with cls._lock:
+            if cls._last is None or cls._last.source != languages:
+                cls._last = cls(languages)
+            return cls._last
@@ -1,3 +1,137 @@
+import hashlib
+import time
+from unittest import mock
+
+import dramatiq
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from dramatiq.brokers.stub import StubBroker
+
+from conf.conf import SysConfigs, ConfigKeys, LOCAL_CACHE_SNAPSHOT_TTL
+from conf.models import SysConfigs as SysConfigsModel
+from judge.models import JudgeServer, PendingTask
+from utils.constants import CacheKey
+
+dramatiq.set_broker(StubBroker())
+
+
+class JudgeServerHeartbeatTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.data = {"hostname": "judger", "judger_version": "2.0.0", "cpu_core": 2, "memory": 10.0, "cpu": 5.0,
+                     "action": "heartbeat", "service_url": "http://judger:8080"}
+        self.token = hashlib.sha256(SysConfigs.judge_server_token.encode("utf-8")).hexdigest()
+
+    def heartbeat(self, token):
+        return self.client.post(reverse("judge_server_heartbeat_api"), self.data, content_type="application/json",
+                                HTTP_X_JUDGE_SERVER_TOKEN=token).data
+
+    def test_invalid_token(self):
+        self.assertEqual(self.heartbeat("invalid")["msg"], "Invalid token")
+        # 先验证token，再验证数据
+        self.data.pop("hostname")
+        self.assertEqual(self.heartbeat("invalid")["msg"], "Invalid token")
+        self.assertFalse(JudgeServer.objects.exists())
+
+    def test_validated_data(self):
+        """
+        注册表使用验证后的数据，忽略未声明的字段
+        """
+        self.data.update(cpu_core="4", is_disabled=True)
+        with mock.patch("conf.views.JudgeServerRegistry.heartbeat") as heartbeat:
+            self.heartbeat(self.token)
+        data = heartbeat.call_args.args[0]
+        self.assertEqual(data["cpu_core"], 4)
+        self.assertNotIn("is_disabled", data)
+
+    def test_heartbeat(self):
+        self.assertEqual(self.heartbeat(self.token), {"err": None, "data": "success"})
+        server = JudgeServer.objects.get(hostname="judger")
+        self.assertEqual(server.cpu_core, 2)
+        self.assertEqual(server.status, "normal")
+
+    def test_new_server_drains_pending_queue(self):
+        """
+        新的判题服务器上线后立即处理等待队列中的任务
+        """
+        from judge.tasks import judge_task
+        queue = judge_task.broker.queues[judge_task.queue_name]
+        PendingTask.objects.create(submission_id="a", problem_id=1)
+        self.heartbeat(self.token)
+        self.assertFalse(PendingTask.objects.exists())
+        self.assertEqual(queue.qsize(), 1)
+
+
+class SysConfigsSnapshotTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_no_query_when_unchanged(self):
+        # 第一次读取时插入默认配置
+        SysConfigs.website_name
+        cache.clear()
+        # 一次查询加载全部配置
+        with self.assertNumQueries(1):
+            SysConfigs.get_options([ConfigKeys.website_name, ConfigKeys.throttling, ConfigKeys.languages])
+        with self.assertNumQueries(0):
+            SysConfigs.website_name
+            SysConfigs.language_names
+            SysConfigs.judge_admission
+
+    def test_set_option(self):
+        SysConfigs.website_name = "SSEOJ"
+        self.assertEqual(SysConfigs.website_name, "SSEOJ")
+        self.assertEqual(SysConfigs.get_options([ConfigKeys.website_name]), {ConfigKeys.website_name: "SSEOJ"})
+
+    def test_other_process(self):
+        """
+        其它进程修改配置后更新了版本号，当前进程在下一次读取时重新加载
+        """
+        SysConfigs.website_name = "a"
+        self.assertEqual(SysConfigs.website_name, "a")
+        SysConfigsModel.objects.filter(key=ConfigKeys.website_name).update(value="b")
+        self.assertEqual(SysConfigs.website_name, "a")
+        cache.set(CacheKey.sys_configs_version, "other", timeout=None)
+        self.assertEqual(SysConfigs.website_name, "b")
+
+    def test_process_local_cache(self):
+        """
+        缓存只在进程内有效时，其它进程的修改在快照过期后读到
+        """
+        SysConfigs.website_name = "a"
+        self.assertEqual(SysConfigs.website_name, "a")
+        SysConfigsModel.objects.filter(key=ConfigKeys.website_name).update(value="b")
+        self.assertEqual(SysConfigs.website_name, "a")
+        with mock.patch("conf.conf.time.monotonic", return_value=time.monotonic() + LOCAL_CACHE_SNAPSHOT_TTL + 1):
+            self.assertEqual(SysConfigs.website_name, "b")
+
+    def test_derived(self):
+        self.assertIn("C++", SysConfigs.language_names)
+        SysConfigs.languages = [item for item in SysConfigs.languages if item["name"] != "C++"]
+        self.assertNotIn("C++", SysConfigs.language_names)
+        SysConfigs.reset_languages()
+        self.assertIn("C++", SysConfigs.language_names)
+
+
+class LanguageRegistryTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_lookup(self):
+        registry = SysConfigs.language_registry
+        self.assertIn("C++", registry)
+        self.assertIsNone(registry.get("Brainfuck"))
+        cpp = next(item for item in SysConfigs.languages if item["name"] == "C++")
+        self.assertEqual(dict(registry["C++"].judge_payload), {"language_config": cpp["config"]})
+        self.assertEqual(SysConfigs.language_names, {item["name"] for item in SysConfigs.languages})
+        self.assertEqual(set(SysConfigs.spj_language_names), {"C", "C++"})
+
+    def test_rebuild_only_when_languages_change(self):
+        registry = SysConfigs.language_registry
+        SysConfigs.website_name = "SSEOJ"
+        self.assertIs(SysConfigs.language_registry, registry)
 
-# Create your tests here.
+        SysConfigs.languages = [item for item in SysConfigs.languages if item["name"] != "Java"]
+        self.assertIsNot(SysConfigs.language_registry, registry)
+        self.assertNotIn("Java", SysConfigs.language_registry)
@@ -1,41 +1,35 @@
 import hashlib
 
-from django.shortcuts import render
 from rest_framework.views import APIView
 
+from conf.conf import SysConfigs
 from conf.serializers import JudgeServerHeartbeatSerializer
-from utils.api import validate_serializer, success
+from judge.counters import ProblemCounters
+from judge.dispatcher import process_pending_task
+from judge.leases import JudgeLeases
+from judge.registry import JudgeServerRegistry
+from utils.api import validate_serializer, success, fail
 
 
 class JudgeServerHeartbeatAPI(APIView):
-    # @validate_serializer(JudgeServerHeartbeatSerializer)
     def post(self, request):
-        # data = request.data
-        # client_token = request.META.get("HTTP_X_JUDGE_SERVER_TOKEN")
-        # if hashlib.sha256(SysOptions.judge_server_token.encode("utf-8")).hexdigest() != client_token:
-        #     return self.error("Invalid token")
-        #
-        # try:
-        #     server = JudgeServer.objects.get(hostname=data["hostname"])
-        #     server.judger_version = data["judger_version"]
-        #     server.cpu_core = data["cpu_core"]
-        #     server.memory_usage = data["memory"]
-        #     server.cpu_usage = data["cpu"]
-        #     server.service_url = data["service_url"]
-        #     server.ip = request.ip
-        #     server.last_heartbeat = timezone.now()
-        #     server.save(update_fields=["judger_version", "cpu_core", "memory_usage", "service_url", "ip", "last_heartbeat"])
-        # except JudgeServer.DoesNotExist:
-        #     JudgeServer.objects.create(hostname=data["hostname"],
-        #                                judger_version=data["judger_version"],
-        #                                cpu_core=data["cpu_core"],
-        #                                memory_usage=data["memory"],
-        #                                cpu_usage=data["cpu"],
-        #                                ip=request.META["REMOTE_ADDR"],
-        #                                service_url=data["service_url"],
-        #                                last_heartbeat=timezone.now(),
-        #                                )
-        # # 新server上线 处理队列中的，防止没有新的提交而导致一直waiting
-        # process_pending_task()
+        """
+        判题服务器定时发送的心跳，只更新注册表，注册表再批量写回数据库
+        """
+        # 先验证token，未授权的请求不需要验证数据
+        client_token = request.META.get("HTTP_X_JUDGE_SERVER_TOKEN")
+        if hashlib.sha256(SysConfigs.judge_server_token.encode("utf-8")).hexdigest() != client_token:
+            return fail("Invalid token")
+        return self.heartbeat(request)
+
+    @validate_serializer(JudgeServerHeartbeatSerializer)
+    def heartbeat(self, request):
+        JudgeServerRegistry.heartbeat(request.validated_data, request.META.get("REMOTE_ADDR"))
+        # 新server上线或有槽位空出 处理队列中的，防止没有新的提交而导致一直waiting
+        process_pending_task()
+        # 定期合并判题产生的题目计数器增量
+        ProblemCounters.schedule_flush()
+        # 定期重新投递异步判题模式下丢失的判题
+        JudgeLeases.schedule_sweep()
 
         return success("success")
@@ -0,0 +1,79 @@
+from django.core.cache import cache
+
+from conf.conf import SysConfigs
+from utils.cache import incr_or_init
+from utils.constants import CacheKey
+
+# 与judge_task的max_age一致，超过这个时间还没有判完的提交视为已经丢失
+ADMISSION_TTL = 2 * 60 * 60
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, msg, retry_after):
+        super().__init__(msg)
+        self.msg = msg
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    提交时的准入控制，限制单个用户以及全站进行中(已提交但还没有判完)的提交数
+    1. 进行中的提交数保存在缓存的原子计数器中，admit时加一，超过SysConfigs.judge_admission中的上限时撤销并拒绝
+    2. 每个被准入的提交在缓存中记录一个令牌，判题结束时release删除令牌并减一；
+       只有删除令牌成功的一方会减一，重判、重复投递或重复release都不会多减
+    3. 令牌和计数器在最后一次准入ADMISSION_TTL秒后过期，worker崩溃等原因没有release的提交不会永久占用名额
+    """
+    @staticmethod
+    def _user_key(user_id):
+        return f"{CacheKey.judge_inflight}:user:{user_id}"
+
+    @staticmethod
+    def _token_key(submission_id):
+        return f"{CacheKey.judge_inflight}:submission:{submission_id}"
+
+    @staticmethod
+    def _decr(key):
+        try:
+            if cache.decr(key) < 0:
+                # 计数器过期后重建，旧提交的release不能让它变成负数
+                cache.incr(key)
+        except ValueError:
+            pass
+
+    @classmethod
+    def admit(cls, submission_id, user_id):
+        """
+        为提交占用一个名额，超过上限时抛出AdmissionRejected
+        """
+        limits = SysConfigs.judge_admission
+        user_key = cls._user_key(user_id)
+        if incr_or_init(user_key, timeout=ADMISSION_TTL) > limits["user_inflight"]:
+            cls._decr(user_key)
+            raise AdmissionRejected("您还有未判完的提交，请稍后再试！", limits["retry_after"])
+        if incr_or_init(CacheKey.judge_inflight, timeout=ADMISSION_TTL) > limits["global_inflight"]:
+            cls._decr(CacheKey.judge_inflight)
+            cls._decr(user_key)
+            raise AdmissionRejected("判题队列繁忙，请稍后再试！", limits["retry_after"])
+        # 只有准入成功才延长计数器的过期时间，被拒绝的请求不会让卡住的计数器一直不过期
+        cache.touch(user_key, ADMISSION_TTL)
+        cache.touch(CacheKey.judge_inflight, ADMISSION_TTL)
+        cache.set(cls._token_key(submission_id), user_id, timeout=ADMISSION_TTL)
+
+    @classmethod
+    def release(cls, submission_id):
+        """
+        提交判题结束(或放弃判题)时释放名额，没有被准入的提交直接忽略
+        """
+        key = cls._token_key(submission_id)
+        user_id = cache.get(key)
+        if user_id is None or not cache.delete(key):
+            return
+        cls._decr(cls._user_key(user_id))
+        cls._decr(CacheKey.judge_inflight)
+
+    @classmethod
+    def inflight(cls, user_id=None):
+        """
+        返回用户或全站(user_id为None)进行中的提交数
+        """
+        return cache.get(CacheKey.judge_inflight if user_id is None else cls._user_key(user_id), 0)
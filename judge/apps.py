@@ -0,0 +1,14 @@
+import dramatiq
+from django.apps import AppConfig
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class JudgeConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'judge'
+
+    def ready(self):
+        # 必须在定义actor(引入judge.tasks)之前设置broker，否则dramatiq会按默认参数创建RedisBroker
+        broker = settings.DRAMATIQ_BROKER
+        dramatiq.set_broker(import_string(broker["BROKER"])(**broker.get("OPTIONS", {})))
@@ -0,0 +1,157 @@
+import asyncio
+import atexit
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from judge.admission import AdmissionController
+from judge.client import AsyncJudgeServerClient
+from judge.dispatcher import JudgeDispatcher, ChooseJudgeServer
+from judge.leases import JudgeLeases
+from judge.routing import JudgeLatencyTracker
+from judge.verdict_cache import VerdictCache
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncJudgeDispatcher(JudgeDispatcher):
+    """
+    判题流程与JudgeDispatcher.judge相同，只是等待判题服务器时不占用线程；
+    数据库和缓存操作都通过run_sync在线程池中执行
+    """
+    async def ajudge(self, client, run_sync):
+        if await run_sync(self._skip):
+            return
+        resp = await run_sync(self._cached_result)
+        if resp is None:
+            chooser = ChooseJudgeServer(self.problem.test_case_id)
+            server = await run_sync(chooser.__enter__)
+            try:
+                if not server:
+                    await run_sync(self._push_pending)
+                    return
+                await run_sync(self._mark_judging)
+                data = await run_sync(self._judge_data)
+                start = time.monotonic()
+                resp = await client.post(urljoin(server.service_url, "/judge"),
+                                         headers={"X-Judge-Server-Token": self.token}, json=data)
+                await run_sync(JudgeLatencyTracker.observe, server.id, time.monotonic() - start, failed=not resp)
+            finally:
+                await run_sync(chooser.__exit__, None, None, None)
+
+            if not resp:
+                await run_sync(self._mark_system_error)
+                return
+            await run_sync(VerdictCache.set, self._verdict_cache_key(), resp)
+        await run_sync(self._save_result, resp)
+
+
+class AsyncJudgeRunner:
+    """
+    worker进程内执行异步判题的事件循环
+    1. judge_task把判题交给事件循环后立即返回，worker线程可以继续处理下一个消息
+    2. 进行中的判题数达到max_inflight时submit会阻塞，压力反馈到dramatiq的worker线程上
+    3. 数据库操作在db_threads个线程的线程池中执行，每个线程保持自己的数据库连接，超过conn_max_age秒或出错后
+       不可用时才在执行前后关闭，不影响web进程的CONN_MAX_AGE
+    4. 消息在submit返回时就被确认(至多一次)，确认前在数据库中写入租约，判题结束时删除；
+       进程退出时丢失的判题由JudgeLeases.sweep在租约过期后重新投递
+    """
+    def __init__(self, max_inflight, db_threads, conn_max_age=0):
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(db_threads, thread_name_prefix="judge-db",
+                                           initializer=self._init_db_thread, initargs=(conn_max_age,))
+        self.loop = asyncio.new_event_loop()
+        # aiohttp的session需要在事件循环中创建
+        self.client = None
+        self.thread = threading.Thread(target=self.loop.run_forever, name="judge-loop", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _init_db_thread(conn_max_age):
+        # 每个线程的连接对象独立，复制一份配置只修改这些线程的连接时长；复用连接前先检查是否可用
+        connection.settings_dict = {**connection.settings_dict, "CONN_MAX_AGE": conn_max_age,
+                                    "CONN_HEALTH_CHECKS": True}
+
+    @staticmethod
+    def _call(func, *args, **kwargs):
+        # 线程池中的线程不经过请求或消息的生命周期，需要自己清理数据库连接
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    async def run_sync(self, func, *args, **kwargs):
+        return await self.loop.run_in_executor(self.executor, functools.partial(self._call, func, *args, **kwargs))
+
+    async def _judge(self, submission_id, problem_id, priority, **options):
+        try:
+            dispatcher = await self.run_sync(AsyncJudgeDispatcher, submission_id, problem_id, priority, **options)
+            if self.client is None:
+                self.client = AsyncJudgeServerClient()
+            await dispatcher.ajudge(self.client, self.run_sync)
+        except Exception:
+            logger.exception(f"Async judge of submission {submission_id} failed")
+            await self.run_sync(AdmissionController.release, submission_id)
+        await self.run_sync(JudgeLeases.release, submission_id)
+
+    def _done(self, future):
+        with self.condition:
+            self.inflight -= 1
+            self.condition.notify_all()
+
+    def submit(self, submission_id, problem_id, priority, **options):
+        with self.condition:
+            self.condition.wait_for(lambda: self.inflight < self.max_inflight)
+            self.inflight += 1
+        try:
+            JudgeLeases.acquire(submission_id, problem_id, priority, **options)
+        except Exception:
+            self._done(None)
+            AdmissionController.release(submission_id)
+            raise
+        future = asyncio.run_coroutine_threadsafe(self._judge(submission_id, problem_id, priority, **options),
+                                                  self.loop)
+        future.add_done_callback(self._done)
+        return future
+
+    def join(self, timeout=None):
+        """
+        等待所有进行中的判题结束，超时返回False
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.inflight, timeout)
+
+    def close(self, timeout=None):
+        self.join(timeout)
+        if self.client:
+            asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown()
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_async_judge_runner():
+    """
+    获取当前worker进程的AsyncJudgeRunner，进程退出前等待进行中的判题结束
+    """
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = AsyncJudgeRunner(settings.JUDGE_ASYNC_MAX_INFLIGHT, settings.JUDGE_ASYNC_DB_THREADS,
+                                           settings.JUDGE_ASYNC_CONN_MAX_AGE)
+                atexit.register(_runner.close, settings.JUDGE_SERVER_READ_TIMEOUT)
+    return _runner
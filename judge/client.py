@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import threading
+
+import aiohttp
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+class JudgeServerClient:
+    """
+    访问判题服务器的HTTP客户端
+    1. 复用同一个requests.Session，urllib3按service_url的host分别维护keep-alive连接池，避免每次判题都重新建立TCP连接
+    2. 设置了连接超时和读超时，判题服务器卡死时不会一直占用worker
+    3. 只对连接阶段的错误进行有限次数的重试，请求已经发出后不再重试，避免同一份代码被重复判题
+    """
+    def __init__(self, connect_timeout=None, read_timeout=None, max_retries=None, pool_size=None):
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else settings.JUDGE_SERVER_CONNECT_TIMEOUT,
+            read_timeout if read_timeout is not None else settings.JUDGE_SERVER_READ_TIMEOUT,
+        )
+        max_retries = max_retries if max_retries is not None else settings.JUDGE_SERVER_MAX_RETRIES
+        pool_size = pool_size if pool_size is not None else settings.JUDGE_SERVER_POOL_SIZE
+
+        retry = Retry(total=max_retries, connect=max_retries, read=0, status=0, other=0,
+                      allowed_methods=None, backoff_factor=0.1)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, url, headers=None, json=None):
+        """
+        返回判题服务器响应的json数据，请求失败或响应无法解析时返回None
+        """
+        try:
+            resp = self.session.post(url, headers=headers, json=json, timeout=self.timeout)
+            return resp.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Request to judge server {url} failed: {e}")
+            return None
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncJudgeServerClient:
+    """
+    JudgeServerClient的asyncio版本，供异步判题模式使用，一个事件循环中可以同时保持大量进行中的判题请求。
+    超时和重试的规则与JudgeServerClient相同，必须在所属的事件循环中创建和使用
+    """
+    def __init__(self, connect_timeout=None, read_timeout=None, max_retries=None):
+        self.timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout if connect_timeout is not None else settings.JUDGE_SERVER_CONNECT_TIMEOUT,
+            sock_read=read_timeout if read_timeout is not None else settings.JUDGE_SERVER_READ_TIMEOUT,
+        )
+        self.max_retries = max_retries if max_retries is not None else settings.JUDGE_SERVER_MAX_RETRIES
+        # 不限制连接数，每个判题服务器上同时进行的请求数已经由判题槽位限制
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=self.timeout)
+
+    async def post(self, url, headers=None, json=None):
+        """
+        返回判题服务器响应的json数据，请求失败或响应无法解析时返回None
+        """
+        for retry in range(self.max_retries + 1):
+            try:
+                async with self.session.post(url, headers=headers, json=json) as resp:
+                    return await resp.json(content_type=None)
+            except aiohttp.ClientConnectorError as e:
+                if retry < self.max_retries:
+                    await asyncio.sleep(0.1 * 2 ** retry)
+                    continue
+                logger.error(f"Request to judge server {url} failed: {e}")
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.error(f"Request to judge server {url} failed: {e}")
+            return None
+
+    async def close(self):
+        await self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_judge_client():
+    """
+    获取当前worker进程共享的JudgeServerClient，第一次使用时才创建，避免fork之前创建的连接被多个进程共用
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = JudgeServerClient()
+    return _client
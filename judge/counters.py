@@ -0,0 +1,87 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Case, When, Value
+
+from judge.models import ProblemCounterDelta
+from problem.models import Problem
+from problem.user_status import invalidate_user_problem_status
+from submission.models import Submission, JudgeStatus
+from utils.constants import CacheKey
+
+# 计数器增量最多隔多少秒合并一次
+FLUSH_INTERVAL = 5
+# 每个事务最多合并的增量数
+FLUSH_BATCH_SIZE = 1000
+
+
+class ProblemCounters:
+    """
+    题目的attempt_cnt、pass_cnt和pass_users的写后合并
+    1. 判题结束时只向problem_counter_delta追加一行增量，不对problem行加锁，热门题目的判题不会排队等同一个行锁
+    2. flush在一个事务中取出一批增量，每个计数字段用一条UPDATE ... CASE合并，再删除这些增量；
+       进程在任何时候退出都不会丢失或重复计数，合并完成后计数器是精确的
+    3. 计数器最多延迟FLUSH_INTERVAL秒，由判题服务器的心跳触发合并
+    """
+    @staticmethod
+    def record(problem_id, user_id, attempt=0, passed=0):
+        ProblemCounterDelta.objects.create(problem_id=problem_id, user_id=user_id, attempt=attempt, passed=passed)
+
+    @staticmethod
+    def _sum_case(totals, index):
+        return Case(*[When(id=problem_id, then=Value(total[index])) for problem_id, total in totals.items()],
+                    default=Value(0))
+
+    @classmethod
+    def flush(cls, batch_size=FLUSH_BATCH_SIZE):
+        """
+        合并一批增量，返回合并的增量数
+        """
+        with transaction.atomic():
+            deltas = list(ProblemCounterDelta.objects.select_for_update(skip_locked=True)
+                          .order_by("id")[:batch_size])
+            if not deltas:
+                return 0
+
+            totals = {}
+            pairs = set()
+            for delta in deltas:
+                total = totals.setdefault(delta.problem_id, [0, 0])
+                total[0] += delta.attempt
+                total[1] += delta.passed
+                if delta.passed:
+                    pairs.add((delta.problem_id, delta.user_id))
+            Problem.objects.filter(id__in=totals.keys()).update(
+                attempt_cnt=F("attempt_cnt") + cls._sum_case(totals, 0),
+                pass_cnt=F("pass_cnt") + cls._sum_case(totals, 1))
+
+            if pairs:
+                # 通过状态改变过的用户按提交记录重新判断是否通过，同一批中先通过后被重判为不通过也能得到正确结果
+                problem_ids = {problem_id for problem_id, _ in pairs}
+                user_ids = {user_id for _, user_id in pairs}
+                accepted = set(Submission.objects.filter(problem_id__in=problem_ids, user_id__in=user_ids,
+                                                         result=JudgeStatus.ACCEPTED)
+                               .order_by().values_list("problem_id", "user_id").distinct())
+                PassUsers = Problem.pass_users.through
+                PassUsers.objects.bulk_create([PassUsers(problem_id=problem_id, user_id=user_id)
+                                               for problem_id, user_id in pairs & accepted], ignore_conflicts=True)
+                for problem_id, user_id in pairs - accepted:
+                    PassUsers.objects.filter(problem_id=problem_id, user_id=user_id).delete()
+                invalidate_user_problem_status(user_ids)
+
+            ProblemCounterDelta.objects.filter(id__in=[delta.id for delta in deltas]).delete()
+        return len(deltas)
+
+    @classmethod
+    def flush_all(cls):
+        while cls.flush() == FLUSH_BATCH_SIZE:
+            pass
+
+    @staticmethod
+    def schedule_flush():
+        """
+        每FLUSH_INTERVAL秒最多投递一次合并任务
+        """
+        if cache.add(CacheKey.problem_counter_flush_lock, 1, timeout=FLUSH_INTERVAL):
+            # 防止循环引入
+            from judge.tasks import flush_problem_counters_task
+            flush_problem_counters_task.send()
@@ -1,52 +1,68 @@
 import hashlib
-import json
+import time
 from urllib.parse import urljoin
 
-import requests
-from django.core.cache import cache
-from django.db import transaction
-from django.db.models import F
+from django.db import transaction, IntegrityError
+from django.db.models import Exists, OuterRef
 
+from account.models import User
 from conf.conf import SysConfigs
-from judge.models import JudgeServer
-from problem.models import Problem
-from submission.models import Submission, JudgeStatus
-from utils.constants import CacheKey
+from judge.admission import AdmissionController
+from judge.client import get_judge_client
+from judge.counters import ProblemCounters
+from judge.events import publish_judge_event, publish_judge_events, JudgeEventType
+from judge.models import JudgeServer, PendingTaskPriority
+from judge.pending import PendingQueue
+from judge.registry import JudgeServerRegistry
+from judge.routing import get_routing_policy, JudgeLatencyTracker
+from judge.scoreboard import ACMScoreboard, OIScoreboard
+from judge.slots import JudgeSlotAllocator
+from judge.verdict_cache import VerdictCache
+from problem.judge_info import get_problem_judge_info
+from problem.models import Problem, ProblemRuleType
+from submission.models import Submission, JudgeStatus, SubmissionTestCase, SubmissionOutput
+from submission.results import save_test_case_results
+
+# 每次最多从等待队列中取出的任务数
+PENDING_TASK_BATCH_SIZE = 20
+
+
+def _free_slot_count():
+    servers = JudgeServerRegistry.live_servers()
+    used = JudgeSlotAllocator.used([s.id for s in servers])
+    return sum(max(JudgeSlotAllocator.capacity(s) - used[s.id], 0) for s in servers)
 
 
 def process_pending_task():
-    tmp = cache.get(CacheKey.waiting_queue, [])
-    tmp = []
-    if len(tmp):
-        # 防止循环引入
-        from judge.tasks import judge_task
-        tmp_data = tmp.pop(-1)
-        cache.set(CacheKey.waiting_queue, tmp)
-        if tmp_data:
-            data = json.loads(tmp_data.decode("utf-8"))
-            judge_task.send(**data)
+    """
+    有判题机空闲(判题结束或收到心跳)时调用，按空闲的判题槽位数批量取出等待中的任务重新投递
+    """
+    # 防止循环引入
+    from judge.tasks import send_judge_task
+    # 在出队的事务中投递，投递失败的任务留在队列中
+    PendingQueue.pop(min(_free_slot_count(), PENDING_TASK_BATCH_SIZE), send=send_judge_task)
 
 
 class ChooseJudgeServer:
-    def __init__(self):
+    def __init__(self, test_case_id=None):
+        self.test_case_id = test_case_id
         self.server = None
 
     def __enter__(self) -> [JudgeServer, None]:
-        with transaction.atomic():
-            # 选择最轻松的cpu核来判题
-            servers = JudgeServer.objects.select_for_update().filter(is_disabled=False).order_by("task_number")
-            servers = [s for s in servers if s.status == "normal"]
-            for server in servers:
-                if server.task_number <= server.cpu_core * 2:
-                    server.task_number = F("task_number") + 1
-                    server.save(update_fields=["task_number"])
-                    self.server = server
-                    return server
+        # 按SysConfigs中选择的路由策略依次尝试各判题机，槽位的占用通过缓存中的原子计数器完成，不对judge_server表加锁
+        servers = JudgeServerRegistry.live_servers()
+        used = JudgeSlotAllocator.used([s.id for s in servers])
+        for server in get_routing_policy().order(servers, used, self.test_case_id):
+            if JudgeSlotAllocator.acquire(server.id, JudgeSlotAllocator.capacity(server)):
+                self.server = server
+                return server
         return None
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.server:
-            JudgeServer.objects.filter(id=self.server.id).update(task_number=F("task_number") - 1)
+            JudgeSlotAllocator.release(self.server.id)
+            # 释放了一个判题槽位，尝试处理任务队列中剩余的任务
+            process_pending_task()
 
 
 class DispatcherBase(object):
@@ -57,20 +73,31 @@ class DispatcherBase(object):
         kwargs = {"headers": {"X-Judge-Server-Token": self.token}}
         if data:
             kwargs["json"] = data
-        return requests.post(url, **kwargs).json()
+        return get_judge_client().post(url, **kwargs)
 
 
 class JudgeDispatcher(DispatcherBase):
-    def __init__(self, submission_id, problem_id):
+    def __init__(self, submission_id, problem_id, priority=PendingTaskPriority.NORMAL, bypass_verdict_cache=False,
+                 rejudge=False):
         super().__init__()
-        self.submission = Submission.objects.get(id=submission_id)
+        self.priority = priority
+        # 批量重判的提交不使用缓存的判题结果，也不逐个更新计数器，由重判任务结束时统一校正
+        self.rejudge = rejudge
+        self.bypass_verdict_cache = bypass_verdict_cache or rejudge
+        # 提交、源代码和用户是否被禁用在一次查询中读出，题目使用进程内缓存的判题快照
+        self.submission = Submission.objects.select_related("code_ref").annotate(
+            user_active=Exists(User.objects.filter(id=OuterRef("user_id"), is_active=True))).get(id=submission_id)
         self.last_result = self.submission.result if self.submission.info else None
-        self.problem = Problem.objects.get(id=problem_id)
+        self.problem = get_problem_judge_info(problem_id)
+        # 比赛功能尚未实现，题目暂不属于任何比赛
+        self.contest_id = None
+        # 快速失败模式下ACM题目只需要第一个错误的测试点，判题服务器跳过之后的测试点，也不返回程序输出
+        self.fail_fast = self.problem.fail_fast and self.problem.rule_type == ProblemRuleType.ACM
 
     def _compute_statistic_info(self, resp_data):
-        # 用时和内存占用保存为多个测试点中最长的那个
-        self.submission.statistic_info["time_cost"] = max([x["cpu_time"] for x in resp_data])
-        self.submission.statistic_info["memory_cost"] = max([x["memory"] for x in resp_data])
+        # 用时和内存占用保存为多个测试点中最长的那个，快速失败模式下只统计实际运行了的测试点
+        self.submission.statistic_info["time_cost"] = max([x["cpu_time"] for x in resp_data], default=0)
+        self.submission.statistic_info["memory_cost"] = max([x["memory"] for x in resp_data], default=0)
 
         # sum up the score in OI mode
         # if self.problem.rule_type == ProblemRuleType.OI:
@@ -88,158 +115,140 @@ class JudgeDispatcher(DispatcherBase):
         #         return
         #     self.submission.statistic_info["score"] = score
 
-    def judge(self):
-        language = self.submission.language
-        sub_config = list(filter(lambda item: language == item["name"], SysConfigs.languages))[0]
-
-        code = self.submission.code
-
-        data = {
-            "language_config": sub_config["config"],
-            "src": code,
+    def _publish_result(self, resp):
+        # 测试点结果和判题结束事件一次写入
+        events = []
+        if not resp["err"]:
+            for case in resp["data"]:
+                events.append((JudgeEventType.TEST_CASE, {"test_case": case["test_case"], "result": case["result"],
+                                                          "cpu_time": case["cpu_time"], "memory": case["memory"]}))
+        events.append((JudgeEventType.FINISHED, {"result": self.submission.result,
+                                                 "statistic_info": self.submission.statistic_info}))
+        publish_judge_events(self.submission.id, events)
+
+    def _judge_data(self):
+        return {
+            **SysConfigs.language_registry[self.submission.language].judge_payload,
+            "src": self.submission.code,
             "max_cpu_time": self.problem.time_limit,
             "max_memory": 1024 * 1024 * self.problem.memory_limit,
             "test_case_id": self.problem.test_case_id,
-            "output": True,
+            "output": not self.fail_fast,
+            "fail_fast": self.fail_fast,
         }
 
-        with ChooseJudgeServer() as server:
-            if not server:
-                data = {"submission_id": self.submission.id, "problem_id": self.problem.id}
-                tmp = cache.get(CacheKey.waiting_queue, [])
-                cache.set(CacheKey.waiting_queue, tmp.append(data))
-                return
-            Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.JUDGING)
-            resp = self._request(urljoin(server.service_url, "/judge"), data=data)
+    def _verdict_cache_key(self):
+        return VerdictCache.key(self.submission.code, self.submission.language, self.problem, self.fail_fast)
+
+    def _cached_result(self):
+        return None if self.bypass_verdict_cache else VerdictCache.get(self._verdict_cache_key())
+
+    def _push_pending(self):
+        PendingQueue.push(self.submission.id, self.problem.id, self.priority,
+                          bypass_verdict_cache=self.bypass_verdict_cache, rejudge=self.rejudge)
+        publish_judge_event(self.submission.id, JudgeEventType.STATUS, result=JudgeStatus.PENDING)
 
-        if not resp:
-            Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.SYSTEM_ERROR)
+    def _mark_judging(self):
+        Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.JUDGING)
+        publish_judge_event(self.submission.id, JudgeEventType.STATUS, result=JudgeStatus.JUDGING)
+
+    def _mark_system_error(self):
+        Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.SYSTEM_ERROR)
+        publish_judge_event(self.submission.id, JudgeEventType.FINISHED, result=JudgeStatus.SYSTEM_ERROR,
+                            statistic_info=self.submission.statistic_info)
+        AdmissionController.release(self.submission.id)
+
+    def _skip(self):
+        """
+        被禁用的用户的提交不判题，直接释放准入名额
+        """
+        if self.submission.user_active:
+            return False
+        AdmissionController.release(self.submission.id)
+        return True
+
+    def judge(self):
+        if self._skip():
             return
+        resp = self._cached_result()
+        if resp is None:
+            with ChooseJudgeServer(self.problem.test_case_id) as server:
+                if not server:
+                    self._push_pending()
+                    return
+                self._mark_judging()
+                data = self._judge_data()
+                start = time.monotonic()
+                resp = self._request(urljoin(server.service_url, "/judge"), data=data)
+                JudgeLatencyTracker.observe(server.id, time.monotonic() - start, failed=not resp)
+
+            if not resp:
+                self._mark_system_error()
+                return
+            VerdictCache.set(self._verdict_cache_key(), resp)
+        self._save_result(resp)
 
+    def _save_result(self, resp):
+        """
+        保存判题结果并更新计数器
+        """
         if resp["err"]:
             self.submission.result = JudgeStatus.COMPILE_ERROR
             self.submission.statistic_info["err_info"] = resp["data"]
             self.submission.statistic_info["score"] = 0
         else:
             resp["data"].sort(key=lambda x: int(x["test_case"]))
-            self.submission.info = resp
+            # 快速失败模式下data只包含实际运行了的测试点，skipped为被跳过的测试点
+            resp.setdefault("skipped", [])
+            self.submission.info = {"err": None, "skipped": resp["skipped"]}
             self._compute_statistic_info(resp["data"])
             error_test_case = list(filter(lambda case: case["result"] != 0, resp["data"]))
             # ACM模式下,多个测试点全部正确则AC，否则取第一个错误的测试点的状态
             # OI模式下, 若多个测试点全部正确则AC， 若全部错误则取第一个错误测试点状态，否则为部分正确
-            if not error_test_case:
+            if not error_test_case and resp["skipped"]:
+                # 没有错误的测试点却跳过了测试点，判题服务器的结果不完整
+                self.submission.result = JudgeStatus.SYSTEM_ERROR
+            elif not error_test_case:
                 self.submission.result = JudgeStatus.ACCEPTED
             elif self.problem.rule_type == ProblemRuleType.ACM or len(error_test_case) == len(resp["data"]):
                 self.submission.result = error_test_case[0]["result"]
             else:
                 self.submission.result = JudgeStatus.PARTIALLY_ACCEPTED
-        self.submission.save()
-
-        if self.contest_id:
-            if self.contest.status != ContestStatus.CONTEST_UNDERWAY or \
-                    User.objects.get(id=self.submission.user_id).is_contest_admin(self.contest):
-                logger.info(
-                    "Contest debug mode, id: " + str(self.contest_id) + ", submission id: " + self.submission.id)
-                return
-            with transaction.atomic():
-                self.update_contest_problem_status()
-                self.update_contest_rank()
-        else:
-            if self.last_result:
-                self.update_problem_status_rejudge()
-            else:
-                self.update_problem_status()
-
-        # 至此判题结束，尝试处理任务队列中剩余的任务
-        process_pending_task()
-
-    def update_problem_status_rejudge(self):
-        result = str(self.submission.result)
-        problem_id = str(self.problem.id)
         with transaction.atomic():
-            # update problem status
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            if self.last_result != JudgeStatus.ACCEPTED and self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem_info = problem.statistic_info
-            problem_info[self.last_result] = problem_info.get(self.last_result, 1) - 1
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.save(update_fields=["accepted_number", "statistic_info"])
-
-            profile = User.objects.select_for_update().get(id=self.submission.user_id).userprofile
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = profile.acm_problems_status.get("problems", {})
-                if acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.acm_problems_status["problems"] = acm_problems_status
-                profile.save(update_fields=["accepted_number", "acm_problems_status"])
+            self.submission.save()
+            # 编译错误时也要清除重判前的测试点结果
+            save_test_case_results(self.submission.id, [] if resp["err"] else resp["data"],
+                                   SubmissionTestCase, SubmissionOutput)
+            # 计数器的增量与判题结果在同一个事务中提交
+            if not self.rejudge and not self.contest_id:
+                if self.last_result:
+                    self.update_problem_status_rejudge()
+                else:
+                    self.update_problem_status()
+        self._publish_result(resp)
+        AdmissionController.release(self.submission.id)
 
-            else:
-                oi_problems_status = profile.oi_problems_status.get("problems", {})
-                score = self.submission.statistic_info["score"]
-                if oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # minus last time score, add this tim score
-                    profile.add_score(this_time_score=score,
-                                      last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.oi_problems_status["problems"] = oi_problems_status
-                profile.save(update_fields=["accepted_number", "oi_problems_status"])
+        if self.rejudge or not self.contest_id:
+            return
 
-    def update_problem_status(self):
-        result = str(self.submission.result)
-        problem_id = str(self.problem.id)
+        if self.contest.status != ContestStatus.CONTEST_UNDERWAY or \
+                User.objects.get(id=self.submission.user_id).is_contest_admin(self.contest):
+            logger.info(
+                "Contest debug mode, id: " + str(self.contest_id) + ", submission id: " + self.submission.id)
+            return
         with transaction.atomic():
-            # update problem status
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            problem.submission_number += 1
-            if self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem_info = problem.statistic_info
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.save(update_fields=["accepted_number", "submission_number", "statistic_info"])
+            self.update_contest_problem_status()
+            self.update_contest_rank()
 
-            # update_userprofile
-            user = User.objects.select_for_update().get(id=self.submission.user_id)
-            user_profile = user.userprofile
-            user_profile.submission_number += 1
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = user_profile.acm_problems_status.get("problems", {})
-                if problem_id not in acm_problems_status:
-                    acm_problems_status[problem_id] = {"status": self.submission.result, "_id": self.problem._id}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.acm_problems_status["problems"] = acm_problems_status
-                user_profile.save(update_fields=["submission_number", "accepted_number", "acm_problems_status"])
+    def update_problem_status_rejudge(self):
+        if self.last_result != JudgeStatus.ACCEPTED and self.submission.result == JudgeStatus.ACCEPTED:
+            ProblemCounters.record(self.problem.id, self.submission.user_id, passed=1)
+        elif self.last_result == JudgeStatus.ACCEPTED and self.submission.result != JudgeStatus.ACCEPTED:
+            ProblemCounters.record(self.problem.id, self.submission.user_id, passed=-1)
 
-            else:
-                oi_problems_status = user_profile.oi_problems_status.get("problems", {})
-                score = self.submission.statistic_info["score"]
-                if problem_id not in oi_problems_status:
-                    user_profile.add_score(score)
-                    oi_problems_status[problem_id] = {"status": self.submission.result,
-                                                      "_id": self.problem._id,
-                                                      "score": score}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # minus last time score, add this time score
-                    user_profile.add_score(this_time_score=score,
-                                           last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.oi_problems_status["problems"] = oi_problems_status
-                user_profile.save(update_fields=["submission_number", "accepted_number", "oi_problems_status"])
+    def update_problem_status(self):
+        ProblemCounters.record(self.problem.id, self.submission.user_id, attempt=1,
+                               passed=int(self.submission.result == JudgeStatus.ACCEPTED))
 
     def update_contest_problem_status(self):
         with transaction.atomic():
@@ -281,75 +290,31 @@ class JudgeDispatcher(DispatcherBase):
             problem.save(update_fields=["submission_number", "accepted_number", "statistic_info"])
 
     def update_contest_rank(self):
-        if self.contest.rule_type == ContestRuleType.OI or self.contest.real_time_rank:
-            cache.delete(f"{CacheKey.contest_rank_cache}:{self.contest.id}")
-
-        def get_rank(model):
-            return model.objects.select_for_update().get(user_id=self.submission.user_id, contest=self.contest)
-
+        # 在数据库中对用户的排名记录加锁后读-改-写
         if self.contest.rule_type == ContestRuleType.ACM:
-            model = ACMContestRank
-            func = self._update_acm_contest_rank
+            model, scoreboard = ACMContestRank, ACMScoreboard
+            # 因前面更改过，这里需要重新获取
+            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
+            args = (self.submission.result, (self.submission.create_time - self.contest.start_time).total_seconds(),
+                    problem.accepted_number == 1)
         else:
-            model = OIContestRank
-            func = self._update_oi_contest_rank
+            model, scoreboard = OIContestRank, OIScoreboard
+            args = (self.submission.statistic_info["score"], )
+
+        def get_rank():
+            return model.objects.select_for_update().get(user_id=self.submission.user_id, contest=self.contest)
 
         try:
-            rank = get_rank(model)
+            rank = get_rank()
         except model.DoesNotExist:
             try:
-                model.objects.create(user_id=self.submission.user_id, contest=self.contest)
-                rank = get_rank(model)
+                with transaction.atomic():
+                    model.objects.create(user_id=self.submission.user_id, contest=self.contest)
+                rank = get_rank()
             except IntegrityError:
-                rank = get_rank(model)
-        func(rank)
-
-    def _update_acm_contest_rank(self, rank):
-        info = rank.submission_info.get(str(self.submission.problem_id))
-        # 因前面更改过，这里需要重新获取
-        problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-        # 此题提交过
-        if info:
-            if info["is_ac"]:
-                return
-
-            rank.submission_number += 1
-            if self.submission.result == JudgeStatus.ACCEPTED:
-                rank.accepted_number += 1
-                info["is_ac"] = True
-                info["ac_time"] = (self.submission.create_time - self.contest.start_time).total_seconds()
-                rank.total_time += info["ac_time"] + info["error_number"] * 20 * 60
-
-                if problem.accepted_number == 1:
-                    info["is_first_ac"] = True
-            elif self.submission.result != JudgeStatus.COMPILE_ERROR:
-                info["error_number"] += 1
-
-        # 第一次提交
-        else:
-            rank.submission_number += 1
-            info = {"is_ac": False, "ac_time": 0, "error_number": 0, "is_first_ac": False}
-            if self.submission.result == JudgeStatus.ACCEPTED:
-                rank.accepted_number += 1
-                info["is_ac"] = True
-                info["ac_time"] = (self.submission.create_time - self.contest.start_time).total_seconds()
-                rank.total_time += info["ac_time"]
-
-                if problem.accepted_number == 1:
-                    info["is_first_ac"] = True
-
-            elif self.submission.result != JudgeStatus.COMPILE_ERROR:
-                info["error_number"] = 1
-        rank.submission_info[str(self.submission.problem_id)] = info
-        rank.save()
-
-    def _update_oi_contest_rank(self, rank):
-        problem_id = str(self.submission.problem_id)
-        current_score = self.submission.statistic_info["score"]
-        last_score = rank.submission_info.get(problem_id)
-        if last_score:
-            rank.total_score = rank.total_score - last_score + current_score
-        else:
-            rank.total_score = rank.total_score + current_score
-        rank.submission_info[problem_id] = current_score
+                rank = get_rank()
+        entry = {field: getattr(rank, field) for field in scoreboard.fields()}
+        scoreboard.apply(entry, self.submission.problem_id, *args)
+        for field, value in entry.items():
+            setattr(rank, field, value)
         rank.save()
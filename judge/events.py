@@ -0,0 +1,202 @@
+import asyncio
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from utils.cache import incr_or_init
+from utils.constants import CacheKey
+
+
+class JudgeEventType:
+    STATUS = "status"
+    TEST_CASE = "test_case"
+    FINISHED = "finished"
+
+
+class LocalBackend:
+    """
+    只在当前进程内分发事件，适用于判题和推送在同一进程中的部署(如异步判题模式)
+    """
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, channel, events):
+        self.hub.dispatch(channel, events)
+
+    def reset(self, channel):
+        pass
+
+    def start(self, channel):
+        pass
+
+    def stop(self, channel):
+        pass
+
+
+class CacheBackend:
+    """
+    事件按序号写入共享缓存，判题worker和ASGI进程可以是不同的进程；
+    ASGI进程中每个有订阅者的频道只有一个轮询任务，读到的新事件再分发给本进程的所有订阅者；
+    没有新事件时轮询间隔逐次加倍，最长为poll_interval * max_backoff，读到新事件后恢复为poll_interval。
+    缓存中保留了频道的全部事件，晚到的订阅者也能收到之前的事件；重新判题前由reset清空频道，订阅者不会收到上一次判题的事件
+    """
+    poll_interval = 0.5
+    max_backoff = 8
+    timeout = 10 * 60
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.tasks = {}
+
+    @staticmethod
+    def _key(channel):
+        return f"{CacheKey.judge_event}:{channel}"
+
+    def publish(self, channel, events):
+        # 一批事件只占用一次序号和一次写入
+        key = self._key(channel)
+        seq = incr_or_init(key, len(events), timeout=self.timeout)
+        first = seq - len(events) + 1
+        cache.set_many({f"{key}:{first + i}": event for i, event in enumerate(events)}, timeout=self.timeout)
+
+    def reset(self, channel):
+        key = self._key(channel)
+        seq = cache.get(key, 0)
+        cache.delete_many([key] + [f"{key}:{i}" for i in range(1, seq + 1)])
+
+    async def _poll(self, channel):
+        key = self._key(channel)
+        last = 0
+        interval = self.poll_interval
+        while True:
+            seq = await cache.aget(key, 0)
+            if seq < last:
+                # 频道被reset，重新开始编号
+                last = 0
+            if seq > last:
+                events = await cache.aget_many([f"{key}:{i}" for i in range(last + 1, seq + 1)])
+                batch = []
+                # publish先增加序号再写入事件，只分发连续的一段，还没有写入的事件下一次再读
+                for i in range(last + 1, seq + 1):
+                    event = events.get(f"{key}:{i}")
+                    if event is None:
+                        break
+                    batch.append(event)
+                    last = i
+                self.hub.dispatch(channel, batch)
+                interval = self.poll_interval
+            else:
+                interval = min(interval * 2, self.poll_interval * self.max_backoff)
+            await asyncio.sleep(interval)
+
+    def start(self, channel):
+        if channel not in self.tasks:
+            self.tasks[channel] = asyncio.get_running_loop().create_task(self._poll(channel))
+
+    def stop(self, channel):
+        task = self.tasks.pop(channel, None)
+        if task:
+            task.cancel()
+
+
+class Subscription:
+    def __init__(self, hub, channel):
+        self.hub = hub
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    async def get(self, timeout=None):
+        """
+        等待下一个事件，超时返回None
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    async def __aenter__(self):
+        self.hub.subscribe(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.hub.unsubscribe(self)
+
+
+class JudgeEventHub:
+    """
+    进程内的判题事件发布/订阅，频道为提交id；事件的跨进程传递由可替换的backend完成
+    """
+    def __init__(self, backend_class):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+        self.backend = backend_class(self)
+
+    def publish(self, channel, *events):
+        self.backend.publish(channel, list(events))
+
+    def reset(self, channel):
+        self.backend.reset(channel)
+
+    def subscribe(self, subscription):
+        with self.lock:
+            first = subscription.channel not in self.subscriptions
+            self.subscriptions.setdefault(subscription.channel, set()).add(subscription)
+        if first:
+            self.backend.start(subscription.channel)
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+            last = not subscriptions
+            if last:
+                self.subscriptions.pop(subscription.channel, None)
+        if last:
+            self.backend.stop(subscription.channel)
+
+    def dispatch(self, channel, events):
+        """
+        把事件分发给本进程中该频道的所有订阅者，可以在任意线程中调用
+        """
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            for event in events:
+                subscription.put(event)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_event_hub():
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = JudgeEventHub(import_string(settings.JUDGE_EVENT_BACKEND))
+    return _hub
+
+
+def publish_judge_event(submission_id, event_type, **data):
+    get_event_hub().publish(str(submission_id), {"type": event_type, **data})
+
+
+def publish_judge_events(submission_id, events):
+    """
+    按顺序发布一批事件，events中的每一项为(event_type, data)
+    """
+    get_event_hub().publish(str(submission_id), *[{"type": event_type, **data} for event_type, data in events])
+
+
+def reset_judge_events(submission_id):
+    """
+    提交重新进入判题前调用，清除上一次判题的事件
+    """
+    get_event_hub().reset(str(submission_id))
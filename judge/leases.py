@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from judge.models import JudgeLease, PendingTask
+from submission.models import Submission, JudgeStatus
+from utils.constants import CacheKey
+
+# 两次检查过期租约之间至少间隔的秒数
+SWEEP_INTERVAL = 60
+# 每次最多重新投递的提交数
+SWEEP_BATCH_SIZE = 100
+
+
+class JudgeLeases:
+    """
+    异步判题模式下判题的租约，基于judge_lease表实现
+    1. 异步模式下消息在交给事件循环时就被确认，之后worker进程退出会丢失判题(至多一次)；
+       确认前先写入租约，判题结束时删除，丢失的判题留下过期的租约
+    2. sweep把租约过期、仍然是PENDING/JUDGING且不在等待队列中的提交重新投递，
+       租约时长JUDGE_ASYNC_LEASE_TIMEOUT需要大于一次判题的最长耗时，否则会重复判题
+    """
+    @staticmethod
+    def acquire(submission_id, problem_id, priority, **options):
+        expire_time = timezone.now() + timedelta(seconds=settings.JUDGE_ASYNC_LEASE_TIMEOUT)
+        JudgeLease.objects.update_or_create(submission_id=submission_id, defaults={
+            "problem_id": problem_id, "priority": priority, "options": options, "expire_time": expire_time})
+
+    @staticmethod
+    def release(submission_id):
+        JudgeLease.objects.filter(submission_id=submission_id).delete()
+
+    @staticmethod
+    def sweep(send):
+        """
+        对每个丢失的判题调用send(submission_id, problem_id, priority, **options)并删除过期的租约，返回重新投递的提交数
+        send抛出异常时整批租约都保留，下一次再投递(之前投递成功的提交可能重复判题，不会丢失)
+        """
+        with transaction.atomic():
+            leases = list(JudgeLease.objects.select_for_update(skip_locked=True)
+                          .filter(expire_time__lt=timezone.now()).order_by("expire_time")[:SWEEP_BATCH_SIZE])
+            if not leases:
+                return 0
+            lost = set(Submission.objects.filter(id__in=[lease.submission_id for lease in leases],
+                                                 result__in=(JudgeStatus.PENDING, JudgeStatus.JUDGING))
+                       .exclude(Exists(PendingTask.objects.filter(submission_id=OuterRef("id"))))
+                       .values_list("id", flat=True))
+            for lease in leases:
+                if lease.submission_id in lost:
+                    send(lease.submission_id, lease.problem_id, lease.priority, **lease.options)
+            JudgeLease.objects.filter(id__in=[lease.id for lease in leases]).delete()
+        return len(lost)
+
+    @staticmethod
+    def schedule_sweep():
+        """
+        异步判题模式下每SWEEP_INTERVAL秒最多投递一次检查任务
+        """
+        if settings.JUDGE_DISPATCH_MODE == "async" and \
+                cache.add(CacheKey.judge_lease_sweep_lock, 1, timeout=SWEEP_INTERVAL):
+            # 防止循环引入
+            from judge.tasks import sweep_judge_leases_task
+            sweep_judge_leases_task.send()
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from judge.models import RejudgeJob, RejudgeJobStatus
+from judge.rejudge import create_rejudge_job
+
+
+class Command(BaseCommand):
+    help = "重判某道题目和/或某个时间段内的全部提交"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--problem", type=int, help="题目id")
+        parser.add_argument("--start", help="开始时间(包含)，如2024-12-01T00:00:00+08:00")
+        parser.add_argument("--end", help="结束时间(不包含)")
+        parser.add_argument("--concurrency", type=int, default=4, help="同时判题的提交数上限")
+        parser.add_argument("--wait", action="store_true", help="等待重判结束并输出进度")
+
+    def handle(self, *args, **options):
+        start_time = parse_datetime(options["start"]) if options["start"] else None
+        end_time = parse_datetime(options["end"]) if options["end"] else None
+        if not (options["problem"] or start_time or end_time):
+            raise CommandError("请指定--problem、--start或--end")
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency必须大于0")
+
+        job = create_rejudge_job(problem_id=options["problem"], start_time=start_time, end_time=end_time,
+                                 concurrency=options["concurrency"])
+        self.stdout.write(f"rejudge job {job.id} created, {job.total} submissions")
+        if not options["wait"]:
+            return
+
+        while job.status != RejudgeJobStatus.FINISHED:
+            time.sleep(1)
+            job = RejudgeJob.objects.get(id=job.id)
+            self.stdout.write(f"{job.finished}/{job.total} finished, {job.enqueued - job.finished} judging")
+        self.stdout.write(self.style.SUCCESS(f"rejudge job {job.id} finished"))
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-16 23:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submission_id', models.CharField(max_length=36, unique=True)),
+                ('problem_id', models.BigIntegerField()),
+                ('priority', models.IntegerField(default=1)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'pending_task',
+                'indexes': [models.Index(fields=['priority', 'id'], name='pending_tas_priorit_ed2c26_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-16 23:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0002_pendingtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingtask',
+            name='bypass_verdict_cache',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.2 on 2026-10-16 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0003_pendingtask_bypass_verdict_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RejudgeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('problem_id', models.BigIntegerField(null=True)),
+                ('start_time', models.DateTimeField(null=True)),
+                ('end_time', models.DateTimeField(null=True)),
+                ('concurrency', models.IntegerField(default=4)),
+                ('total', models.IntegerField(default=0)),
+                ('enqueued', models.IntegerField(default=0)),
+                ('finished', models.IntegerField(default=0)),
+                ('cursor', models.CharField(default='', max_length=36)),
+                ('status', models.CharField(default='running', max_length=16)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('finish_time', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'rejudge_job',
+            },
+        ),
+        migrations.RemoveField(
+            model_name='pendingtask',
+            name='bypass_verdict_cache',
+        ),
+        migrations.AddField(
+            model_name='pendingtask',
+            name='options',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-16 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0004_rejudgejob_remove_pendingtask_bypass_verdict_cache_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProblemCounterDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('problem_id', models.BigIntegerField()),
+                ('user_id', models.IntegerField()),
+                ('attempt', models.IntegerField(default=0)),
+                ('passed', models.IntegerField(default=0)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'problem_counter_delta',
+            },
+        ),
+    ]
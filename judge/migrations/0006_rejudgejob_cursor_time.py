@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-17 00:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0005_problem_counter_delta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rejudgejob',
+            name='cursor_time',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
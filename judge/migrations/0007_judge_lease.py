@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-17 00:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0006_rejudgejob_cursor_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JudgeLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submission_id', models.CharField(max_length=36, unique=True)),
+                ('problem_id', models.BigIntegerField()),
+                ('priority', models.IntegerField(default=1)),
+                ('options', models.JSONField(default=dict)),
+                ('expire_time', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'db_table': 'judge_lease',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-17 01:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0007_judge_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rejudgejob',
+            name='progress_time',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='rejudgejob',
+            name='stalled_resends',
+            field=models.IntegerField(default=0),
+        ),
+    ]
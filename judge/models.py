@@ -1,6 +1,9 @@
 from django.db import models
 from django.utils import timezone
 
+from account.models import User
+from submission.models import Submission
+
 
 class JudgeServer(models.Model):
     hostname = models.TextField()
@@ -23,4 +26,106 @@ class JudgeServer(models.Model):
         return "normal"
 
     class Meta:
-        db_table = "judge_server"
\ No newline at end of file
+        db_table = "judge_server"
+
+
+class PendingTaskPriority:
+    # 数值越小越优先，同一优先级内按入队顺序(FIFO)出队
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class PendingTask(models.Model):
+    """
+    没有空闲判题机时暂存的判题任务，存在数据库中，多个worker/进程共享且不会因进程退出而丢失
+    """
+    submission_id = models.CharField(max_length=36, unique=True)
+    problem_id = models.BigIntegerField()
+    priority = models.IntegerField(default=PendingTaskPriority.NORMAL)
+    # 重新投递时传给judge_task的其余参数，如bypass_verdict_cache、rejudge
+    options = models.JSONField(default=dict)
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "pending_task"
+        indexes = [models.Index(fields=["priority", "id"])]
+
+
+class JudgeLease(models.Model):
+    """
+    异步判题模式下消息已经确认、还没有判完的提交，判题结束时删除；
+    worker进程崩溃等原因到expire_time还存在的记录由JudgeLeases.sweep重新投递
+    """
+    submission_id = models.CharField(max_length=36, unique=True)
+    problem_id = models.BigIntegerField()
+    priority = models.IntegerField(default=PendingTaskPriority.NORMAL)
+    # 重新投递时传给judge_task的其余参数
+    options = models.JSONField(default=dict)
+    expire_time = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = "judge_lease"
+
+
+class ProblemCounterDelta(models.Model):
+    """
+    判题结束后题目计数器的增量，与判题结果在同一个事务中写入，只追加不修改，由ProblemCounters.flush合并到problem表
+    """
+    problem_id = models.BigIntegerField()
+    user_id = models.IntegerField()
+    # attempt_cnt的增量
+    attempt = models.IntegerField(default=0)
+    # pass_cnt的增量，重判由通过变为不通过时为-1
+    passed = models.IntegerField(default=0)
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "problem_counter_delta"
+
+
+class RejudgeJobStatus:
+    RUNNING = "running"
+    FINISHED = "finished"
+
+
+class RejudgeJob(models.Model):
+    """
+    批量重判任务，重判某道题目和/或某个时间段内的全部提交
+    """
+    problem_id = models.BigIntegerField(null=True)
+    start_time = models.DateTimeField(null=True)
+    end_time = models.DateTimeField(null=True)
+    # 同时处于待判/判题中状态的提交数上限，避免挤占正常提交的判题机
+    concurrency = models.IntegerField(default=4)
+    total = models.IntegerField(default=0)
+    enqueued = models.IntegerField(default=0)
+    finished = models.IntegerField(default=0)
+    # 已投递的最后一个提交的(create_time, id)，提交按这个顺序分批投递
+    cursor_time = models.DateTimeField(null=True)
+    cursor = models.CharField(max_length=36, default="")
+    # 最近一次有提交判完或投递新提交的时间，以及之后重新投递卡住的提交的次数
+    progress_time = models.DateTimeField(null=True)
+    stalled_resends = models.IntegerField(default=0)
+    status = models.CharField(max_length=16, default=RejudgeJobStatus.RUNNING)
+    create_time = models.DateTimeField(auto_now_add=True)
+    finish_time = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = "rejudge_job"
+
+    def submissions(self):
+        # 被禁用用户的提交不会被判题；只重判创建任务之前的提交，之后的新提交正在正常判题，不能再次投递
+        submissions = Submission.objects.filter(user_id__in=User.objects.filter(is_active=True).values("id"),
+                                                create_time__lte=self.create_time)
+        if self.problem_id:
+            submissions = submissions.filter(problem_id=self.problem_id)
+        if self.start_time:
+            submissions = submissions.filter(create_time__gte=self.start_time)
+        if self.end_time:
+            submissions = submissions.filter(create_time__lt=self.end_time)
+        return submissions
+
+    def progress(self):
+        return {"id": self.id, "status": self.status, "total": self.total,
+                "enqueued": self.enqueued, "finished": self.finished}
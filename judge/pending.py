@@ -0,0 +1,56 @@
+from django.db import transaction, IntegrityError
+
+from judge.models import PendingTask, PendingTaskPriority
+
+
+class PendingQueue:
+    """
+    持久化的待判题队列，基于pending_task表实现
+    1. 按priority从小到大出队，同一优先级内先进先出
+    2. 出队时使用select_for_update(skip_locked=True)，多个worker同时出队不会拿到同一个任务
+    3. 同一个提交在队列中只会存在一份
+    """
+    @staticmethod
+    def push(submission_id, problem_id, priority=PendingTaskPriority.NORMAL, **options):
+        """
+        options为重新投递时传给judge_task的其余参数
+        """
+        try:
+            with transaction.atomic():
+                PendingTask.objects.create(submission_id=submission_id, problem_id=problem_id, priority=priority,
+                                           options=options)
+        except IntegrityError:
+            # 该提交已经在队列中
+            pass
+
+    @staticmethod
+    def pop(count=1, send=None):
+        """
+        原子地取出至多count个任务，返回可直接用于judge_task.send的参数字典列表
+        send不为None时在出队的事务中对每个任务调用send(**参数)，只删除投递成功的任务：
+        send抛出异常时其余任务留在队列中并重新抛出异常，进程在投递过程中退出时整批任务都留在队列中(可能重复投递，不会丢失)
+        """
+        if count <= 0:
+            return []
+        error = None
+        with transaction.atomic():
+            tasks = list(PendingTask.objects.select_for_update(skip_locked=True).order_by("priority", "id")[:count])
+            data = [{"submission_id": task.submission_id, "problem_id": task.problem_id, "priority": task.priority,
+                     **task.options} for task in tasks]
+            done = len(tasks)
+            if send:
+                for i, item in enumerate(data):
+                    try:
+                        send(**item)
+                    except Exception as e:
+                        error, done = e, i
+                        break
+            if done:
+                PendingTask.objects.filter(id__in=[task.id for task in tasks[:done]]).delete()
+        if error:
+            raise error
+        return data[:done]
+
+    @staticmethod
+    def size():
+        return PendingTask.objects.count()
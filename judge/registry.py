@@ -0,0 +1,116 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from judge.models import JudgeServer
+from utils.constants import CacheKey
+
+# 判题服务器的信息最多隔多少秒写回一次数据库
+FLUSH_INTERVAL = 5
+# 超过多少秒没有心跳视为异常，增加一秒延时，提高对网络环境的适应性
+HEARTBEAT_TIMEOUT = 6
+
+# 需要写回数据库的字段
+_persist_fields = ["judger_version", "cpu_core", "memory_usage", "cpu_usage", "service_url", "ip", "last_heartbeat"]
+# 注册表中保存的字段
+_info_fields = _persist_fields + ["id", "hostname", "is_disabled"]
+
+
+class JudgeServerRegistry:
+    """
+    在线判题服务器的注册表，保存在缓存中，多个进程共享
+    1. 心跳只更新缓存中对应服务器的信息，新上线的服务器才会立即写入数据库
+    2. 每隔FLUSH_INTERVAL秒由收到心跳的某一个进程用一条bulk_update把所有服务器的信息写回judge_server表，
+       同时从数据库同步is_disabled，因此后台禁用服务器最多延迟FLUSH_INTERVAL秒生效
+    """
+    @staticmethod
+    def _key(hostname):
+        return f"{CacheKey.judge_server}:{hostname}"
+
+    @classmethod
+    def _hostnames(cls):
+        hostnames = cache.get(CacheKey.judge_server_hostnames)
+        if hostnames is None:
+            hostnames = list(JudgeServer.objects.values_list("hostname", flat=True))
+            cache.set(CacheKey.judge_server_hostnames, hostnames, timeout=None)
+        return hostnames
+
+    @classmethod
+    def heartbeat(cls, data, ip=None):
+        """
+        data为通过JudgeServerHeartbeatSerializer校验的心跳数据
+        """
+        hostname = data["hostname"]
+        info = {
+            "hostname": hostname,
+            "judger_version": data["judger_version"],
+            "cpu_core": data["cpu_core"],
+            "memory_usage": data["memory"],
+            "cpu_usage": data["cpu"],
+            "service_url": data["service_url"],
+            "ip": ip,
+            "last_heartbeat": timezone.now(),
+        }
+        old_info = cache.get(cls._key(hostname))
+        if old_info is None:
+            # 注册表中没有该服务器，直接写库以拿到id和is_disabled
+            defaults = {key: info[key] for key in _persist_fields}
+            server, created = JudgeServer.objects.update_or_create(hostname=hostname, defaults=defaults)
+            info["id"] = server.id
+            info["is_disabled"] = server.is_disabled
+            if hostname not in cls._hostnames():
+                cache.delete(CacheKey.judge_server_hostnames)
+        else:
+            info["id"] = old_info["id"]
+            info["is_disabled"] = old_info["is_disabled"]
+        cache.set(cls._key(hostname), info, timeout=None)
+
+        # cache.add是原子的，每个FLUSH_INTERVAL内只有一个进程会执行flush
+        if cache.add(CacheKey.judge_server_flush_lock, 1, timeout=FLUSH_INTERVAL):
+            cls.flush()
+
+    @classmethod
+    def servers(cls):
+        """
+        注册表中的所有服务器，返回未保存的JudgeServer对象
+        """
+        infos = cache.get_many([cls._key(hostname) for hostname in cls._hostnames()])
+        return [JudgeServer(**info) for info in infos.values()]
+
+    @classmethod
+    def live_servers(cls):
+        """
+        未被禁用且心跳正常的服务器
+        注册表为空时(缓存被清空，或者缓存不是多进程共享的，心跳落在了其它进程)从数据库读取，
+        数据库中的心跳时间最多落后FLUSH_INTERVAL秒
+        """
+        servers = cls.servers()
+        if not servers:
+            deadline = timezone.now() - timedelta(seconds=HEARTBEAT_TIMEOUT + FLUSH_INTERVAL)
+            return list(JudgeServer.objects.filter(is_disabled=False, last_heartbeat__gte=deadline))
+        deadline = timezone.now() - timedelta(seconds=HEARTBEAT_TIMEOUT)
+        return [server for server in servers if not server.is_disabled and server.last_heartbeat >= deadline]
+
+    @classmethod
+    def flush(cls):
+        """
+        把注册表中的服务器信息批量写回数据库，并同步数据库中的is_disabled
+        """
+        cache.delete(CacheKey.judge_server_hostnames)
+        servers = cls.servers()
+        if not servers:
+            return
+        JudgeServer.objects.bulk_update(servers, _persist_fields)
+
+        disabled = dict(JudgeServer.objects.filter(id__in=[s.id for s in servers]).values_list("id", "is_disabled"))
+        changed = {}
+        for server in servers:
+            if server.id not in disabled:
+                # 服务器已经从数据库中删除
+                cache.delete(cls._key(server.hostname))
+            elif disabled[server.id] != server.is_disabled:
+                server.is_disabled = disabled[server.id]
+                changed[cls._key(server.hostname)] = {field: getattr(server, field) for field in _info_fields}
+        if changed:
+            cache.set_many(changed, timeout=None)
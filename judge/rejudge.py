@@ -0,0 +1,140 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from account.models import User
+from judge.events import reset_judge_events, publish_judge_event, JudgeEventType
+from judge.models import RejudgeJob, RejudgeJobStatus, PendingTask, PendingTaskPriority, ProblemCounterDelta
+from problem.models import Problem
+from problem.user_status import invalidate_user_problem_status
+from submission.models import Submission, JudgeStatus
+
+# 两次检查重判进度之间的间隔(毫秒)
+REJUDGE_TICK_DELAY = 1000
+# 任务超过这个秒数没有进展时处理卡住的提交(消息丢失或判题失败，一直停留在PENDING/JUDGING)
+REJUDGE_STALL_TIMEOUT = 10 * 60
+# 卡住的提交最多重新投递的次数，之后仍然没有判完的标记为系统错误
+REJUDGE_MAX_RESENDS = 1
+
+
+def create_rejudge_job(problem_id=None, start_time=None, end_time=None, concurrency=4):
+    """
+    创建批量重判任务并开始执行，problem_id和时间段至少指定一个
+    """
+    # 先保存以确定create_time，任务只包含在此之前创建的提交
+    job = RejudgeJob.objects.create(problem_id=problem_id, start_time=start_time, end_time=end_time,
+                                    concurrency=concurrency)
+    job.total = job.submissions().count()
+    job.save(update_fields=["total"])
+    # judge.tasks引入时会定义actor，只在投递时引入，加载url时不依赖broker
+    from judge.tasks import rejudge_job_task
+    rejudge_job_task.send(job.id)
+    return job
+
+
+def run_rejudge_job(job_id):
+    """
+    推进一次重判任务：统计仍在判题中的提交数，按并发上限从游标处继续取出一批提交投递到低优先级队列；
+    全部提交判完之后统一校正计数器。未结束时隔REJUDGE_TICK_DELAY毫秒再次执行
+    超过REJUDGE_STALL_TIMEOUT秒没有进展时处理卡住的提交，见_handle_stalled
+    """
+    job = RejudgeJob.objects.get(id=job_id)
+    if job.status == RejudgeJobStatus.FINISHED:
+        return
+    submissions = job.submissions()
+
+    # 提交的id是随机的uuid，按(create_time, id)排序分页
+    after_cursor = Q()
+    if job.cursor_time:
+        after_cursor = Q(create_time__gt=job.cursor_time) | Q(create_time=job.cursor_time, id__gt=job.cursor)
+
+    inflight = 0
+    if job.enqueued:
+        inflight = submissions.exclude(after_cursor) \
+            .filter(result__in=[JudgeStatus.PENDING, JudgeStatus.JUDGING]).count()
+    now = timezone.now()
+    if job.progress_time is None or job.enqueued - inflight != job.finished:
+        job.progress_time = now
+        job.stalled_resends = 0
+    job.finished = job.enqueued - inflight
+
+    from judge.tasks import low_priority_judge_task, rejudge_job_task
+    chunk = []
+    if inflight < job.concurrency:
+        chunk = list(submissions.filter(after_cursor).order_by("create_time", "id")
+                     .values_list("id", "problem_id", "create_time")[:job.concurrency - inflight])
+    if chunk:
+        # 先清除上一次判题的事件，重判期间订阅的客户端不会收到旧的结果
+        for submission_id, _, _ in chunk:
+            reset_judge_events(submission_id)
+        Submission.objects.filter(id__in=[submission_id for submission_id, _, _ in chunk]) \
+            .update(result=JudgeStatus.PENDING)
+        for submission_id, problem_id, _ in chunk:
+            low_priority_judge_task.send(submission_id, problem_id, PendingTaskPriority.LOW, rejudge=True)
+        job.cursor, _, job.cursor_time = chunk[-1]
+        job.enqueued += len(chunk)
+        job.progress_time = now
+        job.stalled_resends = 0
+    elif not inflight:
+        reconcile_problem_counters(submissions.order_by().values_list("problem_id", flat=True).distinct())
+        job.status = RejudgeJobStatus.FINISHED
+        job.finish_time = now
+    elif now - job.progress_time > timedelta(seconds=REJUDGE_STALL_TIMEOUT):
+        _handle_stalled(job, submissions.exclude(after_cursor), low_priority_judge_task.send)
+        job.progress_time = now
+    job.save()
+
+    if job.status != RejudgeJobStatus.FINISHED:
+        rejudge_job_task.send_with_options(args=(job.id,), delay=REJUDGE_TICK_DELAY)
+
+
+def _handle_stalled(job, enqueued, send):
+    """
+    处理已投递但一直没有判完的提交。在等待队列中的提交是在等空闲的判题机，不算卡住；
+    其余的先重新投递，重新投递REJUDGE_MAX_RESENDS次之后仍然没有判完的标记为系统错误，任务才能结束
+    """
+    stalled = list(enqueued.filter(result__in=[JudgeStatus.PENDING, JudgeStatus.JUDGING])
+                   .exclude(Exists(PendingTask.objects.filter(submission_id=OuterRef("id"))))
+                   .values_list("id", "problem_id"))
+    if job.stalled_resends < REJUDGE_MAX_RESENDS:
+        for submission_id, problem_id in stalled:
+            send(submission_id, problem_id, PendingTaskPriority.LOW, rejudge=True)
+        job.stalled_resends += 1
+        return
+    # 标记之前刚好判完的提交保留判题结果
+    Submission.objects.filter(id__in=[submission_id for submission_id, _ in stalled],
+                              result__in=[JudgeStatus.PENDING, JudgeStatus.JUDGING]) \
+        .update(result=JudgeStatus.SYSTEM_ERROR)
+    for submission_id, _ in stalled:
+        publish_judge_event(submission_id, JudgeEventType.FINISHED, result=JudgeStatus.SYSTEM_ERROR)
+
+
+def reconcile_problem_counters(problem_ids):
+    """
+    根据提交记录一次性重新计算题目的attempt_cnt(提交数)、pass_cnt(通过的提交数)和pass_users
+    与判题时的增量一致，只统计已经有判题结果的提交：仍在PENDING/JUDGING的提交判完时会再记录一次增量
+    """
+    problem_ids = list(problem_ids)
+    PassUsers = Problem.pass_users.through
+    with transaction.atomic():
+        # 尚未合并的增量已经包含在重新统计的结果中
+        ProblemCounterDelta.objects.filter(problem_id__in=problem_ids).delete()
+        stats = {item["problem_id"]: item for item in
+                 Submission.objects.filter(problem_id__in=problem_ids)
+                 .exclude(result__in=[JudgeStatus.PENDING, JudgeStatus.JUDGING]).order_by().values("problem_id")
+                 .annotate(attempt_cnt=Count("id"), pass_cnt=Count("id", filter=Q(result=JudgeStatus.ACCEPTED)))}
+        problems = [Problem(id=problem_id,
+                            attempt_cnt=stats.get(problem_id, {}).get("attempt_cnt", 0),
+                            pass_cnt=stats.get(problem_id, {}).get("pass_cnt", 0)) for problem_id in problem_ids]
+        passed = list(Submission.objects.filter(problem_id__in=problem_ids, result=JudgeStatus.ACCEPTED,
+                                                user_id__in=User.objects.values("id"))
+                      .order_by().values_list("problem_id", "user_id").distinct())
+        old_passed = set(PassUsers.objects.filter(problem_id__in=problem_ids).values_list("problem_id", "user_id"))
+
+        Problem.objects.bulk_update(problems, ["attempt_cnt", "pass_cnt"])
+        PassUsers.objects.filter(problem_id__in=problem_ids).delete()
+        PassUsers.objects.bulk_create([PassUsers(problem_id=problem_id, user_id=user_id)
+                                       for problem_id, user_id in passed])
+        invalidate_user_problem_status({user_id for _, user_id in old_passed.symmetric_difference(passed)})
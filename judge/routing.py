@@ -0,0 +1,144 @@
+import hashlib
+
+from django.core.cache import cache
+
+from conf.conf import SysConfigs
+from judge.slots import JudgeSlotAllocator
+from utils.constants import CacheKey
+
+routing_policies = {}
+
+
+def register_routing_policy(cls):
+    """
+    注册一个判题服务器路由策略，注册后即可在SysConfigs.judge_server_routing中按name选用
+    """
+    routing_policies[cls.name] = cls()
+    return cls
+
+
+def get_routing_policy():
+    return routing_policies.get(SysConfigs.judge_server_routing, routing_policies[LeastLoadedPolicy.name])
+
+
+class JudgeLatencyTracker:
+    """
+    各判题服务器判题耗时(秒)的指数加权移动平均(EWMA)，保存在缓存中，多个进程共享；
+    并发更新时可能丢失个别样本，对平均值的影响可以忽略
+    """
+    alpha = 0.2
+    # 请求失败时按当前平均耗时的倍数计入，避免快速失败的服务器显得很快
+    failure_penalty = 2
+
+    @staticmethod
+    def _key(server_id):
+        return f"{CacheKey.judge_server_latency}:{server_id}"
+
+    @classmethod
+    def observe(cls, server_id, latency, failed=False):
+        key = cls._key(server_id)
+        stats = cache.get(key)
+        if stats is None:
+            stats = {"latency": latency, "samples": 0, "failures": 0}
+        if failed:
+            latency = max(latency, stats["latency"] * cls.failure_penalty)
+            stats["failures"] += 1
+        if stats["samples"]:
+            stats["latency"] = cls.alpha * latency + (1 - cls.alpha) * stats["latency"]
+        else:
+            stats["latency"] = latency
+        stats["samples"] += 1
+        cache.set(key, stats, timeout=None)
+
+    @classmethod
+    def stats(cls, server_ids):
+        """
+        返回{server_id: {latency, samples, failures}}，没有样本的服务器为None
+        """
+        keys = {cls._key(server_id): server_id for server_id in server_ids}
+        values = cache.get_many(keys.keys())
+        return {server_id: values.get(key) for key, server_id in keys.items()}
+
+
+class RoutingPolicy:
+    name = None
+
+    def order(self, servers, used, test_case_id=None):
+        """
+        :param servers: 在线的判题服务器列表
+        :param used: {server_id: 已用槽位数}
+        :param test_case_id: 本次判题使用的测试数据
+        :return: 依次尝试占用槽位的服务器列表，靠前的服务器槽位已满时使用后面的
+        """
+        raise NotImplementedError()
+
+
+@register_routing_policy
+class LeastLoadedPolicy(RoutingPolicy):
+    """
+    优先选择已用槽位最少的服务器
+    """
+    name = "least_loaded"
+
+    def order(self, servers, used, test_case_id=None):
+        return sorted(servers, key=lambda s: used[s.id])
+
+
+@register_routing_policy
+class TestCaseAffinityPolicy(RoutingPolicy):
+    """
+    判题服务器按test_case_id缓存测试数据，同一组测试数据尽量发往同一批服务器，避免热门题目的数据在每台服务器上都冷加载一次
+    使用rendezvous hashing为每个test_case_id选出固定的replicas台首选服务器，服务器上下线只影响与之相关的测试数据；
+    首选服务器槽位都满时退化为按负载选择其余服务器
+    """
+    name = "test_case_affinity"
+    replicas = 2
+
+    @staticmethod
+    def _score(test_case_id, server):
+        digest = hashlib.md5(f"{test_case_id}:{server.hostname}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def order(self, servers, used, test_case_id=None):
+        if not test_case_id:
+            return sorted(servers, key=lambda s: used[s.id])
+        ranked = sorted(servers, key=lambda s: self._score(test_case_id, s), reverse=True)
+        preferred = sorted(ranked[:self.replicas], key=lambda s: used[s.id])
+        others = sorted(ranked[self.replicas:], key=lambda s: used[s.id])
+        return preferred + others
+
+
+@register_routing_policy
+class ExpectedCompletionPolicy(RoutingPolicy):
+    """
+    按预计完成时间从小到大选择服务器，适用于配置不同的判题服务器混合部署：
+    预计完成时间 = 判题耗时的EWMA * (已用槽位数 + 1) / 槽位数 * (1 + cpu_weight * CPU使用率 + memory_weight * 内存使用率)
+    还没有耗时样本的服务器使用其它服务器的平均值
+    """
+    name = "expected_completion"
+    cpu_weight = 1.0
+    memory_weight = 0.5
+    default_latency = 1.0
+
+    def scores(self, servers, used):
+        """
+        返回{server_id: {latency, samples, failures, load, score}}，用于选择服务器以及查看调度状态
+        """
+        stats = JudgeLatencyTracker.stats([s.id for s in servers])
+        known = [item["latency"] for item in stats.values() if item]
+        default_latency = sum(known) / len(known) if known else self.default_latency
+
+        result = {}
+        for server in servers:
+            item = stats[server.id] or {"latency": default_latency, "samples": 0, "failures": 0}
+            # 心跳上报的使用率为百分比
+            load = 1 + self.cpu_weight * min(max(server.cpu_usage, 0), 100) / 100 + \
+                self.memory_weight * min(max(server.memory_usage, 0), 100) / 100
+            capacity = max(JudgeSlotAllocator.capacity(server), 1)
+            score = item["latency"] * (used[server.id] + 1) / capacity * load
+            result[server.id] = {**item, "load": load, "score": score}
+        return result
+
+    def order(self, servers, used, test_case_id=None):
+        scores = self.scores(servers, used)
+        return sorted(servers, key=lambda s: scores[s.id]["score"])
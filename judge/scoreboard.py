@@ -0,0 +1,141 @@
+import copy
+import threading
+
+from sortedcontainers import SortedList
+
+from submission.models import JudgeStatus
+
+# ACM赛制中每次错误提交的罚时(秒)
+ACM_PENALTY_TIME = 20 * 60
+
+
+class Scoreboard:
+    """
+    单个比赛的排行榜，排名信息以数据库为准
+    1. 判题结束时在数据库中对用户的排名记录加锁后用apply计算新的排名信息并保存
+    2. entries保存每个用户的排名信息，ranking是按排序键有序的SortedList，更新一个用户只需移除并重新插入，O(log n)
+    3. 排序键相同时按user_id排序，保证名次稳定
+    """
+    def __init__(self, contest_id):
+        self.contest_id = contest_id
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.ranking = SortedList()
+
+    @staticmethod
+    def new_entry(user_id):
+        raise NotImplementedError()
+
+    @staticmethod
+    def sort_key(entry):
+        raise NotImplementedError()
+
+    @classmethod
+    def fields(cls):
+        """
+        排名信息中的字段，与数据库中排名记录的字段同名
+        """
+        return list(cls.new_entry(None))
+
+    @staticmethod
+    def apply(entry, *args):
+        """
+        根据一次判题结果修改排名信息entry
+        """
+        raise NotImplementedError()
+
+    def put(self, entry):
+        """
+        用新的排名信息替换用户在排行榜中的排名信息
+        """
+        entry = copy.deepcopy(entry)
+        user_id = entry["user_id"]
+        with self.lock:
+            old = self.entries.get(user_id)
+            if old is not None:
+                self.ranking.remove((self.sort_key(old), user_id))
+            self.entries[user_id] = entry
+            self.ranking.add((self.sort_key(entry), user_id))
+
+    def load(self, entries):
+        """
+        用数据库中持久化的排名信息重建排行榜
+        """
+        with self.lock:
+            self.entries = {entry["user_id"]: copy.deepcopy(entry) for entry in entries}
+            self.ranking = SortedList((self.sort_key(entry), user_id) for user_id, entry in self.entries.items())
+
+    def rank(self, user_id):
+        """
+        返回用户的名次(从1开始)，没有提交过返回None
+        """
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            return self.ranking.index((self.sort_key(entry), user_id)) + 1
+
+    def page(self, offset, limit):
+        with self.lock:
+            return [{**copy.deepcopy(self.entries[user_id]), "rank": offset + i + 1}
+                    for i, (_, user_id) in enumerate(self.ranking.islice(offset, offset + limit))]
+
+    def __len__(self):
+        return len(self.ranking)
+
+
+class ACMScoreboard(Scoreboard):
+    """
+    通过题数多的在前，通过题数相同时罚时少的在前；
+    罚时为每道通过的题目的通过时间加上之前的错误次数乘ACM_PENALTY_TIME，编译错误不计入
+    """
+    @staticmethod
+    def new_entry(user_id):
+        return {"user_id": user_id, "submission_number": 0, "accepted_number": 0, "total_time": 0,
+                "submission_info": {}}
+
+    @staticmethod
+    def sort_key(entry):
+        return -entry["accepted_number"], entry["total_time"]
+
+    @staticmethod
+    def apply(entry, problem_id, result, submit_time, first_ac=False):
+        """
+        submit_time为提交时间距比赛开始的秒数，first_ac为这次提交是否是这道题目的第一个通过(由数据库中题目的通过数判断)
+        """
+        problem_id = str(problem_id)
+        info = entry["submission_info"].setdefault(problem_id, {"is_ac": False, "ac_time": 0, "error_number": 0,
+                                                                "is_first_ac": False})
+        # 已经通过的题目再提交不影响排名
+        if info["is_ac"]:
+            return
+        entry["submission_number"] += 1
+        if result == JudgeStatus.ACCEPTED:
+            entry["accepted_number"] += 1
+            info["is_ac"] = True
+            info["ac_time"] = submit_time
+            entry["total_time"] += submit_time + info["error_number"] * ACM_PENALTY_TIME
+            info["is_first_ac"] = first_ac
+        elif result != JudgeStatus.COMPILE_ERROR:
+            info["error_number"] += 1
+
+
+class OIScoreboard(Scoreboard):
+    """
+    按总分排序，每道题取最后一次提交的得分
+    """
+    @staticmethod
+    def new_entry(user_id):
+        return {"user_id": user_id, "submission_number": 0, "total_score": 0, "submission_info": {}}
+
+    @staticmethod
+    def sort_key(entry):
+        return -entry["total_score"]
+
+    @staticmethod
+    def apply(entry, problem_id, score):
+        problem_id = str(problem_id)
+        entry["submission_number"] += 1
+        entry["total_score"] += score - entry["submission_info"].get(problem_id, 0)
+        entry["submission_info"][problem_id] = score
+
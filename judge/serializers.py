@@ -0,0 +1,13 @@
+from rest_framework import serializers
+
+
+class RejudgeSerializer(serializers.Serializer):
+    problem_id = serializers.IntegerField(required=False)
+    start_time = serializers.DateTimeField(required=False)
+    end_time = serializers.DateTimeField(required=False)
+    concurrency = serializers.IntegerField(min_value=1, max_value=64, default=4)
+
+    def validate(self, attrs):
+        if not any(attrs.get(key) for key in ("problem_id", "start_time", "end_time")):
+            raise serializers.ValidationError("请指定要重判的题目或时间段")
+        return attrs
@@ -0,0 +1,46 @@
+from django.core.cache import cache
+
+from utils.cache import incr_or_init
+from utils.constants import CacheKey
+
+
+class JudgeSlotAllocator:
+    """
+    判题槽位分配器，每个判题服务器的已用槽位数保存在缓存的计数器中
+    incr/decr是原子操作，分配和释放都不需要对judge_server表加锁；
+    多进程部署时缓存需要使用redis/memcached等共享的后端
+    """
+    @staticmethod
+    def _key(server_id):
+        return f"{CacheKey.judge_server_slots}:{server_id}"
+
+    @classmethod
+    def acquire(cls, server_id, capacity):
+        """
+        尝试占用一个槽位，已用槽位数达到capacity时失败，返回是否成功
+        """
+        key = cls._key(server_id)
+        if incr_or_init(key) > capacity:
+            cls.release(server_id)
+            return False
+        return True
+
+    @classmethod
+    def release(cls, server_id):
+        try:
+            cache.decr(cls._key(server_id))
+        except ValueError:
+            pass
+
+    @classmethod
+    def used(cls, server_ids):
+        """
+        批量获取各判题服务器的已用槽位数，返回{server_id: used}
+        """
+        keys = {cls._key(server_id): server_id for server_id in server_ids}
+        values = cache.get_many(keys.keys())
+        return {server_id: values.get(key, 0) for key, server_id in keys.items()}
+
+    @staticmethod
+    def capacity(server):
+        return server.cpu_core * 2
@@ -1,13 +1,59 @@
 import dramatiq
+from django.conf import settings
 
-from account.models import User
-from submission.models import Submission
+from judge.admission import AdmissionController
+from judge.async_dispatch import get_async_judge_runner
+from judge.counters import ProblemCounters
 from judge.dispatcher import JudgeDispatcher
+from judge.leases import JudgeLeases
+from judge.models import PendingTaskPriority
 
 
-@dramatiq.actor(time_limit=3600_000, max_retries=0, max_age=7200_000)
-def judge_task(submission_id, problem_id):
-    uid = Submission.objects.get(id=submission_id).user_id
-    if User.objects.get(id=uid).is_disabled:
+def _judge(submission_id, problem_id, priority, **options):
+    if settings.JUDGE_DISPATCH_MODE == "async":
+        get_async_judge_runner().submit(submission_id, problem_id, priority, **options)
         return
-    JudgeDispatcher(submission_id, problem_id).judge()
+    try:
+        JudgeDispatcher(submission_id, problem_id, priority, **options).judge()
+    except Exception:
+        # 判题结束时由JudgeDispatcher释放准入名额，异常退出时在这里释放
+        AdmissionController.release(submission_id)
+        raise
+
+
+@dramatiq.actor(time_limit=3600_000, max_retries=0, max_age=7200_000)
+def judge_task(submission_id, problem_id, priority=PendingTaskPriority.NORMAL, bypass_verdict_cache=False,
+               rejudge=False):
+    _judge(submission_id, problem_id, priority, bypass_verdict_cache=bypass_verdict_cache, rejudge=rejudge)
+
+
+# 重判等低优先级的判题任务使用单独的队列，不会排在正常提交的前面
+@dramatiq.actor(queue_name="low_priority_judge", priority=100, time_limit=3600_000, max_retries=0)
+def low_priority_judge_task(submission_id, problem_id, priority=PendingTaskPriority.LOW, bypass_verdict_cache=False,
+                            rejudge=False):
+    _judge(submission_id, problem_id, priority, bypass_verdict_cache=bypass_verdict_cache, rejudge=rejudge)
+
+
+def send_judge_task(submission_id, problem_id, priority=PendingTaskPriority.NORMAL, **options):
+    """
+    按优先级把判题任务投递到对应的队列
+    """
+    actor = low_priority_judge_task if priority == PendingTaskPriority.LOW else judge_task
+    actor.send(submission_id, problem_id, priority, **options)
+
+
+@dramatiq.actor(queue_name="rejudge_job", max_retries=3)
+def rejudge_job_task(job_id):
+    # 防止循环引入
+    from judge.rejudge import run_rejudge_job
+    run_rejudge_job(job_id)
+
+
+@dramatiq.actor(queue_name="problem_counter", max_retries=3)
+def flush_problem_counters_task():
+    ProblemCounters.flush_all()
+
+
+@dramatiq.actor(queue_name="judge_lease", max_retries=3)
+def sweep_judge_leases_task():
+    JudgeLeases.sweep(send_judge_task)
@@ -1,7 +1,43 @@
+import asyncio
+import copy
+import random
+from datetime import timedelta
+from unittest import mock
+
+import dramatiq
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from dramatiq.brokers.stub import StubBroker
 
+from account.models import User, UserType
+from benchmarks.stub_judge_server import StubJudgeServer, StubJudgeConfig
 from conf.conf import SysConfigs
-from judge.dispatcher import process_pending_task
+from judge.admission import AdmissionController, AdmissionRejected
+from judge.async_dispatch import AsyncJudgeDispatcher, AsyncJudgeRunner
+from judge.client import JudgeServerClient, AsyncJudgeServerClient
+from judge.counters import ProblemCounters
+from judge.dispatcher import process_pending_task, ChooseJudgeServer, JudgeDispatcher
+from judge.events import JudgeEventHub, LocalBackend, CacheBackend, Subscription
+from judge.leases import JudgeLeases
+from judge.models import PendingTask, PendingTaskPriority, JudgeServer, RejudgeJob, RejudgeJobStatus, \
+    ProblemCounterDelta, JudgeLease
+from judge.pending import PendingQueue
+from judge.registry import JudgeServerRegistry
+from judge.routing import TestCaseAffinityPolicy, LeastLoadedPolicy, ExpectedCompletionPolicy, JudgeLatencyTracker, \
+    get_routing_policy
+from judge.scoreboard import ACMScoreboard, OIScoreboard, ACM_PENALTY_TIME
+from judge.slots import JudgeSlotAllocator
+from judge.verdict_cache import VerdictCache
+from problem.models import Problem, ProblemRuleType
+from problem.tests import DEFAULT_PROBLEM_DATA
+from problem.user_status import UserProblemStatus
+from submission.models import JudgeStatus, Submission, SubmissionOutput
+
+dramatiq.set_broker(StubBroker())
 
 
 class JudgeTestCase(TestCase):
@@ -9,3 +45,861 @@ class JudgeTestCase(TestCase):
         # print(SysConfigs.languages)
         print(list(filter(lambda item: "C++" == item["name"], SysConfigs.languages))[0])
         # process_pending_task()
+
+
+class PendingQueueTestCase(TestCase):
+    def test_fifo_within_priority(self):
+        """
+        高优先级的任务先出队，同一优先级内先进先出
+        """
+        PendingQueue.push("a", 1, PendingTaskPriority.LOW)
+        PendingQueue.push("b", 1)
+        PendingQueue.push("c", 2, PendingTaskPriority.HIGH)
+        PendingQueue.push("d", 2)
+
+        ids = [task["submission_id"] for task in PendingQueue.pop(4)]
+        self.assertEqual(ids, ["c", "b", "d", "a"])
+
+    def test_pop_removes_tasks(self):
+        for i in range(5):
+            PendingQueue.push(str(i), 1, rejudge=True)
+        tasks = PendingQueue.pop(3)
+        self.assertEqual([task["submission_id"] for task in tasks], ["0", "1", "2"])
+        self.assertEqual(tasks[0], {"submission_id": "0", "problem_id": 1, "priority": PendingTaskPriority.NORMAL,
+                                    "rejudge": True})
+        self.assertEqual(PendingQueue.size(), 2)
+        self.assertEqual(PendingQueue.pop(0), [])
+        self.assertEqual(len(PendingQueue.pop(10)), 2)
+        self.assertEqual(PendingQueue.pop(), [])
+
+    def test_send_failure_keeps_tasks(self):
+        """
+        投递失败时，失败的任务和之后的任务留在队列中
+        """
+        for i in range(3):
+            PendingQueue.push(str(i), 1)
+        sent = []
+
+        def send(submission_id, **kwargs):
+            if submission_id == "1":
+                raise ConnectionError()
+            sent.append(submission_id)
+
+        with self.assertRaises(ConnectionError):
+            PendingQueue.pop(3, send=send)
+        self.assertEqual(sent, ["0"])
+        self.assertEqual([task["submission_id"] for task in PendingQueue.pop(3)], ["1", "2"])
+
+    def test_push_duplicate(self):
+        """
+        同一个提交重复入队只保留一份
+        """
+        PendingQueue.push("a", 1)
+        PendingQueue.push("a", 1)
+        self.assertEqual(PendingTask.objects.count(), 1)
+
+    def test_process_without_free_server(self):
+        """
+        没有可用的判题机时不会取出任务
+        """
+        PendingQueue.push("a", 1)
+        process_pending_task()
+        self.assertEqual(PendingQueue.size(), 1)
+
+
+class JudgeLeasesTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="test", email="123@qq.com", password="password")
+        problem = Problem.objects.create(**DEFAULT_PROBLEM_DATA)
+        for submission_id, result in [("lost", JudgeStatus.JUDGING), ("finished", JudgeStatus.ACCEPTED),
+                                      ("waiting", JudgeStatus.PENDING), ("running", JudgeStatus.JUDGING)]:
+            Submission.objects.create(id=submission_id, problem=problem, user_id=user.id, username=user.username,
+                                      code="", language="C++", result=result)
+            JudgeLeases.acquire(submission_id, problem.id, PendingTaskPriority.LOW, rejudge=True)
+        PendingQueue.push("waiting", problem.id)
+        JudgeLease.objects.exclude(submission_id="running").update(expire_time=timezone.now() - timedelta(seconds=1))
+        self.problem = problem
+
+    def test_sweep(self):
+        """
+        租约过期且没有判完、不在等待队列中的提交重新投递，过期的租约都被删除
+        """
+        sent = []
+        self.assertEqual(JudgeLeases.sweep(lambda *args, **kwargs: sent.append((args, kwargs))), 1)
+        self.assertEqual(sent, [(("lost", self.problem.id, PendingTaskPriority.LOW), {"rejudge": True})])
+        self.assertEqual(list(JudgeLease.objects.values_list("submission_id", flat=True)), ["running"])
+
+        JudgeLeases.release("running")
+        self.assertFalse(JudgeLease.objects.exists())
+
+    def test_send_failure_keeps_leases(self):
+        def send(*args, **kwargs):
+            raise ConnectionError()
+
+        with self.assertRaises(ConnectionError):
+            JudgeLeases.sweep(send)
+        self.assertEqual(JudgeLease.objects.count(), 4)
+
+
+class JudgeServerClientTestCase(TestCase):
+    def test_post(self):
+        client = JudgeServerClient()
+        with StubJudgeServer() as server:
+            resp = client.post(server.service_url + "/judge", json={"src": ""})
+            # 同一个连接池中的连接被复用
+            client.post(server.service_url + "/judge", json={"src": ""})
+        client.close()
+        self.assertIsNone(resp["err"])
+        self.assertEqual(resp["data"][0]["result"], 0)
+
+    def test_server_unavailable(self):
+        """
+        判题服务器无法连接时返回None，而不是抛出异常
+        """
+        client = JudgeServerClient(connect_timeout=0.5, max_retries=0)
+        self.assertIsNone(client.post("http://127.0.0.1:1/judge", json={}))
+
+
+def heartbeat_data(hostname="judger", cpu_core=1, cpu=0):
+    return {"hostname": hostname, "judger_version": "2.0.0", "cpu_core": cpu_core, "memory": 0, "cpu": cpu,
+            "action": "heartbeat", "service_url": f"http://{hostname}:8080"}
+
+
+def create_judge_server(hostname="judger", cpu_core=1):
+    """
+    模拟判题服务器发送一次心跳，使其出现在注册表中
+    """
+    JudgeServerRegistry.heartbeat(heartbeat_data(hostname, cpu_core), "127.0.0.1")
+    return JudgeServer.objects.get(hostname=hostname)
+
+
+class JudgeSlotAllocatorTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_acquire_release(self):
+        self.assertTrue(JudgeSlotAllocator.acquire(1, 2))
+        self.assertTrue(JudgeSlotAllocator.acquire(1, 2))
+        # 槽位已满
+        self.assertFalse(JudgeSlotAllocator.acquire(1, 2))
+        self.assertEqual(JudgeSlotAllocator.used([1, 2]), {1: 2, 2: 0})
+        JudgeSlotAllocator.release(1)
+        self.assertTrue(JudgeSlotAllocator.acquire(1, 2))
+
+
+class ChooseJudgeServerTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_choose_least_used(self):
+        server1 = create_judge_server("judger1", cpu_core=1)
+        server2 = create_judge_server("judger2", cpu_core=1)
+        with ChooseJudgeServer() as s1, ChooseJudgeServer() as s2:
+            self.assertEqual({s1.id, s2.id}, {server1.id, server2.id})
+            self.assertEqual(JudgeSlotAllocator.used([server1.id, server2.id]), {server1.id: 1, server2.id: 1})
+        # 退出后释放槽位
+        self.assertEqual(JudgeSlotAllocator.used([server1.id, server2.id]), {server1.id: 0, server2.id: 0})
+
+    def test_no_free_server(self):
+        create_judge_server("judger1", cpu_core=1)
+        JudgeServer.objects.create(hostname="disabled", judger_version="2.0.0", cpu_core=1, memory_usage=0,
+                                   cpu_usage=0, last_heartbeat=timezone.now(), is_disabled=True)
+        create_judge_server("disabled")
+        create_judge_server("abnormal")
+        key = JudgeServerRegistry._key("abnormal")
+        cache.set(key, {**cache.get(key), "last_heartbeat": timezone.now() - timedelta(seconds=60)}, timeout=None)
+        with ChooseJudgeServer() as s1, ChooseJudgeServer() as s2, ChooseJudgeServer() as s3:
+            self.assertEqual(s1.hostname, "judger1")
+            self.assertEqual(s2.hostname, "judger1")
+            self.assertIsNone(s3)
+
+
+class JudgeServerRegistryTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_new_server_persisted(self):
+        JudgeServerRegistry.heartbeat(heartbeat_data("judger1", cpu_core=4), "127.0.0.1")
+        server = JudgeServer.objects.get(hostname="judger1")
+        self.assertEqual(server.cpu_core, 4)
+        self.assertEqual(server.ip, "127.0.0.1")
+        self.assertEqual([s.id for s in JudgeServerRegistry.live_servers()], [server.id])
+
+    def test_batched_flush(self):
+        """
+        两次flush之间的心跳只更新注册表，flush时批量写回数据库
+        """
+        JudgeServerRegistry.heartbeat(heartbeat_data("judger1"))
+        JudgeServerRegistry.heartbeat(heartbeat_data("judger2"))
+        JudgeServerRegistry.heartbeat(heartbeat_data("judger1", cpu=50))
+        self.assertEqual(JudgeServer.objects.get(hostname="judger1").cpu_usage, 0)
+        self.assertEqual(JudgeServerRegistry.live_servers()[0].cpu_usage, 50)
+
+        with self.assertNumQueries(3):
+            JudgeServerRegistry.flush()
+        self.assertEqual(JudgeServer.objects.get(hostname="judger1").cpu_usage, 50)
+
+    def test_sync_disabled(self):
+        server = create_judge_server("judger1")
+        JudgeServer.objects.filter(id=server.id).update(is_disabled=True)
+        self.assertEqual(len(JudgeServerRegistry.live_servers()), 1)
+        JudgeServerRegistry.flush()
+        self.assertEqual(JudgeServerRegistry.live_servers(), [])
+
+    def test_fallback_to_database(self):
+        """
+        注册表为空时(例如心跳落在了其它进程)从数据库读取心跳正常的服务器
+        """
+        server = create_judge_server("judger1")
+        create_judge_server("abnormal")
+        JudgeServer.objects.filter(hostname="abnormal").update(last_heartbeat=timezone.now() - timedelta(seconds=60))
+        cache.clear()
+        self.assertEqual([s.id for s in JudgeServerRegistry.live_servers()], [server.id])
+
+
+class RoutingPolicyTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.servers = [JudgeServer(id=i, hostname=f"judger{i}", cpu_core=1) for i in range(1, 6)]
+
+    def test_least_loaded(self):
+        used = {1: 2, 2: 0, 3: 1, 4: 2, 5: 2}
+        self.assertEqual([s.id for s in LeastLoadedPolicy().order(self.servers, used)][:2], [2, 3])
+
+    def test_affinity_stable(self):
+        """
+        同一个test_case_id总是优先选择相同的服务器，且与服务器列表的顺序无关
+        """
+        policy = TestCaseAffinityPolicy()
+        used = {s.id: 0 for s in self.servers}
+        preferred = {s.id for s in policy.order(self.servers, used, "problem_1")[:policy.replicas]}
+        reordered = {s.id for s in policy.order(self.servers[::-1], used, "problem_1")[:policy.replicas]}
+        self.assertEqual(preferred, reordered)
+        # 去掉一台非首选服务器不影响首选服务器
+        removed = next(s for s in self.servers if s.id not in preferred)
+        others = [s for s in self.servers if s is not removed]
+        self.assertEqual({s.id for s in policy.order(others, used, "problem_1")[:policy.replicas]}, preferred)
+
+    def test_affinity_fallback(self):
+        """
+        首选服务器的槽位已满时退化为选择负载最低的服务器
+        """
+        create_judge_server("judger1")
+        create_judge_server("judger2")
+        create_judge_server("judger3")
+        SysConfigs.judge_server_routing = TestCaseAffinityPolicy.name
+        self.assertIsInstance(get_routing_policy(), TestCaseAffinityPolicy)
+
+        # 每台服务器2个槽位，首选的2台服务器共4个槽位
+        with ChooseJudgeServer("problem_1") as s1, ChooseJudgeServer("problem_1") as s2, \
+                ChooseJudgeServer("problem_1") as s3, ChooseJudgeServer("problem_1") as s4, \
+                ChooseJudgeServer("problem_1") as s5:
+            self.assertEqual(len({s.id for s in (s1, s2, s3, s4)}), 2)
+            self.assertNotIn(s5.id, {s.id for s in (s1, s2, s3, s4)})
+
+
+class ExpectedCompletionPolicyTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.servers = [JudgeServer(id=i, hostname=f"judger{i}", cpu_core=1, cpu_usage=0, memory_usage=0)
+                        for i in range(1, 4)]
+        self.used = {s.id: 0 for s in self.servers}
+
+    def test_ewma(self):
+        JudgeLatencyTracker.observe(1, 1.0)
+        JudgeLatencyTracker.observe(1, 2.0)
+        stats = JudgeLatencyTracker.stats([1, 2])
+        self.assertAlmostEqual(stats[1]["latency"], 0.2 * 2.0 + 0.8 * 1.0)
+        self.assertEqual(stats[1]["samples"], 2)
+        self.assertIsNone(stats[2])
+
+        # 失败的请求至少按当前平均耗时的failure_penalty倍计入
+        JudgeLatencyTracker.observe(1, 0.1, failed=True)
+        stats = JudgeLatencyTracker.stats([1])[1]
+        self.assertAlmostEqual(stats["latency"], 0.2 * 1.2 * 2 + 0.8 * 1.2)
+        self.assertEqual(stats["failures"], 1)
+
+    def test_prefer_fast_server(self):
+        JudgeLatencyTracker.observe(1, 3.0)
+        JudgeLatencyTracker.observe(2, 1.0)
+        JudgeLatencyTracker.observe(3, 1.5)
+        policy = ExpectedCompletionPolicy()
+        self.assertEqual([s.id for s in policy.order(self.servers, self.used)], [2, 3, 1])
+        # 最快的服务器占用一个槽位后，预计完成时间超过稍慢的空闲服务器
+        self.used[2] = 1
+        self.assertEqual([s.id for s in policy.order(self.servers, self.used)], [3, 2, 1])
+
+    def test_prefer_idle_server(self):
+        for server in self.servers:
+            JudgeLatencyTracker.observe(server.id, 1.0)
+        self.servers[0].cpu_usage = 90
+        self.servers[1].memory_usage = 90
+        self.assertEqual([s.id for s in ExpectedCompletionPolicy().order(self.servers, self.used)], [3, 2, 1])
+
+    def test_default_latency(self):
+        """
+        没有样本的服务器使用其它服务器的平均耗时
+        """
+        JudgeLatencyTracker.observe(1, 1.0)
+        JudgeLatencyTracker.observe(2, 3.0)
+        scores = ExpectedCompletionPolicy().scores(self.servers, self.used)
+        self.assertEqual(scores[3]["latency"], 2.0)
+        self.assertEqual(scores[3]["samples"], 0)
+
+    def test_stats_api(self):
+        url = reverse("judge_server_stats_api")
+        user = User.objects.create_user(username="test", email="123@qq.com", password="password")
+        self.client.login(email="123@qq.com", password="password")
+        self.assertEqual(self.client.get(url).data["msg"], "用户无权限！")
+
+        User.objects.filter(id=user.id).update(user_type=UserType.ADMIN)
+        server = create_judge_server("judger1")
+        JudgeLatencyTracker.observe(server.id, 1.5)
+        data = self.client.get(url).data["data"]
+        self.assertEqual(len(data["servers"]), 1)
+        self.assertEqual(data["servers"][0]["hostname"], "judger1")
+        self.assertEqual(data["servers"][0]["latency"], 1.5)
+        self.assertEqual(data["servers"][0]["capacity"], 2)
+
+
+class AdmissionControllerTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        SysConfigs.judge_admission = {"user_inflight": 2, "global_inflight": 3, "retry_after": 7}
+
+    def test_user_limit(self):
+        AdmissionController.admit("a", 1)
+        AdmissionController.admit("b", 1)
+        with self.assertRaises(AdmissionRejected) as cm:
+            AdmissionController.admit("c", 1)
+        self.assertEqual(cm.exception.retry_after, 7)
+        # 被拒绝的提交不占用名额
+        self.assertEqual(AdmissionController.inflight(1), 2)
+        self.assertEqual(AdmissionController.inflight(), 2)
+
+        AdmissionController.release("a")
+        AdmissionController.admit("c", 1)
+        self.assertEqual(AdmissionController.inflight(1), 2)
+
+    def test_global_limit(self):
+        AdmissionController.admit("a", 1)
+        AdmissionController.admit("b", 2)
+        AdmissionController.admit("c", 3)
+        with self.assertRaises(AdmissionRejected):
+            AdmissionController.admit("d", 4)
+        self.assertEqual(AdmissionController.inflight(4), 0)
+        self.assertEqual(AdmissionController.inflight(), 3)
+
+    def test_rejected_keeps_ttl(self):
+        """
+        被拒绝的提交不延长计数器的过期时间
+        """
+        AdmissionController.admit("a", 1)
+        AdmissionController.admit("b", 1)
+        with mock.patch.object(cache, "touch") as touch:
+            with self.assertRaises(AdmissionRejected):
+                AdmissionController.admit("c", 1)
+            touch.assert_not_called()
+            AdmissionController.admit("d", 2)
+            self.assertEqual(touch.call_count, 2)
+
+    def test_release_once(self):
+        """
+        重复release以及没有被准入的提交(如重判)不会多减
+        """
+        AdmissionController.admit("a", 1)
+        AdmissionController.admit("b", 1)
+        AdmissionController.release("a")
+        AdmissionController.release("a")
+        AdmissionController.release("rejudged")
+        self.assertEqual(AdmissionController.inflight(1), 1)
+        self.assertEqual(AdmissionController.inflight(), 1)
+
+
+class VerdictCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.problem = Problem(id=1, test_case_id="tc", time_limit=1000, memory_limit=256)
+        self.resp = {"err": None, "data": [{"test_case": "1", "result": 0, "cpu_time": 1, "memory": 1024}]}
+
+    def test_key(self):
+        key = VerdictCache.key("code", "C++", self.problem)
+        self.assertEqual(key, VerdictCache.key("code", "C++", self.problem))
+        self.assertNotEqual(key, VerdictCache.key("code ", "C++", self.problem))
+        self.assertNotEqual(key, VerdictCache.key("code", "C", self.problem))
+        self.problem.test_case_id = "tc2"
+        self.assertNotEqual(key, VerdictCache.key("code", "C++", self.problem))
+        self.problem.time_limit = 2000
+        self.assertNotEqual(key, VerdictCache.key("code", "C++", self.problem))
+        self.assertNotEqual(VerdictCache.key("code", "C++", self.problem),
+                            VerdictCache.key("code", "C++", self.problem, fail_fast=True))
+
+    def test_hit_and_miss(self):
+        key = VerdictCache.key("code", "C++", self.problem)
+        self.assertIsNone(VerdictCache.get(key))
+        VerdictCache.set(key, self.resp)
+        self.assertEqual(VerdictCache.get(key), self.resp)
+        self.assertEqual(VerdictCache.stats(), {"hits": 1, "misses": 1})
+
+    def test_system_error_not_cached(self):
+        key = VerdictCache.key("code", "C++", self.problem)
+        self.resp["data"][0]["result"] = JudgeStatus.SYSTEM_ERROR
+        VerdictCache.set(key, self.resp)
+        self.assertIsNone(VerdictCache.get(key))
+        # 编译错误可以缓存
+        VerdictCache.set(key, {"err": "CompileError", "data": "error"})
+        self.assertEqual(VerdictCache.get(key)["err"], "CompileError")
+
+
+class ProblemCountersTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="test", email="123@qq.com", password="password")
+        self.problem = Problem.objects.create(**DEFAULT_PROBLEM_DATA)
+
+    def create_submission(self, submission_id, result):
+        Submission.objects.create(id=submission_id, problem=self.problem, user_id=self.user.id,
+                                  username=self.user.username, code="", language="C++", result=result)
+
+    def test_flush(self):
+        for i in range(5):
+            self.create_submission(f"submission-{i}", JudgeStatus.ACCEPTED if i < 2 else JudgeStatus.WRONG_ANSWER)
+            ProblemCounters.record(self.problem.id, self.user.id, attempt=1, passed=int(i < 2))
+        # 合并之前计数器不变
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.attempt_cnt, self.problem.pass_cnt), (0, 0))
+        self.assertEqual(UserProblemStatus(self.user).passed, set())
+
+        self.assertEqual(ProblemCounters.flush(batch_size=3), 3)
+        ProblemCounters.flush_all()
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.attempt_cnt, self.problem.pass_cnt), (5, 2))
+        self.assertTrue(self.problem.get_pass_status(self.user))
+        # 合并后用户缓存的通过集合失效
+        self.assertEqual(UserProblemStatus(self.user).passed, {self.problem.id})
+        self.assertFalse(ProblemCounterDelta.objects.exists())
+        self.assertEqual(ProblemCounters.flush(), 0)
+
+    def test_rejudge_to_wrong_answer(self):
+        """
+        同一批增量中先通过、后被重判为不通过，用户不在通过列表中
+        """
+        self.create_submission("submission", JudgeStatus.WRONG_ANSWER)
+        ProblemCounters.record(self.problem.id, self.user.id, attempt=1, passed=1)
+        ProblemCounters.record(self.problem.id, self.user.id, passed=-1)
+        ProblemCounters.flush()
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.attempt_cnt, self.problem.pass_cnt), (1, 0))
+        self.assertFalse(self.problem.get_pass_status(self.user))
+
+    def test_schedule_flush(self):
+        from judge.tasks import flush_problem_counters_task
+        queue = flush_problem_counters_task.broker.queues[flush_problem_counters_task.queue_name]
+        size = queue.qsize()
+        ProblemCounters.schedule_flush()
+        ProblemCounters.schedule_flush()
+        self.assertEqual(queue.qsize(), size + 1)
+
+
+class JudgeDispatcherTestCase(TestCase):
+    """
+    通过本地的判题服务器桩走完整的判题流程
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="test", email="123@qq.com", password="password")
+        self.problem = Problem.objects.create(**DEFAULT_PROBLEM_DATA, test_case_id="tc")
+
+    def judge(self, submission_id, config, use_async=False):
+        Submission.objects.create(id=submission_id, problem=self.problem, user_id=self.user.id,
+                                  username=self.user.username, code=submission_id, language="C++")
+        with StubJudgeServer(config=config) as server:
+            JudgeServerRegistry.heartbeat({**heartbeat_data(), "service_url": server.service_url})
+            if use_async:
+                async_to_sync(self.async_judge)(submission_id)
+            else:
+                JudgeDispatcher(submission_id, self.problem.id).judge()
+        self.received = [data for _, data in server.received]
+        ProblemCounters.flush_all()
+        return Submission.objects.get(id=submission_id)
+
+    async def async_judge(self, submission_id):
+        # 测试事务中的数据只对当前线程可见，数据库操作回到调用async_to_sync的线程中执行
+        async def run_sync(func, *args, **kwargs):
+            return await sync_to_async(func)(*args, **kwargs)
+
+        client = AsyncJudgeServerClient()
+        try:
+            dispatcher = await run_sync(AsyncJudgeDispatcher, submission_id, self.problem.id)
+            await dispatcher.ajudge(client, run_sync)
+        finally:
+            await client.close()
+
+    def test_accepted(self):
+        submission = self.judge("submission-1", StubJudgeConfig(test_case_number=2))
+        self.assertEqual(submission.result, JudgeStatus.ACCEPTED)
+        self.assertEqual([case.test_case for case in submission.test_cases.order_by("id")], ["1", "2"])
+        self.assertEqual(submission.output.outputs, {"1": "output 1", "2": "output 2"})
+        self.assertEqual(submission.info, {"err": None, "skipped": []})
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.attempt_cnt, self.problem.pass_cnt), (1, 1))
+        self.assertTrue(self.problem.get_pass_status(self.user))
+
+    def test_record_latency(self):
+        self.judge("submission-1", StubJudgeConfig())
+        self.judge("submission-2", StubJudgeConfig(failure_rate=1), use_async=True)
+        server_id = JudgeServer.objects.get().id
+        stats = JudgeLatencyTracker.stats([server_id])[server_id]
+        self.assertEqual((stats["samples"], stats["failures"]), (2, 1))
+
+    def test_one_query_per_dispatch(self):
+        """
+        题目快照已经缓存时，构造JudgeDispatcher只需要一次查询
+        """
+        Submission.objects.create(id="submission-1", problem=self.problem, user_id=self.user.id,
+                                  username=self.user.username, code="code", language="C++")
+        JudgeDispatcher("submission-1", self.problem.id)
+        with self.assertNumQueries(1):
+            dispatcher = JudgeDispatcher("submission-1", self.problem.id)
+        self.assertEqual(dispatcher._judge_data()["src"], "code")
+        self.assertEqual(dispatcher.problem.test_case_id, "tc")
+
+    def test_inactive_user(self):
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        AdmissionController.admit("submission-1", self.user.id)
+        submission = self.judge("submission-1", StubJudgeConfig())
+        self.assertEqual(submission.result, JudgeStatus.PENDING)
+        self.assertEqual(self.received, [])
+        self.assertEqual(AdmissionController.inflight(self.user.id), 0)
+
+    def test_release_admission(self):
+        AdmissionController.admit("submission-1", self.user.id)
+        AdmissionController.admit("submission-2", self.user.id)
+        self.judge("submission-1", StubJudgeConfig())
+        self.judge("submission-2", StubJudgeConfig(failure_rate=1), use_async=True)
+        self.assertEqual(AdmissionController.inflight(self.user.id), 0)
+        self.assertEqual(AdmissionController.inflight(), 0)
+
+    def test_wrong_answer(self):
+        submission = self.judge("submission-1", StubJudgeConfig(verdicts={JudgeStatus.WRONG_ANSWER: 1}))
+        self.assertEqual(submission.result, JudgeStatus.WRONG_ANSWER)
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.attempt_cnt, self.problem.pass_cnt), (1, 0))
+        self.assertFalse(self.problem.get_pass_status(self.user))
+
+    def test_fail_fast(self):
+        Problem.objects.filter(id=self.problem.id).update(fail_fast=True)
+        config = StubJudgeConfig(verdicts={JudgeStatus.WRONG_ANSWER: 1}, test_case_number=3)
+        submission = self.judge("submission-1", config)
+        self.assertTrue(self.received[0]["fail_fast"])
+        self.assertFalse(self.received[0]["output"])
+        self.assertEqual(submission.result, JudgeStatus.WRONG_ANSWER)
+        self.assertEqual([case.test_case for case in submission.test_cases.all()], ["1"])
+        self.assertEqual(submission.info["skipped"], ["2", "3"])
+        # 快速失败模式不返回程序输出
+        self.assertFalse(SubmissionOutput.objects.exists())
+
+    def test_fail_fast_ignored_for_oi(self):
+        Problem.objects.filter(id=self.problem.id).update(fail_fast=True, rule_type=ProblemRuleType.OI)
+        config = StubJudgeConfig(verdicts={JudgeStatus.WRONG_ANSWER: 1}, test_case_number=3)
+        submission = self.judge("submission-1", config)
+        self.assertFalse(self.received[0]["fail_fast"])
+        self.assertEqual(submission.result, JudgeStatus.PARTIALLY_ACCEPTED)
+        self.assertEqual(submission.test_cases.count(), 3)
+        self.assertEqual(submission.info["skipped"], [])
+
+    def test_async_dispatcher(self):
+        submission = self.judge("submission-1", StubJudgeConfig(test_case_number=2), use_async=True)
+        self.assertEqual(submission.result, JudgeStatus.ACCEPTED)
+        self.assertEqual(submission.test_cases.count(), 2)
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.attempt_cnt, self.problem.pass_cnt), (1, 1))
+
+    def test_async_dispatcher_system_error(self):
+        submission = self.judge("submission-1", StubJudgeConfig(failure_rate=1), use_async=True)
+        self.assertEqual(submission.result, JudgeStatus.SYSTEM_ERROR)
+        # 判题结束后释放了判题槽位
+        server_id = JudgeServer.objects.get().id
+        self.assertEqual(JudgeSlotAllocator.used([server_id]), {server_id: 0})
+
+    def test_async_runner_connection(self):
+        """
+        异步判题线程池中的线程保持数据库连接，不修改其它线程的连接配置
+        """
+        runner = AsyncJudgeRunner(1, 1, conn_max_age=60)
+        try:
+            future = asyncio.run_coroutine_threadsafe(runner.run_sync(
+                lambda: (connection.settings_dict["CONN_MAX_AGE"], connection.settings_dict["CONN_HEALTH_CHECKS"])),
+                runner.loop)
+            self.assertEqual(future.result(), (60, True))
+        finally:
+            runner.close()
+        self.assertEqual(connection.settings_dict["CONN_MAX_AGE"], 0)
+
+
+class RejudgeTestCase(TestCase):
+    def setUp(self):
+        from judge.tasks import low_priority_judge_task
+        self.queue = low_priority_judge_task.broker.queues[low_priority_judge_task.queue_name]
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+        self.user = User.objects.create_user(username="test", email="123@qq.com", password="password")
+        self.problem = Problem.objects.create(**DEFAULT_PROBLEM_DATA)
+        for i in range(5):
+            Submission.objects.create(id=f"submission-{i}", problem=self.problem, user_id=self.user.id,
+                                      username=self.user.username, code="", language="C++",
+                                      result=JudgeStatus.WRONG_ANSWER)
+
+    def judge_all(self, result):
+        Submission.objects.filter(result=JudgeStatus.PENDING).update(result=result)
+
+    def test_rejudge_problem(self):
+        from judge.rejudge import create_rejudge_job, run_rejudge_job
+        job = create_rejudge_job(problem_id=self.problem.id, concurrency=2)
+        self.assertEqual(job.total, 5)
+
+        # 每次最多投递concurrency个提交
+        run_rejudge_job(job.id)
+        self.assertEqual(Submission.objects.filter(result=JudgeStatus.PENDING).count(), 2)
+        run_rejudge_job(job.id)
+        self.assertEqual(Submission.objects.filter(result=JudgeStatus.PENDING).count(), 2)
+
+        self.judge_all(JudgeStatus.ACCEPTED)
+        run_rejudge_job(job.id)
+        self.judge_all(JudgeStatus.ACCEPTED)
+        run_rejudge_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.progress()["enqueued"], 5)
+        self.assertEqual(job.status, RejudgeJobStatus.RUNNING)
+
+        self.judge_all(JudgeStatus.ACCEPTED)
+        run_rejudge_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, RejudgeJobStatus.FINISHED)
+        self.assertEqual(job.finished, 5)
+
+        # 结束时统一校正计数器
+        self.problem.refresh_from_db()
+        self.assertEqual(self.problem.attempt_cnt, 5)
+        self.assertEqual(self.problem.pass_cnt, 5)
+        self.assertTrue(self.problem.get_pass_status(self.user))
+        # 投递到低优先级队列的消息数
+        self.assertEqual(self.queue.qsize(), 5)
+
+    def test_skip_new_submissions(self):
+        """
+        创建任务之后的新提交正在正常判题，即使id排在游标之后也不会被重判
+        """
+        from judge.rejudge import create_rejudge_job, run_rejudge_job
+        job = create_rejudge_job(problem_id=self.problem.id, concurrency=10)
+        Submission.objects.create(id="zzzz-new", problem=self.problem, user_id=self.user.id,
+                                  username=self.user.username, code="", language="C++", result=JudgeStatus.JUDGING)
+        run_rejudge_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.total, job.enqueued), (5, 5))
+        self.assertEqual(Submission.objects.get(id="zzzz-new").result, JudgeStatus.JUDGING)
+
+        self.judge_all(JudgeStatus.ACCEPTED)
+        run_rejudge_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, RejudgeJobStatus.FINISHED)
+        self.assertEqual(job.finished, 5)
+        self.assertEqual(self.queue.qsize(), 5)
+
+    def test_reconcile_with_pending_submission(self):
+        """
+        校正时还没有判完的提交不计入提交数，判完后由增量计入一次
+        """
+        from judge.rejudge import reconcile_problem_counters
+        Submission.objects.create(id="pending", problem=self.problem, user_id=self.user.id,
+                                  username=self.user.username, code="", language="C++")
+        reconcile_problem_counters([self.problem.id])
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.attempt_cnt, self.problem.pass_cnt), (5, 0))
+
+        Submission.objects.filter(id="pending").update(result=JudgeStatus.ACCEPTED)
+        ProblemCounters.record(self.problem.id, self.user.id, attempt=1, passed=1)
+        ProblemCounters.flush_all()
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.attempt_cnt, self.problem.pass_cnt), (6, 1))
+
+    def test_stalled_submissions(self):
+        """
+        消息丢失的提交超时后先重新投递一次，仍然没有判完的标记为系统错误，任务可以结束；在等待队列中的提交不算卡住
+        """
+        from judge.rejudge import create_rejudge_job, run_rejudge_job, REJUDGE_STALL_TIMEOUT
+        job = create_rejudge_job(problem_id=self.problem.id, concurrency=10)
+        run_rejudge_job(job.id)
+        self.assertEqual(self.queue.qsize(), 5)
+        PendingQueue.push("submission-0", self.problem.id, PendingTaskPriority.LOW, rejudge=True)
+        Submission.objects.filter(id="submission-1").update(result=JudgeStatus.ACCEPTED)
+
+        def stall():
+            RejudgeJob.objects.filter(id=job.id).update(
+                progress_time=timezone.now() - timedelta(seconds=REJUDGE_STALL_TIMEOUT + 1))
+            run_rejudge_job(job.id)
+
+        # 有提交判完，任务仍有进展
+        stall()
+        run_rejudge_job(job.id)
+        self.assertEqual(self.queue.qsize(), 5)
+
+        stall()
+        self.assertEqual(self.queue.qsize(), 8)
+        stall()
+        job.refresh_from_db()
+        self.assertEqual(job.status, RejudgeJobStatus.RUNNING)
+        self.assertEqual(Submission.objects.filter(result=JudgeStatus.SYSTEM_ERROR).count(), 3)
+        self.assertEqual(Submission.objects.get(id="submission-0").result, JudgeStatus.PENDING)
+
+        PendingTask.objects.all().delete()
+        Submission.objects.filter(id="submission-0").update(result=JudgeStatus.ACCEPTED)
+        run_rejudge_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, RejudgeJobStatus.FINISHED)
+        self.assertEqual(self.queue.qsize(), 8)
+
+    def test_rejudge_api(self):
+        url = reverse("rejudge_api")
+        self.client.login(email="123@qq.com", password="password")
+        self.assertEqual(self.client.post(url, {"problem_id": self.problem.id}).data["msg"], "用户无权限！")
+
+        User.objects.filter(id=self.user.id).update(user_type=UserType.ADMIN)
+        self.assertEqual(self.client.post(url, {}).data["err"], "invalid-non_field_errors")
+        data = self.client.post(url, {"problem_id": self.problem.id}).data["data"]
+        self.assertEqual(data["total"], 5)
+        job = RejudgeJob.objects.get(id=data["id"])
+        self.assertEqual(self.client.get(url, {"job_id": job.id}).data["data"], job.progress())
+
+
+class JudgeEventHubTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    async def test_local_fan_out(self):
+        hub = JudgeEventHub(LocalBackend)
+        async with Subscription(hub, "a") as s1, Subscription(hub, "a") as s2, Subscription(hub, "b") as s3:
+            hub.publish("a", {"type": "status"})
+            self.assertEqual(await s1.get(timeout=1), {"type": "status"})
+            self.assertEqual(await s2.get(timeout=1), {"type": "status"})
+            self.assertIsNone(await s3.get(timeout=0.1))
+        self.assertEqual(hub.subscriptions, {})
+
+    async def test_cache_backend(self):
+        """
+        通过缓存传递的事件，晚到的订阅者也能按顺序收到之前发布的事件
+        """
+        publisher = JudgeEventHub(CacheBackend)
+        publisher.publish("a", {"type": "status"})
+        hub = JudgeEventHub(CacheBackend)
+        hub.backend.poll_interval = 0.01
+        async with Subscription(hub, "a") as subscription:
+            publisher.publish("a", {"type": "finished"})
+            self.assertEqual(await subscription.get(timeout=1), {"type": "status"})
+            self.assertEqual(await subscription.get(timeout=1), {"type": "finished"})
+        self.assertEqual(hub.backend.tasks, {})
+
+    async def test_cache_backend_batch(self):
+        """
+        一批事件只写一次缓存，订阅者按顺序收到；没有新事件时轮询间隔加倍但不超过上限
+        """
+        publisher = JudgeEventHub(CacheBackend)
+        with mock.patch.object(cache, "set_many", wraps=cache.set_many) as set_many:
+            publisher.publish("a", {"type": "status"}, {"type": "test_case"}, {"type": "finished"})
+        self.assertEqual(set_many.call_count, 1)
+        hub = JudgeEventHub(CacheBackend)
+        hub.backend.poll_interval = 0.01
+        sleeps = []
+        sleep = asyncio.sleep
+
+        async def record_sleep(delay):
+            sleeps.append(delay)
+            await sleep(0)
+
+        with mock.patch("judge.events.asyncio.sleep", record_sleep):
+            async with Subscription(hub, "a") as subscription:
+                self.assertEqual([(await subscription.get(timeout=1))["type"] for _ in range(3)],
+                                 ["status", "test_case", "finished"])
+                while len(sleeps) < 6:
+                    await sleep(0)
+        self.assertEqual(sleeps[:6], [0.01, 0.02, 0.04, 0.08, 0.08, 0.08])
+
+    async def test_cache_backend_reset(self):
+        """
+        重判前清空频道，订阅者不会收到上一次判题的事件；正在轮询的订阅者从新的编号继续接收
+        """
+        publisher = JudgeEventHub(CacheBackend)
+        publisher.publish("a", {"type": "status"})
+        publisher.publish("a", {"type": "finished", "result": 0})
+        hub = JudgeEventHub(CacheBackend)
+        hub.backend.poll_interval = 0.01
+        async with Subscription(hub, "a") as watching:
+            self.assertEqual((await watching.get(timeout=1))["type"], "status")
+            self.assertEqual((await watching.get(timeout=1))["type"], "finished")
+            publisher.reset("a")
+            late_hub = JudgeEventHub(CacheBackend)
+            late_hub.backend.poll_interval = 0.01
+            async with Subscription(late_hub, "a") as late:
+                publisher.publish("a", {"type": "status", "result": 6})
+                self.assertEqual(await late.get(timeout=1), {"type": "status", "result": 6})
+                self.assertEqual(await watching.get(timeout=1), {"type": "status", "result": 6})
+
+
+class ScoreboardTestCase(TestCase):
+    @staticmethod
+    def update(scoreboard, user_id, *args):
+        # 与update_contest_rank相同：在排名信息的副本上计算，再写回排行榜
+        entry = copy.deepcopy(scoreboard.entries.get(user_id) or scoreboard.new_entry(user_id))
+        scoreboard.apply(entry, *args)
+        scoreboard.put(entry)
+        return entry
+
+    def test_acm(self):
+        scoreboard = ACMScoreboard(1)
+        self.update(scoreboard, 1, 1, JudgeStatus.WRONG_ANSWER, 100)
+        self.update(scoreboard, 1, 1, JudgeStatus.COMPILE_ERROR, 150)
+        entry = self.update(scoreboard, 1, 1, JudgeStatus.ACCEPTED, 200, True)
+        self.assertEqual(entry["total_time"], 200 + ACM_PENALTY_TIME)
+        self.assertTrue(entry["submission_info"]["1"]["is_first_ac"])
+        # 通过之后的提交不影响排名
+        self.assertEqual(self.update(scoreboard, 1, 1, JudgeStatus.WRONG_ANSWER, 300), entry)
+
+        entry = self.update(scoreboard, 2, 1, JudgeStatus.ACCEPTED, 250)
+        self.assertFalse(entry["submission_info"]["1"]["is_first_ac"])
+        # 通过题数相同，罚时少的在前
+        self.assertEqual([item["user_id"] for item in scoreboard.page(0, 10)], [2, 1])
+        self.update(scoreboard, 1, 2, JudgeStatus.ACCEPTED, 400)
+        self.assertEqual(scoreboard.rank(1), 1)
+        self.assertEqual(scoreboard.page(1, 10), [{**scoreboard.entries[2], "rank": 2}])
+        self.assertIsNone(scoreboard.rank(3))
+
+        # 从持久化的结果重建
+        restored = ACMScoreboard(1)
+        restored.load(scoreboard.entries.values())
+        self.assertEqual(restored.page(0, 10), scoreboard.page(0, 10))
+
+    def test_oi(self):
+        scoreboard = OIScoreboard(1)
+        self.update(scoreboard, 1, 1, 50)
+        self.update(scoreboard, 2, 1, 80)
+        self.assertEqual([item["user_id"] for item in scoreboard.page(0, 10)], [2, 1])
+        # 每道题取最后一次提交的得分
+        self.assertEqual(self.update(scoreboard, 1, 1, 100)["total_score"], 100)
+        self.update(scoreboard, 2, 1, 30)
+        self.assertEqual([item["total_score"] for item in scoreboard.page(0, 10)], [100, 30])
+
+    def test_random_updates(self):
+        """
+        增量维护的名次与每次全量排序的结果一致
+        """
+        rng = random.Random(0)
+        scoreboard = ACMScoreboard(1)
+        for i in range(2000):
+            self.update(scoreboard, rng.randrange(100), rng.randrange(10),
+                        rng.choice([JudgeStatus.ACCEPTED, JudgeStatus.WRONG_ANSWER]), i)
+        expected = sorted(scoreboard.entries.values(),
+                          key=lambda entry: (-entry["accepted_number"], entry["total_time"], entry["user_id"]))
+        self.assertEqual([item["user_id"] for item in scoreboard.page(0, len(scoreboard))],
+                         [entry["user_id"] for entry in expected])
+        self.assertEqual(scoreboard.rank(expected[42]["user_id"]), 43)
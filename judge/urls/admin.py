@@ -0,0 +1,8 @@
+from django.urls import path
+
+from ..views.admin import *
+
+urlpatterns = [
+    path("rejudge/", RejudgeAPI.as_view(), name="rejudge_api"),
+    path("judge_server/stats/", JudgeServerStatsAPI.as_view(), name="judge_server_stats_api"),
+]
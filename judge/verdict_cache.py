@@ -0,0 +1,44 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from submission.models import JudgeStatus
+from utils.cache import incr_or_init
+from utils.constants import CacheKey
+
+
+class VerdictCache:
+    """
+    判题结果缓存，比赛中大量字节级相同的代码(模板、共享的题解)以及未修改代码的重判不需要再交给判题服务器
+    缓存键由代码、语言、测试数据以及时间/内存限制共同决定，任一项改变都不会命中旧结果；
+    缓存项在VERDICT_CACHE_TIMEOUT秒后过期，缓存后端容量不足时按后端自身的策略淘汰
+    """
+    @staticmethod
+    def key(code, language, problem, fail_fast=False):
+        # 快速失败模式的结果只包含部分测试点，和完整的结果分开缓存
+        raw = "\0".join([code, language, str(problem.test_case_id), str(problem.time_limit), str(problem.memory_limit),
+                         "fail_fast" if fail_fast else ""])
+        return f"{CacheKey.verdict_cache}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+    @classmethod
+    def get(cls, key):
+        """
+        返回缓存的判题服务器响应，未命中时返回None
+        """
+        resp = cache.get(key)
+        incr_or_init(CacheKey.verdict_cache_hits if resp is not None else CacheKey.verdict_cache_misses)
+        return resp
+
+    @staticmethod
+    def set(key, resp):
+        # 系统错误可能是判题服务器的偶发问题，不缓存
+        if not resp["err"] and any(case["result"] == JudgeStatus.SYSTEM_ERROR for case in resp["data"]):
+            return
+        cache.set(key, resp, timeout=settings.VERDICT_CACHE_TIMEOUT)
+
+    @staticmethod
+    def stats():
+        counters = cache.get_many([CacheKey.verdict_cache_hits, CacheKey.verdict_cache_misses])
+        return {"hits": counters.get(CacheKey.verdict_cache_hits, 0),
+                "misses": counters.get(CacheKey.verdict_cache_misses, 0)}
@@ -0,0 +1,54 @@
+from rest_framework.views import APIView
+
+from account.models import UserType
+from judge.models import RejudgeJob
+from judge.registry import JudgeServerRegistry
+from judge.rejudge import create_rejudge_job
+from judge.routing import ExpectedCompletionPolicy, get_routing_policy
+from judge.slots import JudgeSlotAllocator
+from judge.serializers import RejudgeSerializer
+from utils.api import success, fail, validate_serializer
+
+
+class RejudgeAPI(APIView):
+    @validate_serializer(RejudgeSerializer)
+    def post(self, request):
+        """
+        创建批量重判任务，重判某道题目和/或[start_time, end_time)时间段内的全部提交，返回任务的进度信息
+        """
+        if not request.user.is_authenticated or request.user.user_type != UserType.ADMIN:
+            return fail('用户无权限！')
+        s = RejudgeSerializer(data=request.data)
+        s.is_valid()
+        job = create_rejudge_job(**s.validated_data)
+        return success(job.progress())
+
+    def get(self, request):
+        """
+        查询id为job_id的重判任务的进度
+        """
+        if not request.user.is_authenticated or request.user.user_type != UserType.ADMIN:
+            return fail('用户无权限！')
+        try:
+            job = RejudgeJob.objects.get(id=request.GET.get('job_id'))
+        except (RejudgeJob.DoesNotExist, ValueError):
+            return fail('该重判任务不存在！')
+        return success(job.progress())
+
+
+class JudgeServerStatsAPI(APIView):
+    def get(self, request):
+        """
+        在线判题服务器的调度状态：槽位占用、上报的负载、判题耗时的EWMA以及按预计完成时间策略计算的得分
+        """
+        if not request.user.is_authenticated or request.user.user_type != UserType.ADMIN:
+            return fail('用户无权限！')
+        servers = JudgeServerRegistry.live_servers()
+        used = JudgeSlotAllocator.used([s.id for s in servers])
+        scores = ExpectedCompletionPolicy().scores(servers, used)
+        return success({
+            "routing": get_routing_policy().name,
+            "servers": [{"id": server.id, "hostname": server.hostname, "capacity": JudgeSlotAllocator.capacity(server),
+                         "used": used[server.id], "cpu_usage": server.cpu_usage, "memory_usage": server.memory_usage,
+                         **scores[server.id]} for server in servers],
+        })
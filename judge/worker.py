@@ -0,0 +1,13 @@
+"""
+dramatiq worker的入口，先初始化django(同时按settings.DRAMATIQ_BROKER设置broker)再引入actor：
+
+dramatiq judge.worker
+"""
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "SSEOJ.settings")
+django.setup()
+
+import judge.tasks  # noqa: E402, F401
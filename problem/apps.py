@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ProblemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'problem'
+
+    def ready(self):
+        # 注册题目修改时使判题快照失效并更新检索索引、通过或收藏改变时使用户状态失效的信号
+        import problem.judge_info  # noqa: F401
+        import problem.search  # noqa: F401
+        import problem.user_status  # noqa: F401
@@ -0,0 +1,59 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from problem.models import Problem
+from utils.cache import VersionedSnapshots, bump_version
+from utils.constants import CacheKey
+
+# 判题只需要的题目字段
+JUDGE_FIELDS = ("id", "time_limit", "memory_limit", "test_case_id", "rule_type", "fail_fast")
+# 每个进程最多缓存的题目数
+MAX_CACHED_PROBLEMS = 1024
+
+
+class ProblemJudgeInfo:
+    """
+    判题用的题目快照，只包含JUDGE_FIELDS，不包含题面等大字段
+    """
+    __slots__ = JUDGE_FIELDS
+
+    def __init__(self, **fields):
+        for field in JUDGE_FIELDS:
+            setattr(self, field, fields[field])
+
+
+_snapshots = VersionedSnapshots(MAX_CACHED_PROBLEMS)
+
+
+def _version_key(problem_id):
+    return f"{CacheKey.problem_judge_info_version}:{problem_id}"
+
+
+def get_problem_judge_info(problem_id):
+    """
+    获取题目的判题快照，每个worker进程按LRU缓存最近使用的题目；
+    缓存中每道题目有一个版本号，题目修改后版本号改变，各进程在下一次判题时重新读取。题目不存在时抛出Problem.DoesNotExist
+    """
+    return _snapshots.get(problem_id, _version_key(problem_id),
+                          lambda: ProblemJudgeInfo(**Problem.objects.values(*JUDGE_FIELDS).get(id=problem_id)))
+
+
+def invalidate_problem_judge_info(problem_id):
+    """
+    题目的判题参数改变后调用；通过save()修改题目时会自动调用，queryset.update()修改判题字段时需要手动调用。
+    在事务中调用时提交后会再失效一次，提交前重新加载的进程不会一直使用旧的参数
+    """
+    bump_version([_version_key(problem_id)])
+
+
+@receiver(post_save, sender=Problem)
+def _problem_saved(sender, instance, update_fields=None, **kwargs):
+    # 只更新计数器等字段时不影响判题
+    if update_fields is not None and not set(update_fields) & set(JUDGE_FIELDS):
+        return
+    invalidate_problem_judge_info(instance.id)
+
+
+@receiver(post_delete, sender=Problem)
+def _problem_deleted(sender, instance, **kwargs):
+    invalidate_problem_judge_info(instance.id)
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-16 23:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0014_problem_test_case_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='rule_type',
+            field=models.CharField(default='ACM', max_length=10),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-16 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0015_problem_rule_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='problem',
+            name='fail_fast',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -6,6 +6,12 @@ from django.db.models import Count
 from account.models import User
 
 
+class ProblemRuleType:
+    # ACM: 取第一个错误测试点的结果；OI: 按测试点给分，可以部分正确
+    ACM = "ACM"
+    OI = "OI"
+
+
 class Tag(models.Model):
     name = models.CharField(max_length=10)
     parent = models.ForeignKey('self', related_name='children', on_delete=models.CASCADE, null=True)
@@ -42,6 +48,11 @@ class Problem(models.Model):
     time_limit = models.IntegerField()
     # KB
     memory_limit = models.IntegerField()
+    # 判题服务器上测试数据所在目录的名称，判题服务器按此缓存测试数据
+    test_case_id = models.TextField(null=True)
+    rule_type = models.CharField(max_length=10, default=ProblemRuleType.ACM)
+    # 只对ACM题目生效，判题服务器遇到第一个错误的测试点即停止，其余测试点跳过
+    fail_fast = models.BooleanField(default=False)
     pass_cnt = models.IntegerField(default=0)
     attempt_cnt = models.IntegerField(default=0)
     source = models.TextField(null=True, blank=True)
@@ -0,0 +1,407 @@
+import itertools
+import logging
+import math
+import operator
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from sortedcontainers import SortedSet
+
+from problem.models import Problem
+from utils.cache import incr_or_init, get_version
+from utils.constants import CacheKey
+
+# 题目名称中的词在打分时相当于在描述中出现的次数
+NAME_WEIGHT = 3
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 字母数字词的前缀匹配最多展开的词数，单个中日韩文字的前缀匹配不限制(展开的词最多是这个字开头的二元组)
+MAX_PREFIX_EXPANSION = 64
+# 从数据库加载题目时每批读取的题目数
+LOAD_CHUNK_SIZE = 2000
+# 落后的修改超过这个数时直接重建索引
+MAX_SYNC_CHANGES = 1000
+# 修改记录在缓存中保留的秒数，超时未同步的进程重建索引
+CHANGE_TTL = 24 * 60 * 60
+# 修改记录先增加序号再写入，读到缺失的记录时先认为正在写入，超过这么多秒仍然缺失才重建索引
+CHANGE_WRITE_GRACE = 10
+
+# 中日韩文字
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+# 中日韩文字连续的一段，或者一个由字母数字组成的词
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[a-z0-9]+")
+# 建立索引时直接由正则表达式找出所有词，不逐段处理：字母数字组成的词、相邻两个字(可以重叠)、每段的最后一个字
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_BIGRAM_RE = re.compile(rf"(?=([{_CJK}]{{2}}))")
+_LAST_CHAR_RE = re.compile(rf"[{_CJK}](?![{_CJK}])")
+
+
+def _is_cjk(token):
+    return not token[0].isascii()
+
+
+def tokenize(text, query=False):
+    """
+    将文本切分为索引词：字母数字按词切分并转为小写，中日韩文字切分为相邻两个字的二元组，
+    索引时每段中日韩文字的最后一个字也单独作为一个词，这样单个字的查询可以通过前缀匹配找到任意位置的字；索引词不保证顺序
+    query为True时按查询切分并保持顺序，不添加最后一个字(已经包含在最后一个二元组中)
+    """
+    text = text.lower()
+    if not query:
+        return _WORD_RE.findall(text) + _BIGRAM_RE.findall(text) + _LAST_CHAR_RE.findall(text)
+    tokens = []
+    for run in _TOKEN_RE.findall(text):
+        if run.isascii():
+            tokens.append(run)
+            continue
+        # 相邻两个字拼接为二元组
+        tokens.extend(map(operator.add, run, run[1:]))
+        if len(run) == 1:
+            tokens.append(run)
+    return tokens
+
+
+class ProblemSearchIndex:
+    """
+    题目名称和描述的倒排索引，查询返回按BM25得分排序的题目id
+    1. postings保存每个词出现在哪些题目中以及出现次数，doc_tokens保存每道题目的词，用于增量修改时删除旧的记录
+    2. 查询的所有词都出现的题目才算匹配；最后一个字母数字词和单个中日韩文字按前缀匹配，输入过程中就能得到结果
+    3. attributes保存每道题目的难度和标签，检索结果按难度、标签筛选和按id、难度排序都不需要访问数据库
+    4. 索引只在当前进程中，web进程启动时在后台构建，由get_problem_search_index按缓存中的修改记录增量同步
+    """
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.doc_tokens = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+        self.vocabulary = SortedSet()
+        self.attributes = {}
+
+    def __len__(self):
+        return len(self.doc_tokens)
+
+    def __contains__(self, problem_id):
+        return problem_id in self.doc_tokens
+
+    def add(self, problem_id, name, description, difficulty=0, tags=()):
+        """
+        添加或更新一道题目，tags为标签id
+        """
+        self.remove(problem_id)
+        counts = Counter(tokenize(description))
+        for token in tokenize(name):
+            counts[token] += NAME_WEIGHT
+
+        postings = self.postings
+        for token, count in counts.items():
+            if token not in postings:
+                self.vocabulary.add(token)
+            postings[token][problem_id] = count
+        length = sum(counts.values())
+        self.doc_tokens[problem_id] = tuple(counts)
+        self.doc_lengths[problem_id] = length
+        self.total_length += length
+        self.attributes[problem_id] = (difficulty, frozenset(tags))
+
+    def remove(self, problem_id):
+        tokens = self.doc_tokens.pop(problem_id, None)
+        if tokens is None:
+            return
+        for token in tokens:
+            posting = self.postings[token]
+            del posting[problem_id]
+            if not posting:
+                del self.postings[token]
+                self.vocabulary.remove(token)
+        self.total_length -= self.doc_lengths.pop(problem_id)
+        del self.attributes[problem_id]
+
+    def _expand(self, token, limit=None):
+        """
+        返回前缀为token的词，token本身在最前面，limit不为None时最多返回limit个词
+        """
+        tokens = [token] if token in self.postings else []
+        for word in self.vocabulary.irange(token, token + "\uffff", inclusive=(False, False)):
+            if limit is not None and len(tokens) >= limit:
+                break
+            tokens.append(word)
+        return tokens
+
+    def _term_groups(self, query):
+        """
+        将查询切分为若干组词，每组中的任意一个词出现即可，所有组都要匹配
+        """
+        tokens = list(dict.fromkeys(tokenize(query, query=True)))
+        groups = []
+        for i, token in enumerate(tokens):
+            if _is_cjk(token) and len(token) == 1:
+                groups.append(self._expand(token))
+            elif not _is_cjk(token) and i == len(tokens) - 1:
+                groups.append(self._expand(token, MAX_PREFIX_EXPANSION))
+            else:
+                groups.append([token] if token in self.postings else [])
+        return groups
+
+    def _matches(self, problem_id, min_difficulty, max_difficulty, tags):
+        difficulty, problem_tags = self.attributes[problem_id]
+        return (min_difficulty is None or difficulty >= min_difficulty) and \
+            (max_difficulty is None or difficulty <= max_difficulty) and \
+            (not tags or not problem_tags.isdisjoint(tags))
+
+    def search(self, query, min_difficulty=None, max_difficulty=None, tags=None, order_by=None):
+        """
+        返回匹配query的题目id，query中没有可以检索的词时返回None
+        min_difficulty、max_difficulty、tags(有其中任意一个标签即可)与题库的筛选条件相同；
+        order_by为None时按得分从高到低排序，得分相同时按id排序，也可以是"id"、"-id"、"difficulty"、"-difficulty"
+        """
+        if order_by not in (None, "id", "-id", "difficulty", "-difficulty"):
+            raise ValueError(f"Invalid order_by: {order_by}")
+        groups = self._term_groups(query)
+        if not groups:
+            return None
+        if not all(groups):
+            return []
+
+        # 从最短的倒排表开始求交集
+        group_postings = sorted(([self.postings[token] for token in group] for group in groups),
+                                key=lambda postings: sum(map(len, postings)))
+        candidates = set().union(*group_postings[0])
+        for postings in group_postings[1:]:
+            candidates.intersection_update(set().union(*postings))
+            if not candidates:
+                return []
+        if min_difficulty is not None or max_difficulty is not None or tags:
+            candidates = {problem_id for problem_id in candidates
+                          if self._matches(problem_id, min_difficulty, max_difficulty, tags)}
+        if order_by is not None:
+            ranked = sorted(candidates, reverse=order_by == "-id")
+            if order_by.endswith("difficulty"):
+                attributes = self.attributes
+                # 稳定排序，难度相同的题目按id排序
+                ranked.sort(key=lambda problem_id: attributes[problem_id][0], reverse=order_by[0] == "-")
+            return ranked
+
+        n = len(self.doc_tokens)
+        scale = BM25_K1 * BM25_B / (self.total_length / n or 1)
+        doc_lengths = self.doc_lengths
+        # 每个文档的长度归一化项只计算一次
+        norms = {problem_id: BM25_K1 * (1 - BM25_B) + scale * doc_lengths[problem_id] for problem_id in candidates}
+        scores = dict.fromkeys(candidates, 0.0)
+        for postings in group_postings:
+            for posting in postings:
+                weight = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5)) * (BM25_K1 + 1)
+                for problem_id in candidates.intersection(posting):
+                    tf = posting[problem_id]
+                    scores[problem_id] += weight * tf / (tf + norms[problem_id])
+        # 先按id排序，稳定排序保证得分相同的题目仍按id排序
+        ranked = sorted(scores)
+        ranked.sort(key=scores.__getitem__, reverse=True)
+        return ranked
+
+
+def _epoch():
+    return get_version(CacheKey.problem_search_epoch)
+
+
+def _seq_key(epoch):
+    return f"{CacheKey.problem_search_changes}:{epoch}:seq"
+
+
+def _change_key(epoch, seq):
+    return f"{CacheKey.problem_search_changes}:{epoch}:{seq}"
+
+
+def record_problem_change(problem_id):
+    """
+    记录一道题目的名称、描述、难度或标签被修改(或题目被删除)，各进程在下一次检索时重新读取这道题目
+    序号先于记录写入，读取方读到缺失的最新记录时等待CHANGE_WRITE_GRACE秒，不会因此重建索引
+    """
+    epoch = _epoch()
+    seq = incr_or_init(_seq_key(epoch))
+    cache.set(_change_key(epoch, seq), problem_id, timeout=CHANGE_TTL)
+
+
+logger = logging.getLogger(__name__)
+
+_index = None
+# (epoch, seq)：当前进程的索引已经包含的修改记录
+_index_position = None
+# 缺失的修改记录之前的位置(epoch, seq)，和第一次发现缺失的时间
+_missing_change = None
+# 读写_index时持有，只用于增量同步和检索
+_index_lock = threading.Lock()
+# 从数据库重建索引时持有，同一时间只有一个线程重建
+_build_lock = threading.Lock()
+
+
+def _reset_locks():
+    # 在后台线程重建索引时fork出的子进程中，锁永远不会被释放
+    global _index_lock, _build_lock
+    _index_lock, _build_lock = threading.Lock(), threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_locks)
+
+
+def _load(index, queryset):
+    rows = queryset.values_list("id", "name", "description", "difficulty").iterator(chunk_size=LOAD_CHUNK_SIZE)
+    while True:
+        chunk = list(itertools.islice(rows, LOAD_CHUNK_SIZE))
+        if not chunk:
+            return
+        tags = defaultdict(list)
+        for problem_id, tag_id in Problem.tags.through.objects.filter(problem_id__in=[row[0] for row in chunk]) \
+                .values_list("problem_id", "tag_id"):
+            tags[problem_id].append(tag_id)
+        for problem_id, name, description, difficulty in chunk:
+            index.add(problem_id, name, description, difficulty, tags.get(problem_id, ()))
+
+
+def _position():
+    epoch = _epoch()
+    return epoch, cache.get(_seq_key(epoch), 0)
+
+
+def _sync(epoch, seq):
+    """
+    持有_index_lock时调用，按修改记录把索引增量同步到(epoch, seq)，返回False表示需要重建索引
+    只应用连续的一段修改记录，缺失的记录可能正在写入，CHANGE_WRITE_GRACE秒内不重建
+    """
+    global _index_position, _missing_change
+    if _index is None or _index_position[0] != epoch or not 0 <= seq - _index_position[1] <= MAX_SYNC_CHANGES:
+        return False
+    start = _index_position[1]
+    if seq == start:
+        return True
+    keys = [_change_key(epoch, i) for i in range(start + 1, seq + 1)]
+    changes = cache.get_many(keys)
+    applied = 0
+    while applied < len(keys) and keys[applied] in changes:
+        applied += 1
+    problem_ids = {changes[key] for key in keys[:applied]}
+    for problem_id in problem_ids:
+        _index.remove(problem_id)
+    _load(_index, Problem.objects.filter(id__in=problem_ids))
+    _index_position = (epoch, start + applied)
+    if applied == len(keys):
+        _missing_change = None
+        return True
+
+    missing, now = _index_position, time.monotonic()
+    if _missing_change is None or _missing_change[0] != missing:
+        _missing_change = (missing, now)
+    return now - _missing_change[1] <= CHANGE_WRITE_GRACE
+
+
+def _rebuild():
+    """
+    在_index_lock之外从数据库重建索引，重建期间其它线程继续使用旧的索引检索；
+    已经有线程在重建时，有旧索引的直接返回，还没有索引的等待重建完成
+    """
+    global _index, _index_position, _missing_change
+    if not _build_lock.acquire(blocking=_index is None):
+        return
+    try:
+        # 等待锁的过程中可能已经由其它线程重建
+        epoch, seq = _position()
+        with _index_lock:
+            if _sync(epoch, seq):
+                return
+        # 先读修改记录的位置再读数据库，之后的修改都会在下一次同步时读到
+        index = ProblemSearchIndex()
+        _load(index, Problem.objects.order_by())
+        with _index_lock:
+            _index, _index_position, _missing_change = index, (epoch, seq), None
+    finally:
+        _build_lock.release()
+
+
+def _with_index(func):
+    """
+    在同步后的索引上调用func(index)
+    """
+    epoch, seq = _position()
+    with _index_lock:
+        if _sync(epoch, seq):
+            return func(_index)
+    _rebuild()
+    epoch, seq = _position()
+    with _index_lock:
+        _sync(epoch, seq)
+        return func(_index)
+
+
+def _warm_up():
+    try:
+        _rebuild()
+    except Exception:
+        logger.exception("Failed to build the problem search index")
+    finally:
+        # 后台线程不经过请求的生命周期，自己关闭数据库连接
+        connections.close_all()
+
+
+def warm_up_problem_search_index():
+    """
+    当前进程还没有索引时在后台线程中从数据库构建，web进程启动时调用
+    """
+    if _index is None and not _build_lock.locked():
+        threading.Thread(target=_warm_up, name="problem-search-index", daemon=True).start()
+
+
+def get_problem_search_index():
+    """
+    获取当前进程的题目检索索引，第一次使用时从数据库构建，之后按缓存中的修改记录增量同步
+    """
+    return _with_index(lambda index: index)
+
+
+def search_problems(query, min_difficulty=None, max_difficulty=None, tags=None, order_by=None):
+    """
+    返回匹配query并满足筛选条件的题目id，默认按相关度排序，参数见ProblemSearchIndex.search；
+    query中没有可以检索的词，或者当前进程的索引还没有构建完成(这时在后台开始构建)时返回None，由调用方回退到数据库查询
+    """
+    if _index is None:
+        warm_up_problem_search_index()
+        return None
+    return _with_index(lambda index: index.search(query, min_difficulty, max_difficulty, tags, order_by))
+
+
+def _changed(problem_id):
+    record_problem_change(problem_id)
+    # 其它进程在事务提交前同步时可能读到旧的数据，提交后再记录一次
+    transaction.on_commit(lambda: record_problem_change(problem_id))
+
+
+@receiver(post_save, sender=Problem)
+def _problem_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {"name", "description", "difficulty"} & set(update_fields):
+        return
+    _changed(instance.id)
+
+
+@receiver(post_delete, sender=Problem)
+def _problem_deleted(sender, instance, **kwargs):
+    _changed(instance.id)
+
+
+@receiver(m2m_changed, sender=Problem.tags.through)
+def _problem_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            _changed(instance.pk)
+    elif action in ("post_add", "post_remove"):
+        for problem_id in pk_set:
+            _changed(problem_id)
+    elif action == "pre_clear":
+        # 从标签一侧清空，instance是标签
+        for problem_id in sender.objects.filter(tag_id=instance.pk).values_list("problem_id", flat=True):
+            _changed(problem_id)
@@ -9,7 +9,7 @@ class ProblemSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Problem
-        exclude = ['star_users', 'pass_users', 'check_status', 'create_time']
+        exclude = ['star_users', 'pass_users', 'check_status', 'create_time', 'test_case_id']
 
     def __init__(self, *args, **kwargs):
         needed_fields = kwargs.pop('needed_fields', None)
@@ -1,10 +1,27 @@
 import copy
+import time
+from unittest import mock
 
+import dramatiq
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from dramatiq.brokers.stub import StubBroker
 
 from account.models import User
+from problem.judge_info import get_problem_judge_info, invalidate_problem_judge_info
 from problem.models import Problem, Tag, Solution, ProblemList
+from problem.search import tokenize, ProblemSearchIndex, search_problems, get_problem_search_index, \
+    MAX_PREFIX_EXPANSION, CHANGE_WRITE_GRACE
+from problem.user_status import UserProblemStatus
+from submission.models import Submission
+from utils.constants import CacheKey
+
+# 题目的url会引入judge.tasks
+dramatiq.set_broker(StubBroker())
 
 DEFAULT_PROBLEM_DATA = {
     'name': 'Test Problem 1',
@@ -306,3 +323,248 @@ class ProblemsetTestCase(TestCase):
         self.problem2 = Problem.objects.create(**{**DEFAULT_PROBLEM_DATA, 'name': "Test Problem 2", 'difficulty': 3})
         self.problem2.tags.add(self.tag1)
         self.problem3 = Problem.objects.create(**{**DEFAULT_PROBLEM_DATA, 'name': "Test Problem 3", 'difficulty': 5})
+
+
+class ProblemJudgeInfoTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.problem = Problem.objects.create(**DEFAULT_PROBLEM_DATA, test_case_id="tc")
+
+    def test_cached(self):
+        info = get_problem_judge_info(self.problem.id)
+        self.assertEqual((info.time_limit, info.test_case_id), (self.problem.time_limit, "tc"))
+        self.assertFalse(hasattr(info, "description"))
+        with self.assertNumQueries(0):
+            self.assertIs(get_problem_judge_info(self.problem.id), info)
+
+    def test_invalidate_on_save(self):
+        get_problem_judge_info(self.problem.id)
+        self.problem.time_limit = 2000
+        self.problem.save()
+        self.assertEqual(get_problem_judge_info(self.problem.id).time_limit, 2000)
+
+        # 只修改计数器不会使快照失效
+        info = get_problem_judge_info(self.problem.id)
+        self.problem.attempt_cnt = 10
+        self.problem.save(update_fields=["attempt_cnt"])
+        self.assertIs(get_problem_judge_info(self.problem.id), info)
+
+    def test_invalidate_on_commit(self):
+        """
+        事务提交前重新加载的进程在提交后还会再加载一次
+        """
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.problem.time_limit = 2000
+            self.problem.save()
+            info = get_problem_judge_info(self.problem.id)
+        for callback in callbacks:
+            callback()
+        with self.assertNumQueries(1):
+            self.assertIsNot(get_problem_judge_info(self.problem.id), info)
+
+    def test_invalidate_after_update(self):
+        get_problem_judge_info(self.problem.id)
+        Problem.objects.filter(id=self.problem.id).update(fail_fast=True)
+        invalidate_problem_judge_info(self.problem.id)
+        self.assertTrue(get_problem_judge_info(self.problem.id).fail_fast)
+
+
+class UserProblemStatusTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="username", email="123@qq.com", password="123")
+        self.problems = [Problem.objects.create(**{**DEFAULT_PROBLEM_DATA, 'name': f"Problem {i}"})
+                         for i in range(5)]
+        self.problems[0].pass_users.add(self.user)
+        self.problems[1].star_users.add(self.user)
+
+    def test_status(self):
+        status = UserProblemStatus(self.user)
+        self.assertEqual(status.passed, {self.problems[0].id})
+        self.assertEqual(status.starred, {self.problems[1].id})
+        problems = status.annotate([{'id': problem.id} for problem in self.problems[:2]], star=True)
+        self.assertEqual([(p['pass_status'], p['star_status']) for p in problems], [(True, False), (False, True)])
+        self.assertEqual(status.pass_count([problem.id for problem in self.problems]), 1)
+
+    def test_anonymous(self):
+        status = UserProblemStatus(AnonymousUser())
+        with self.assertNumQueries(0):
+            self.assertIsNone(status.pass_status(self.problems[0].id))
+            self.assertIsNone(status.pass_count([self.problems[0].id]))
+
+    def test_cached_and_invalidated(self):
+        UserProblemStatus(self.user).passed
+        with self.assertNumQueries(0):
+            self.assertEqual(UserProblemStatus(self.user).passed, {self.problems[0].id})
+        self.problems[2].pass_users.add(self.user)
+        self.assertEqual(UserProblemStatus(self.user).passed, {self.problems[0].id, self.problems[2].id})
+        self.user.star_problems.remove(self.problems[1])
+        self.assertEqual(UserProblemStatus(self.user).starred, set())
+        self.problems[0].pass_users.clear()
+        self.assertEqual(UserProblemStatus(self.user).passed, {self.problems[2].id})
+
+    def test_problemset_queries(self):
+        self.client.login(email="123@qq.com", password="123")
+        request_data = {'page_num': 1, 'page_size': 10}
+        data = self.client.get(reverse("problemset"), request_data).data['data']
+        self.assertEqual(data['count'], 5)
+        self.assertEqual({p['id']: p['pass_status'] for p in data['problems']},
+                         {problem.id: problem is self.problems[0] for problem in self.problems})
+
+        # 页面大小不影响查询数
+        with self.assertNumQueries(self.count_queries(request_data)):
+            self.client.get(reverse("problemset"), {'page_num': 1, 'page_size': 2})
+
+    def count_queries(self, request_data):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse("problemset"), request_data)
+        return len(context.captured_queries)
+
+    def test_problem_list_detail(self):
+        problem_list = ProblemList.objects.create(title='title', create_user=self.user, is_public=True)
+        problem_list.add_problem(self.problems[:3])
+        self.client.login(email="123@qq.com", password="123")
+        data = self.client.get(reverse("problem_list_detail", args=[problem_list.id])).data['data']
+        self.assertEqual([p['pass_status'] for p in data['problems']], [True, False, False])
+
+    def test_tried_problems(self):
+        for problem in self.problems[:2]:
+            Submission.objects.create(problem=problem, user_id=self.user.id, code="code", language="C")
+        data = self.client.get(reverse("user_practice", args=[self.user.id])).data['data']
+        self.assertEqual(sorted((p['id'], p['pass_status']) for p in data),
+                         [(self.problems[0].id, True), (self.problems[1].id, False)])
+
+
+class ProblemSearchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tree = Problem.objects.create(**{**DEFAULT_PROBLEM_DATA, 'name': "二叉树的遍历",
+                                              'description': "给定一棵二叉树，输出它的前序遍历", 'difficulty': 2})
+        self.graph = Problem.objects.create(**{**DEFAULT_PROBLEM_DATA, 'name': "Shortest Path",
+                                               'description': "给定一张图，图中的边权是一棵树的深度", 'difficulty': 3})
+        self.sum = Problem.objects.create(**{**DEFAULT_PROBLEM_DATA, 'name': "A+B Problem",
+                                             'description': "Output the sum of two integers", 'difficulty': 1})
+        # 索引构建完成之前检索回退到数据库查询，见test_index_not_ready
+        get_problem_search_index()
+
+    def test_tokenize(self):
+        self.assertEqual(sorted(tokenize("Hello 二叉树World!")), sorted(["hello", "二叉", "叉树", "树", "world"]))
+        self.assertEqual(tokenize("Hello 二叉树World!", query=True), ["hello", "二叉", "叉树", "world"])
+        self.assertEqual(tokenize("树", query=True), ["树"])
+
+    def test_index(self):
+        index = ProblemSearchIndex()
+        index.add(1, "树", "")
+        index.add(2, "图", "一棵树")
+        index.add(3, "sum", "sum of integers")
+        # 名称中出现的词得分更高
+        self.assertEqual(index.search("树"), [1, 2])
+        self.assertEqual(index.search("一棵树"), [2])
+        self.assertEqual(index.search("in"), [3])
+        self.assertEqual(index.search("sum graph"), [])
+        self.assertIsNone(index.search("+"))
+        index.remove(1)
+        self.assertEqual(index.search("树"), [2])
+        index.remove(3)
+        self.assertNotIn("sum", index.vocabulary)
+        self.assertEqual(len(index), 1)
+
+    def test_search(self):
+        self.assertEqual(search_problems("二叉树"), [self.tree.id])
+        self.assertEqual(search_problems("树"), [self.tree.id, self.graph.id])
+        self.assertEqual(search_problems("shortest pa"), [self.graph.id])
+        self.assertEqual(search_problems("SUM"), [self.sum.id])
+
+    def test_incremental_update(self):
+        index = get_problem_search_index()
+        self.sum.description = "计算两个整数的和"
+        self.sum.save()
+        self.assertEqual(search_problems("整数"), [self.sum.id])
+        self.assertEqual(search_problems("integers"), [])
+        self.graph.delete()
+        self.assertEqual(search_problems("树"), [self.tree.id])
+        # 增量同步，没有重建索引
+        self.assertIs(get_problem_search_index(), index)
+
+        # 只修改计数器时不需要同步
+        self.tree.pass_cnt = 1
+        self.tree.save(update_fields=["pass_cnt"])
+        with self.assertNumQueries(0):
+            get_problem_search_index()
+
+    def test_single_character_expansion(self):
+        """
+        单个中日韩文字的前缀匹配不受MAX_PREFIX_EXPANSION限制
+        """
+        index = ProblemSearchIndex()
+        for i in range(MAX_PREFIX_EXPANSION + 10):
+            index.add(i, "", "树" + chr(0x4e00 + i))
+        self.assertEqual(len(index.search("树")), MAX_PREFIX_EXPANSION + 10)
+
+    def test_missing_change(self):
+        """
+        最新的修改记录还没有写入时不重建索引，超过CHANGE_WRITE_GRACE秒仍然缺失才重建
+        """
+        index = get_problem_search_index()
+        # 另一个进程增加了序号，还没有写入修改记录
+        cache.incr(f"{CacheKey.problem_search_changes}:{cache.get(CacheKey.problem_search_epoch)}:seq")
+        self.sum.description = "计算两个整数的和"
+        self.sum.save()
+        self.assertIs(get_problem_search_index(), index)
+        self.assertEqual(search_problems("integers"), [self.sum.id])
+        with mock.patch("problem.search.time.monotonic", return_value=time.monotonic() + CHANGE_WRITE_GRACE + 1):
+            self.assertIsNot(get_problem_search_index(), index)
+        self.assertEqual(search_problems("整数"), [self.sum.id])
+
+    def test_index_not_ready(self):
+        """
+        进程中还没有索引时在后台构建，构建完成之前检索回退到数据库查询
+        """
+        with mock.patch("problem.search._index", None), \
+                mock.patch("problem.search.warm_up_problem_search_index") as warm_up:
+            self.assertIsNone(search_problems("树"))
+            warm_up.assert_called_once()
+            data = self.client.get(reverse("problemset"), {'keyword': "树"}).data['data']
+        self.assertEqual([p['id'] for p in data['problems']], [self.tree.id, self.graph.id])
+
+    def test_problemset(self):
+        data = self.client.get(reverse("problemset"), {'keyword': "树", 'page_num': 1, 'page_size': 10}).data['data']
+        self.assertEqual([p['id'] for p in data['problems']], [self.tree.id, self.graph.id])
+        self.assertEqual(data['count'], 2)
+
+        data = self.client.get(reverse("problemset"), {'keyword': "树", 'min_difficulty': 3}).data['data']
+        self.assertEqual([p['id'] for p in data['problems']], [self.graph.id])
+
+        data = self.client.get(reverse("problemset"), {'keyword': "树", 'sort_type': 'idDesc'}).data['data']
+        self.assertEqual([p['id'] for p in data['problems']], [self.graph.id, self.tree.id])
+
+    def test_problemset_invalid_params(self):
+        url = reverse("problemset")
+        for params in ({'keyword': "树", 'min_difficulty': "a"}, {'max_difficulty': "1.5"}, {'tags': ["x"]}):
+            response = self.client.get(url, params)
+            self.assertEqual((response.status_code, response.data['msg']), (200, '参数错误！'))
+
+    def test_problemset_filters(self):
+        tag = Tag.objects.create(name="tree")
+        self.tree.tags.add(tag)
+        url = reverse("problemset")
+        data = self.client.get(url, {'keyword': "树", 'tags': [tag.id]}).data['data']
+        self.assertEqual([p['id'] for p in data['problems']], [self.tree.id])
+        # 标签修改后同步到索引
+        self.tree.tags.remove(tag)
+        self.graph.tags.add(tag)
+        data = self.client.get(url, {'keyword': "树", 'tags': [tag.id]}).data['data']
+        self.assertEqual([p['id'] for p in data['problems']], [self.graph.id])
+
+        data = self.client.get(url, {'keyword': "树", 'sort_type': 'diffDesc'}).data['data']
+        self.assertEqual([p['id'] for p in data['problems']], [self.graph.id, self.tree.id])
+        Problem.objects.filter(id=self.tree.id).update(attempt_cnt=2, pass_cnt=1)
+        Problem.objects.filter(id=self.graph.id).update(attempt_cnt=4, pass_cnt=1)
+        data = self.client.get(url, {'keyword': "树", 'sort_type': 'passRateDesc'}).data['data']
+        self.assertEqual([p['id'] for p in data['problems']], [self.tree.id, self.graph.id])
+        data = self.client.get(url, {'keyword': "树", 'sort_type': 'passRateAsc', 'page_size': 1}).data['data']
+        self.assertEqual(([p['id'] for p in data['problems']], data['count']), ([self.graph.id], 2))
+
+        # 只读取本页的题目和标签
+        with self.assertNumQueries(2):
+            self.client.get(url, {'keyword': "树", 'min_difficulty': 3, 'sort_type': 'idAsc'})
@@ -0,0 +1,100 @@
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from problem.models import Problem
+from utils.cache import get_version, bump_version
+from utils.constants import CacheKey
+
+# 用户的通过/收藏集合在缓存中最多保留的秒数
+USER_STATUS_TTL = 10 * 60
+
+
+def _version_key(user_id):
+    return f"{CacheKey.user_problem_status}:version:{user_id}"
+
+
+def _data_key(user_id):
+    return f"{CacheKey.user_problem_status}:data:{user_id}"
+
+
+class UserProblemStatus:
+    """
+    一个用户通过和收藏的题目id集合，每个请求只加载一次，之后判断任意一道题目的状态都是O(1)的
+    1. 集合缓存在共享缓存中，缓存带有用户的版本号；通过状态或收藏改变时版本号改变，旧的缓存不再使用
+    2. 先读版本号再读数据库，并发写入时最多多读一次数据库，不会长期缓存旧的集合
+    3. 未登录用户的所有状态都是None
+    """
+    def __init__(self, user):
+        self.user_id = user.id if user.is_authenticated else None
+        self._sets = None
+
+    def _load(self):
+        if self._sets is not None:
+            return self._sets
+        version_key, data_key = _version_key(self.user_id), _data_key(self.user_id)
+        values = cache.get_many([version_key, data_key])
+        version = values.get(version_key) or get_version(version_key, timeout=USER_STATUS_TTL)
+        data = values.get(data_key)
+        if data is not None and data[0] == version:
+            self._sets = data[1:]
+            return self._sets
+
+        passed = frozenset(Problem.pass_users.through.objects.filter(user_id=self.user_id)
+                           .values_list("problem_id", flat=True))
+        starred = frozenset(Problem.star_users.through.objects.filter(user_id=self.user_id)
+                            .values_list("problem_id", flat=True))
+        cache.set(data_key, (version, passed, starred), timeout=USER_STATUS_TTL)
+        self._sets = passed, starred
+        return self._sets
+
+    @property
+    def passed(self):
+        return self._load()[0] if self.user_id is not None else frozenset()
+
+    @property
+    def starred(self):
+        return self._load()[1] if self.user_id is not None else frozenset()
+
+    def pass_status(self, problem_id):
+        return problem_id in self.passed if self.user_id is not None else None
+
+    def star_status(self, problem_id):
+        return problem_id in self.starred if self.user_id is not None else None
+
+    def pass_count(self, problem_ids):
+        return len(self.passed.intersection(problem_ids)) if self.user_id is not None else None
+
+    def annotate(self, problems, star=False):
+        """
+        为序列化后的题目(包含id的字典)添加pass_status，star为True时同时添加star_status
+        """
+        for problem in problems:
+            problem["pass_status"] = self.pass_status(problem["id"])
+            if star:
+                problem["star_status"] = self.star_status(problem["id"])
+        return problems
+
+
+def invalidate_user_problem_status(user_ids):
+    """
+    用户的通过状态或收藏改变后调用；通过pass_users/star_users的add、remove、clear修改时会自动调用，
+    直接操作中间表(bulk_create、delete)时需要手动调用。在事务中调用时提交后会再失效一次
+    """
+    user_ids = list(user_ids)
+    if user_ids:
+        bump_version([_version_key(user_id) for user_id in user_ids], timeout=USER_STATUS_TTL)
+
+
+@receiver(m2m_changed, sender=Problem.pass_users.through)
+@receiver(m2m_changed, sender=Problem.star_users.through)
+def _problem_users_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # 从用户一侧修改，instance是用户
+        if action in ("post_add", "post_remove", "post_clear"):
+            invalidate_user_problem_status([instance.pk])
+    elif action in ("post_add", "post_remove"):
+        invalidate_user_problem_status(pk_set)
+    elif action == "pre_clear":
+        invalidate_user_problem_status(sender.objects.filter(problem_id=instance.pk)
+                                       .values_list("user_id", flat=True))
@@ -7,6 +7,8 @@ from problem.models import Problem, Solution, ProblemList, Tag, SolutionComment
 from problem.serializers import ProblemSerializer, SolutionSerializer, ProblemListSerializer, \
     ProblemListDetailSerializer, SolutionCreateSerializer, TagSerializer, ProblemListCreateSerializer, \
     ProblemCreateSerializer, SolutionCommentSerializer
+from problem.search import search_problems
+from problem.user_status import UserProblemStatus
 from utils.api import success, fail, paginate_data, validate_serializer
 
 sort_dict = {
@@ -24,6 +26,9 @@ sort_dict = {
     'diffDesc': '-difficulty',
 }
 
+# 按通过率排序检索结果时每次读取计数器的题目数
+PASS_RATE_CHUNK_SIZE = 1000
+
 
 class ProblemDescriptionAPI(APIView):
     @staticmethod
@@ -117,13 +122,16 @@ class ProblemListAPI(APIView):
 
         problem_lists = problem_lists.exclude(create_user=request.user)
         response_data = paginate_data(request, problem_lists, ProblemListSerializer)
+        # 一次查询取出本页所有题单的题目
+        list_problems = {}
+        for problem_list_id, problem_id in ProblemList.problems.through.objects.filter(
+                problemlist_id__in=[problem_list['id'] for problem_list in response_data]) \
+                .values_list('problemlist_id', 'problem_id'):
+            list_problems.setdefault(problem_list_id, []).append(problem_id)
+        status = UserProblemStatus(request.user)
         # response_data为list,problem_list为字典
         for problem_list in response_data:
-            problem_list['pass_count'] = 0
-            # problem_list['id']取自于数据库，可保证存在，不需要处理异常
-            for problem in ProblemList.objects.get(id=problem_list['id']).problems.all():
-                if problem.get_pass_status(request.user):
-                    problem_list['pass_count'] += 1
+            problem_list['pass_count'] = status.pass_count(list_problems.get(problem_list['id'], []))
 
         return success({'count': problem_lists.count(), 'problemlists': response_data})
 
@@ -171,12 +179,7 @@ class ProblemListDetailAPI(APIView):
         else:
             response_data['star_status'] = None
 
-        problems = response_data['problems']
-        for problem in problems:
-            if request.user.is_authenticated:
-                problem['pass_status'] = Problem.objects.get(id=problem['id']).get_pass_status(request.user)
-            else:
-                problem['pass_status'] = None
+        UserProblemStatus(request.user).annotate(response_data['problems'])
 
         return success(response_data)
 
@@ -309,43 +312,80 @@ class TagAPI(APIView):
         return success(serializer.data)
 
 
+def _sort_by_pass_rate(problem_ids, descending):
+    """
+    按通过率排序，每次读取PASS_RATE_CHUNK_SIZE道题目的计数器；没有提交过的题目排在最前(降序时在最后)，与数据库的排序一致
+    """
+    rates = {}
+    for i in range(0, len(problem_ids), PASS_RATE_CHUNK_SIZE):
+        rates.update((problem_id, pass_cnt / attempt_cnt if attempt_cnt else -1)
+                     for problem_id, pass_cnt, attempt_cnt in Problem.objects
+                     .filter(id__in=problem_ids[i:i + PASS_RATE_CHUNK_SIZE])
+                     .values_list('id', 'pass_cnt', 'attempt_cnt'))
+    # 稳定排序，通过率相同的题目按id排序
+    return sorted(sorted(problem_ids), key=lambda problem_id: rates.get(problem_id, -1), reverse=descending)
+
+
 class ProblemsetAPI(APIView):
     def get(self, request):
         """
         获取题库，根据keyword、min_difficulty、max_difficulty、tags进行筛选，根据sort_type进行排序
         可选的sort_type: idAsc（默认） || idDesc || diffAsc || diffDesc || passRateAsc || passRateDesc
+        keyword在题目名称和描述的检索索引中查询，没有指定sort_type时按相关度排序，其它筛选条件也在索引中完成
         返回所有的题目信息
         """
-        keyword = request.GET.get('keyword', '')
-        min_difficulty = request.GET.get('min_difficulty')
-        max_difficulty = request.GET.get('max_difficulty')
-        tags = request.GET.get('tags')
-        sort_type = request.GET.get('sort_type', 'idAsc')
+        keyword = request.GET.get('keyword', '').strip()
+        try:
+            min_difficulty = int(request.GET['min_difficulty']) if request.GET.get('min_difficulty') else None
+            max_difficulty = int(request.GET['max_difficulty']) if request.GET.get('max_difficulty') else None
+            tags = {int(tag) for tag in request.GET.getlist('tags')}
+        except ValueError:
+            return fail('参数错误！')
+        sort_type = request.GET.get('sort_type')
 
-        problems = Problem.objects.filter(Q(title__icontains=keyword) | Q(description__icontains=keyword))
-        if min_difficulty:
+        problems = Problem.objects.all()
+        if min_difficulty is not None:
             problems = problems.filter(difficulty__gte=min_difficulty)
-        if max_difficulty:
+        if max_difficulty is not None:
             problems = problems.filter(difficulty__lte=max_difficulty)
         if tags:
-            problems = problems.filter(tags__in=tags)
-        if sort_type[:8] == 'passRate':
-            problems = problems.annotate(
-                            pass_rate=ExpressionWrapper(
-                                F('passed_count') / F('attempt_count'),
-                                output_field=FloatField()
-                            )
-                        ).order_by('pass_rate' if sort_type == 'passRateAsc' else '-pass_rate')
+            problems = problems.filter(tags__in=tags).distinct()
+
+        ranked = None
+        if keyword:
+            # 难度、标签的筛选和按id、难度排序在检索索引中完成，不需要把匹配的题目id传给数据库
+            pass_rate = (sort_type or '')[:8] == 'passRate'
+            order_by = sort_dict[sort_type] if sort_type and not pass_rate else None
+            ranked = search_problems(keyword, min_difficulty=min_difficulty, max_difficulty=max_difficulty,
+                                     tags=tags, order_by=order_by)
+            if ranked is not None and pass_rate:
+                ranked = _sort_by_pass_rate(ranked, sort_type == 'passRateDesc')
+        if ranked is not None:
+            # 分页后只读取本页的题目
+            count = len(ranked)
+            page_ids = paginate_data(request, ranked)
+            page = Problem.objects.prefetch_related('tags').in_bulk(page_ids)
+            problems = ProblemSerializer([page[problem_id] for problem_id in page_ids if problem_id in page],
+                                         many=True).data
         else:
-            problems = problems.order_by(sort_dict[sort_type])
-        problems = paginate_data(request, problems, ProblemSerializer)
-        for problem in problems:
-            if request.user.is_authenticated:
-                problem['pass_status'] = Problem.objects.get(id=problem['id']).get_pass_status(request.user)
+            if keyword:
+                # keyword中没有可以检索的词(只有标点符号等)，或者检索索引还在构建中
+                problems = problems.filter(Q(name__icontains=keyword) | Q(description__icontains=keyword))
+            sort_type = sort_type or 'idAsc'
+            if sort_type[:8] == 'passRate':
+                problems = problems.annotate(
+                                pass_rate=ExpressionWrapper(
+                                    F('pass_cnt') * 1.0 / F('attempt_cnt'),
+                                    output_field=FloatField()
+                                )
+                            ).order_by('pass_rate' if sort_type == 'passRateAsc' else '-pass_rate')
             else:
-                problem['pass_status'] = None
+                problems = problems.order_by(sort_dict[sort_type])
+            count = problems.count()
+            problems = paginate_data(request, problems.prefetch_related('tags'), ProblemSerializer)
+        problems = UserProblemStatus(request.user).annotate(problems)
 
-        resp = {"count": problems.count(), 'problems': problems}
+        resp = {"count": count, 'problems': problems}
         return success(resp)
 
 
@@ -0,0 +1,33 @@
+import hashlib
+import zlib
+
+
+def code_hash(code):
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+def compress_code(code):
+    return zlib.compress(code.encode("utf-8"), 9)
+
+
+def decompress_code(data):
+    return zlib.decompress(bytes(data)).decode("utf-8")
+
+
+def store_codes(codes, code_model):
+    """
+    按内容寻址保存一组源代码，hash已经存在的不再写入
+    返回(与codes一一对应的code_model实例列表, 本次新写入的压缩后字节数)；传入模型类是为了回填命令和数据迁移都能使用
+    """
+    blobs = {}
+    hashes = []
+    for code in codes:
+        key = code_hash(code)
+        hashes.append(key)
+        if key not in blobs:
+            blobs[key] = code_model(hash=key, data=compress_code(code), size=len(code.encode("utf-8")))
+    existing = set(code_model.objects.filter(hash__in=blobs.keys()).values_list("hash", flat=True))
+    new = [blob for key, blob in blobs.items() if key not in existing]
+    # 并发写入同一份代码时忽略主键冲突
+    code_model.objects.bulk_create(new, ignore_conflicts=True)
+    return [blobs[key] for key in hashes], sum(len(blob.data) for blob in new)
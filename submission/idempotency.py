@@ -0,0 +1,59 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+
+from utils.constants import CacheKey
+
+# 同一个Idempotency-Key在多长时间内有效(秒)
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# 认领后还没有完成的key保留的秒数，请求异常退出时过期后可以重新使用
+IN_PROGRESS_TTL = 60
+# key处理中时建议客户端等待的秒数
+IN_PROGRESS_RETRY_AFTER = 1
+
+
+class SubmitIdempotency:
+    """
+    提交接口的幂等性：客户端为每次提交生成一个Idempotency-Key，重复点击或超时重试时带上相同的key，
+    只有第一次请求会创建提交和判题任务，之后的请求直接返回第一次请求的submission_id。
+    1. key按用户隔离，保存在缓存中，cache.add保证并发的重复请求中只有一个能认领
+    2. 认领时key处于处理中状态，提交的事务提交后才由finish记录submission_id，此前的重复请求需要稍后重试
+    3. key与请求内容(题目、语言、代码)的指纹绑定，同一个key用于不同的请求内容时拒绝
+    """
+    @staticmethod
+    def _key(user_id, idempotency_key):
+        digest = hashlib.sha256(idempotency_key.encode("utf-8")).hexdigest()
+        return f"{CacheKey.submit_idempotency}:{user_id}:{digest}"
+
+    @staticmethod
+    def fingerprint(problem_id, language, code):
+        return hashlib.sha256(json.dumps([str(problem_id), language, code]).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def claim(cls, user_id, idempotency_key, fingerprint):
+        """
+        认领key，成功返回None；key已经被认领过时返回当时的记录{"fingerprint": ..., "submission_id": ...}，
+        submission_id为None表示第一次请求还在处理中
+        """
+        key = cls._key(user_id, idempotency_key)
+        while not cache.add(key, {"fingerprint": fingerprint, "submission_id": None}, timeout=IN_PROGRESS_TTL):
+            existing = cache.get(key)
+            if existing is not None:
+                return existing
+        return None
+
+    @classmethod
+    def finish(cls, user_id, idempotency_key, fingerprint, submission_id):
+        """
+        提交的事务提交后调用，之后的重复请求直接返回submission_id
+        """
+        cache.set(cls._key(user_id, idempotency_key), {"fingerprint": fingerprint, "submission_id": submission_id},
+                  timeout=IDEMPOTENCY_KEY_TTL)
+
+    @classmethod
+    def forget(cls, user_id, idempotency_key):
+        """
+        提交失败时释放key，客户端可以用同一个key重试
+        """
+        cache.delete(cls._key(user_id, idempotency_key))
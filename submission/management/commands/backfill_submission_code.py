@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from submission.code_store import store_codes
+from submission.models import Submission, SubmissionCode
+
+
+class Command(BaseCommand):
+    help = "把旧提交保存在submission.code列中的源代码分批迁移到按内容寻址的submission_code表"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="每个事务迁移的提交数")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size必须大于0")
+
+        migrated = raw_bytes = stored_bytes = 0
+        last = ""
+        while True:
+            submissions = list(Submission.objects.filter(id__gt=last).exclude(raw_code="").order_by("id")
+                               .only("id", "raw_code")[:options["batch_size"]])
+            if not submissions:
+                break
+            with transaction.atomic():
+                blobs, new_bytes = store_codes([submission.raw_code for submission in submissions], SubmissionCode)
+                for submission, blob in zip(submissions, blobs):
+                    raw_bytes += len(submission.raw_code.encode("utf-8"))
+                    submission.code_ref = blob
+                    submission.raw_code = ""
+                Submission.objects.bulk_update(submissions, ["code_ref", "raw_code"])
+            migrated += len(submissions)
+            stored_bytes += new_bytes
+            last = submissions[-1].id
+            self.stdout.write(f"{migrated} submissions migrated")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{migrated} submissions migrated, {raw_bytes} bytes of code stored as {stored_bytes} bytes, "
+            f"{raw_bytes - stored_bytes} bytes reclaimed"))
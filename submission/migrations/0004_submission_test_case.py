@@ -0,0 +1,40 @@
+# Generated by Django 5.1.2 on 2026-10-16 23:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0003_alter_submission_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionOutput',
+            fields=[
+                ('submission', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='output', serialize=False, to='submission.submission')),
+                ('data', models.BinaryField()),
+            ],
+            options={
+                'db_table': 'submission_output',
+            },
+        ),
+        migrations.CreateModel(
+            name='SubmissionTestCase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('test_case', models.CharField(max_length=32)),
+                ('result', models.SmallIntegerField()),
+                ('cpu_time', models.IntegerField()),
+                ('memory', models.IntegerField()),
+                ('output_md5', models.CharField(blank=True, max_length=32)),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='test_cases', to='submission.submission')),
+            ],
+            options={
+                'db_table': 'submission_test_case',
+                'unique_together': {('submission', 'test_case')},
+            },
+        ),
+    ]
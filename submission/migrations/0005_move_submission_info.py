@@ -0,0 +1,73 @@
+from django.db import migrations, transaction
+
+from submission.results import save_test_case_results, decompress_outputs
+
+BATCH_SIZE = 500
+
+
+def split_info(apps, schema_editor):
+    """
+    把info中各测试点的结果移到submission_test_case和submission_output，info只保留概要
+    """
+    Submission = apps.get_model("submission", "Submission")
+    SubmissionTestCase = apps.get_model("submission", "SubmissionTestCase")
+    SubmissionOutput = apps.get_model("submission", "SubmissionOutput")
+
+    last = ""
+    while True:
+        submissions = list(Submission.objects.filter(id__gt=last, info__has_key="data").order_by("id")
+                           .only("id", "info")[:BATCH_SIZE])
+        if not submissions:
+            break
+        with transaction.atomic():
+            for submission in submissions:
+                save_test_case_results(submission.id, submission.info["data"], SubmissionTestCase, SubmissionOutput)
+                submission.info = {"err": submission.info.get("err"), "skipped": submission.info.get("skipped", [])}
+            Submission.objects.bulk_update(submissions, ["info"])
+        last = submissions[-1].id
+
+
+def merge_info(apps, schema_editor):
+    """
+    反向迁移，只能恢复submission_test_case中保存的字段和程序输出
+    """
+    Submission = apps.get_model("submission", "Submission")
+    SubmissionTestCase = apps.get_model("submission", "SubmissionTestCase")
+    SubmissionOutput = apps.get_model("submission", "SubmissionOutput")
+
+    last = ""
+    while True:
+        submissions = list(Submission.objects.filter(id__gt=last, test_cases__isnull=False).distinct()
+                           .order_by("id").only("id", "info")[:BATCH_SIZE])
+        if not submissions:
+            break
+        ids = [submission.id for submission in submissions]
+        cases = {}
+        for case in SubmissionTestCase.objects.filter(submission_id__in=ids).order_by("id"):
+            cases.setdefault(case.submission_id, []).append(
+                {"test_case": case.test_case, "result": case.result, "cpu_time": case.cpu_time,
+                 "memory": case.memory, "output_md5": case.output_md5})
+        outputs = {output.submission_id: decompress_outputs(output.data)
+                   for output in SubmissionOutput.objects.filter(submission_id__in=ids)}
+        with transaction.atomic():
+            for submission in submissions:
+                for case in cases[submission.id]:
+                    case["output"] = outputs.get(submission.id, {}).get(case["test_case"])
+                submission.info = {**submission.info, "data": cases[submission.id]}
+            Submission.objects.bulk_update(submissions, ["info"])
+            SubmissionTestCase.objects.filter(submission_id__in=ids).delete()
+            SubmissionOutput.objects.filter(submission_id__in=ids).delete()
+        last = submissions[-1].id
+
+
+class Migration(migrations.Migration):
+    # 提交表可能很大，分批提交事务
+    atomic = False
+
+    dependencies = [
+        ('submission', '0004_submission_test_case'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_info, merge_info),
+    ]
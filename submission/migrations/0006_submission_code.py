@@ -0,0 +1,43 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0005_move_submission_info'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionCode',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('size', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'submission_code',
+            },
+        ),
+        # 只修改字段名，数据库中的列仍然是code，避免大表改列
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RenameField(
+                    model_name='submission',
+                    old_name='code',
+                    new_name='raw_code',
+                ),
+                migrations.AlterField(
+                    model_name='submission',
+                    name='raw_code',
+                    field=models.TextField(blank=True, db_column='code', default=''),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='code_ref',
+            field=models.ForeignKey(db_column='code_hash', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='submission.submissioncode'),
+        ),
+    ]
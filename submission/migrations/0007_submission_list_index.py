@@ -0,0 +1,22 @@
+# Generated by Django 5.1.2 on 2026-10-16 23:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0016_problem_fail_fast'),
+        ('submission', '0006_submission_code'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['problem', 'create_time', 'id'], name='submission_problem_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['problem', 'user_id', 'create_time', 'id'], name='submission_problem_user_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-16 23:56
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0007_submission_list_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='submission',
+            name='id',
+            field=models.CharField(db_index=True, default=uuid.uuid4, max_length=36, primary_key=True, serialize=False),
+        ),
+    ]
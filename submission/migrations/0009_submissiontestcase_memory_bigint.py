@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-17 00:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submission', '0008_alter_submission_id_default'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='submissiontestcase',
+            name='memory',
+            field=models.BigIntegerField(),
+        ),
+    ]
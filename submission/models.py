@@ -1,8 +1,11 @@
 import uuid
+from functools import cached_property
 
 from django.db import models
 
 from problem.models import Problem
+from submission.code_store import decompress_code, store_codes
+from submission.results import decompress_outputs
 
 from utils.shortcuts import rand_str
 
@@ -21,15 +24,36 @@ class JudgeStatus:
     PARTIALLY_ACCEPTED = 8
 
 
+class SubmissionCode(models.Model):
+    """
+    按内容寻址保存的源代码，hash为sha256，相同的代码(重复提交、语言模板)只保存一份，data为zlib压缩后的代码
+    """
+    hash = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+    # 压缩前的字节数
+    size = models.IntegerField()
+
+    class Meta:
+        db_table = "submission_code"
+
+    @cached_property
+    def code(self):
+        return decompress_code(self.data)
+
+
 class Submission(models.Model):
-    id = models.CharField(max_length=36, default=uuid.uuid4(), primary_key=True, db_index=True)
+    id = models.CharField(max_length=36, default=uuid.uuid4, primary_key=True, db_index=True)
     problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
     create_time = models.DateTimeField(auto_now_add=True)
     user_id = models.IntegerField(db_index=True)
     username = models.TextField()
-    code = models.TextField()
+    # 源代码通过code属性读写，保存时写入SubmissionCode；raw_code只在回填之前的旧数据以及bulk_create的行中非空，
+    # 由manage.py backfill_submission_code迁移
+    raw_code = models.TextField(db_column="code", blank=True, default="")
+    code_ref = models.ForeignKey(SubmissionCode, null=True, on_delete=models.PROTECT, db_column="code_hash",
+                                 related_name="+")
     result = models.IntegerField(db_index=True, default=JudgeStatus.PENDING)
-    # 从JudgeServer返回的判题详情
+    # 判题详情的概要{err: None, skipped: [...]}，各测试点的结果在SubmissionTestCase中，程序输出在SubmissionOutput中
     info = models.JSONField(default=dict)
     language = models.TextField()
     shared = models.BooleanField(default=False)
@@ -41,6 +65,61 @@ class Submission(models.Model):
     class Meta:
         db_table = "submission"
         ordering = ("-create_time",)
+        # 题目的提交列表按(create_time, id)做游标分页，定位和排序都在索引中完成，每页只回表page_size行
+        indexes = [
+            models.Index(fields=["problem", "create_time", "id"], name="submission_problem_time_idx"),
+            models.Index(fields=["problem", "user_id", "create_time", "id"], name="submission_problem_user_idx"),
+        ]
 
     def __str__(self):
         return self.id
+
+    @property
+    def code(self):
+        return self.code_ref.code if self.code_ref_id else self.raw_code
+
+    @code.setter
+    def code(self, value):
+        self.raw_code = value
+        self.code_ref = None
+
+    def save(self, *args, **kwargs):
+        if self.raw_code:
+            (self.code_ref, ), _ = store_codes([self.raw_code], SubmissionCode)
+            self.raw_code = ""
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "raw_code", "code_ref"}
+        super().save(*args, **kwargs)
+
+
+class SubmissionTestCase(models.Model):
+    """
+    提交在单个测试点上的判题结果，只保存定长的几个字段
+    """
+    submission = models.ForeignKey(Submission, on_delete=models.CASCADE, related_name="test_cases")
+    test_case = models.CharField(max_length=32)
+    result = models.SmallIntegerField()
+    # ms
+    cpu_time = models.IntegerField()
+    # B，超过2GiB时会超出IntegerField的范围
+    memory = models.BigIntegerField()
+    output_md5 = models.CharField(max_length=32, blank=True)
+
+    class Meta:
+        db_table = "submission_test_case"
+        unique_together = ("submission", "test_case")
+
+
+class SubmissionOutput(models.Model):
+    """
+    提交在各测试点上的程序输出，{test_case: output}压缩后保存，只在查看详情时读取
+    """
+    submission = models.OneToOneField(Submission, on_delete=models.CASCADE, primary_key=True, related_name="output")
+    data = models.BinaryField()
+
+    class Meta:
+        db_table = "submission_output"
+
+    @property
+    def outputs(self):
+        return decompress_outputs(self.data)
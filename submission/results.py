@@ -0,0 +1,33 @@
+import json
+import zlib
+
+
+def compress_outputs(outputs):
+    """
+    {test_case: output} -> zlib压缩后的json
+    """
+    return zlib.compress(json.dumps(outputs, separators=(",", ":")).encode("utf-8"))
+
+
+def decompress_outputs(data):
+    return json.loads(zlib.decompress(bytes(data)).decode("utf-8"))
+
+
+def save_test_case_results(submission_id, cases, test_case_model, output_model):
+    """
+    把判题服务器返回的各测试点结果拆成窄行写入test_case_model，非空的程序输出压缩后整体写入output_model；
+    重判时先删除旧的结果。传入模型类是为了数据迁移中也能使用历史模型
+    """
+    test_case_model.objects.filter(submission_id=submission_id).delete()
+    test_case_model.objects.bulk_create([
+        test_case_model(submission_id=submission_id, test_case=case["test_case"], result=case["result"],
+                        cpu_time=case.get("cpu_time", 0), memory=case.get("memory", 0),
+                        output_md5=case.get("output_md5") or "")
+        for case in cases])
+
+    outputs = {case["test_case"]: case["output"] for case in cases if case.get("output")}
+    if outputs:
+        output_model.objects.update_or_create(submission_id=submission_id,
+                                              defaults={"data": compress_outputs(outputs)})
+    else:
+        output_model.objects.filter(submission_id=submission_id).delete()
@@ -0,0 +1,21 @@
+from rest_framework import serializers
+
+from submission.models import Submission
+
+# 提交列表只读取这些字段，不读取源代码和判题详情
+SUBMISSION_LIST_FIELDS = ["id", "problem_id", "create_time", "user_id", "username", "result", "language", "shared",
+                          "statistic_info"]
+
+
+class SubmitSerializer(serializers.Serializer):
+    problem_id = serializers.IntegerField()
+    language = serializers.CharField(max_length=32)
+    code = serializers.CharField(max_length=1024 * 1024)
+
+
+class SubmissionListSerializer(serializers.ModelSerializer):
+    problem_id = serializers.IntegerField()
+
+    class Meta:
+        model = Submission
+        fields = SUBMISSION_LIST_FIELDS
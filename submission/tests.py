@@ -1,3 +1,307 @@
+import importlib
+import io
+from unittest import mock
+
+import dramatiq
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from dramatiq.brokers.stub import StubBroker
+
+from account.models import User
+from conf.conf import SysConfigs
+from judge.admission import AdmissionController
+from judge.events import publish_judge_event, JudgeEventType
+from judge.models import PendingTask
+from problem.models import Problem
+from problem.tests import DEFAULT_PROBLEM_DATA
+from submission.models import Submission, JudgeStatus, SubmissionTestCase, SubmissionOutput, SubmissionCode
+
+dramatiq.set_broker(StubBroker())
+
+
+class SubmissionEventsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="test", email="123@qq.com", password="password")
+        User.objects.create_user(username="other", email="456@qq.com", password="password")
+        self.problem = Problem.objects.create(**DEFAULT_PROBLEM_DATA)
+        self.submission = Submission.objects.create(id="submission", problem=self.problem, user_id=self.user.id,
+                                                    username=self.user.username, code="", language="C++")
+
+    async def get_events(self):
+        response = await self.async_client.get(reverse("submission_events", args=[self.submission.id]))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        return "".join([chunk.decode("utf-8") async for chunk in response.streaming_content])
+
+    async def test_finished(self):
+        """
+        已经判完的提交直接返回最终结果
+        """
+        await Submission.objects.filter(id=self.submission.id).aupdate(result=JudgeStatus.ACCEPTED)
+        events = await self.get_events()
+        self.assertTrue(events.startswith("event: finished\n"))
+        self.assertEqual(events.count("event:"), 1)
+
+    async def test_progress(self):
+        publish_judge_event(self.submission.id, JudgeEventType.STATUS, result=JudgeStatus.JUDGING)
+        publish_judge_event(self.submission.id, JudgeEventType.TEST_CASE, test_case="1",
+                            result=JudgeStatus.ACCEPTED, cpu_time=1, memory=1024)
+        publish_judge_event(self.submission.id, JudgeEventType.FINISHED, result=JudgeStatus.ACCEPTED,
+                            statistic_info={})
+        events = await self.get_events()
+        self.assertEqual([line for line in events.split("\n") if line.startswith("event:")],
+                         ["event: status", "event: status", "event: test_case", "event: finished"])
+
+    async def test_max_streams(self):
+        """
+        连接数达到上限时返回503，连接结束后释放名额
+        """
+        await Submission.objects.filter(id=self.submission.id).aupdate(result=JudgeStatus.ACCEPTED)
+        url = reverse("submission_events", args=[self.submission.id])
+        with mock.patch("submission.views.oj.EVENT_MAX_STREAMS", 0):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "5")
+        with mock.patch("submission.views.oj.EVENT_MAX_STREAMS", 1):
+            self.assertTrue((await self.get_events()).startswith("event: finished\n"))
+            self.assertTrue((await self.get_events()).startswith("event: finished\n"))
+
+    async def test_not_found(self):
+        response = await self.async_client.get(reverse("submission_events", args=["not-exist"]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_show_own_submission(self):
+        await Submission.objects.filter(id=self.submission.id).aupdate(result=JudgeStatus.ACCEPTED)
+        await sync_to_async(setattr)(SysConfigs, "submission_list_show_all", False)
+        url = reverse("submission_events", args=[self.submission.id])
+        self.assertEqual((await self.async_client.get(url)).status_code, 403)
+        await self.async_client.alogin(email="456@qq.com", password="password")
+        self.assertEqual((await self.async_client.get(url)).status_code, 403)
+        await self.async_client.alogin(email="123@qq.com", password="password")
+        self.assertTrue((await self.get_events()).startswith("event: finished\n"))
+
+
+class SubmissionInfoMigrationTestCase(TestCase):
+    def setUp(self):
+        self.migration = importlib.import_module("submission.migrations.0005_move_submission_info")
+        self.user = User.objects.create_user(username="test", email="123@qq.com", password="password")
+        self.problem = Problem.objects.create(**DEFAULT_PROBLEM_DATA)
+        self.data = [{"test_case": str(i), "result": JudgeStatus.ACCEPTED, "cpu_time": i, "memory": 1024,
+                      "output_md5": "md5", "output": f"output {i}"} for i in range(1, 4)]
+        Submission.objects.create(id="submission", problem=self.problem, user_id=self.user.id,
+                                  username=self.user.username, code="", language="C++",
+                                  info={"err": None, "data": self.data})
+
+    def test_split_and_merge(self):
+        self.migration.split_info(apps, None)
+        submission = Submission.objects.get(id="submission")
+        self.assertEqual(submission.info, {"err": None, "skipped": []})
+        self.assertEqual([(case.test_case, case.cpu_time) for case in submission.test_cases.order_by("id")],
+                         [("1", 1), ("2", 2), ("3", 3)])
+        self.assertEqual(submission.output.outputs, {str(i): f"output {i}" for i in range(1, 4)})
+
+        self.migration.merge_info(apps, None)
+        submission = Submission.objects.get(id="submission")
+        self.assertEqual(submission.info["data"], self.data)
+        self.assertFalse(SubmissionTestCase.objects.exists())
+        self.assertFalse(SubmissionOutput.objects.exists())
+
+
+class ProblemSubmitAPITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        from judge.tasks import judge_task
+        self.queue = judge_task.broker.queues[judge_task.queue_name]
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        SysConfigs.judge_admission = {"user_inflight": 1, "global_inflight": 100, "retry_after": 3}
+        self.user = User.objects.create_user(username="test", email="123@qq.com", password="password")
+        self.problem = Problem.objects.create(**DEFAULT_PROBLEM_DATA)
+        self.client.login(email="123@qq.com", password="password")
+        self.url = reverse("problem_submit")
+
+    def submit(self, language="C++", **headers):
+        # 判题任务在事务提交后才投递
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, {"problem_id": self.problem.id, "language": language,
+                                               "code": "int main() { return 0; }"}, headers=headers)
+
+    def test_submit(self):
+        data = self.submit().data["data"]
+        submission = Submission.objects.get(id=data["submission_id"])
+        self.assertEqual((submission.user_id, submission.result), (self.user.id, JudgeStatus.PENDING))
+        self.assertEqual(submission.code, "int main() { return 0; }")
+        self.assertEqual(self.queue.qsize(), 1)
+
+    def test_enqueue_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(self.url, {"problem_id": self.problem.id, "language": "C++", "code": "code"})
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.queue.qsize(), 0)
+
+    def test_send_failure(self):
+        """
+        投递失败时放入等待队列，提交仍然成功
+        """
+        from judge.tasks import judge_task
+        with mock.patch.object(judge_task, "send", side_effect=ConnectionError), self.assertLogs("submission"):
+            submission_id = self.submit().data["data"]["submission_id"]
+        self.assertEqual(list(PendingTask.objects.values_list("submission_id", "problem_id")),
+                         [(submission_id, self.problem.id)])
+
+    def test_idempotency_key(self):
+        SysConfigs.judge_admission = {"user_inflight": 5, "global_inflight": 100, "retry_after": 3}
+        first = self.submit(**{"Idempotency-Key": "key-1"}).data["data"]["submission_id"]
+        self.assertEqual(self.submit(**{"Idempotency-Key": "key-1"}).data["data"]["submission_id"], first)
+        self.assertEqual(Submission.objects.count(), 1)
+        self.assertEqual(self.queue.qsize(), 1)
+
+        self.assertNotEqual(self.submit(**{"Idempotency-Key": "key-2"}).data["data"]["submission_id"], first)
+        self.assertEqual(Submission.objects.count(), 2)
+
+    def test_idempotency_key_in_progress(self):
+        """
+        第一次请求的事务还没有提交时，重复请求需要稍后重试
+        """
+        SysConfigs.judge_admission = {"user_inflight": 5, "global_inflight": 100, "retry_after": 3}
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(self.url, {"problem_id": self.problem.id, "language": "C++",
+                                        "code": "int main() { return 0; }"}, headers={"Idempotency-Key": "key"})
+        response = self.submit(**{"Idempotency-Key": "key"})
+        self.assertEqual((response.status_code, response.data["err"]), (200, "submission-in-progress"))
+        self.assertEqual(response["Retry-After"], "1")
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.submit(**{"Idempotency-Key": "key"}).data["data"]["submission_id"],
+                         Submission.objects.get().id)
+
+    def test_idempotency_key_reused(self):
+        """
+        同一个key用于不同的代码时拒绝
+        """
+        self.submit(**{"Idempotency-Key": "key"})
+        response = self.client.post(self.url, {"problem_id": self.problem.id, "language": "C++", "code": "changed"},
+                                    headers={"Idempotency-Key": "key"})
+        self.assertEqual((response.status_code, response.data["err"]), (200, "idempotency-key-reused"))
+        self.assertEqual(Submission.objects.count(), 1)
+
+    def test_idempotency_key_after_failure(self):
+        """
+        提交失败时不占用key，客户端可以用同一个key重试
+        """
+        self.submit()
+        self.assertEqual(self.submit(**{"Idempotency-Key": "key"}).data["err"], "too-many-submissions")
+        AdmissionController.release(Submission.objects.get().id)
+        self.assertIsNone(self.submit(**{"Idempotency-Key": "key"}).data["err"])
+        self.assertEqual(Submission.objects.count(), 2)
+
+    def test_invalid_language(self):
+        self.assertEqual(self.submit("Brainfuck").data["msg"], "不支持该语言！")
+        self.assertFalse(Submission.objects.exists())
+
+    def test_admission(self):
+        submission_id = self.submit().data["data"]["submission_id"]
+        response = self.submit()
+        self.assertEqual(response.data["err"], "too-many-submissions")
+        self.assertEqual(response["Retry-After"], "3")
+        self.assertEqual(Submission.objects.count(), 1)
+        self.assertEqual(self.queue.qsize(), 1)
+
+        # 判题结束后释放名额
+        AdmissionController.release(submission_id)
+        self.assertIsNone(self.submit().data["err"])
+
+
+class SubmissionCodeTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test", email="123@qq.com", password="password")
+        self.problem = Problem.objects.create(**DEFAULT_PROBLEM_DATA)
+
+    def create(self, submission_id, code):
+        return Submission.objects.create(id=submission_id, problem=self.problem, user_id=self.user.id,
+                                         username=self.user.username, code=code, language="C++")
+
+    def test_default_id(self):
+        a = Submission.objects.create(problem=self.problem, user_id=self.user.id, username="test", code="")
+        b = Submission.objects.create(problem=self.problem, user_id=self.user.id, username="test", code="")
+        self.assertNotEqual(a.id, b.id)
+
+    def test_deduplicate(self):
+        self.create("a", "int main() { return 0; }")
+        self.create("b", "int main() { return 0; }")
+        self.create("c", "int main() { return 1; }")
+        self.assertEqual(SubmissionCode.objects.count(), 2)
+        submission = Submission.objects.get(id="b")
+        self.assertEqual(submission.raw_code, "")
+        self.assertEqual(submission.code, "int main() { return 0; }")
+
+    def test_backfill(self):
+        code = '#include <cstdio>\nint main() { puts("hello"); return 0; }\n' * 20
+        Submission.objects.bulk_create([
+            Submission(id=f"s{i}", problem=self.problem, user_id=self.user.id, username=self.user.username,
+                       code=code if i % 2 else code + "\n", language="C++") for i in range(5)])
+        self.assertEqual(Submission.objects.exclude(raw_code="").count(), 5)
+
+        out = io.StringIO()
+        call_command("backfill_submission_code", batch_size=2, stdout=out)
+        self.assertIn("5 submissions migrated", out.getvalue())
+        self.assertEqual(Submission.objects.exclude(raw_code="").count(), 0)
+        self.assertEqual(SubmissionCode.objects.count(), 2)
+        self.assertEqual({s.code for s in Submission.objects.select_related("code_ref")}, {code, code + "\n"})
+
+
+class ProblemSubmissionsAPITestCase(TestCase):
+    def setUp(self):
+        SysConfigs.submission_list_show_all = True
+        self.user = User.objects.create_user(username="test", email="123@qq.com", password="password")
+        self.other = User.objects.create_user(username="other", email="456@qq.com", password="password")
+        self.problem = Problem.objects.create(**DEFAULT_PROBLEM_DATA)
+        for i in range(7):
+            user = self.user if i % 2 else self.other
+            Submission.objects.create(id=f"s{i}", problem=self.problem, user_id=user.id, username=user.username,
+                                      code="secret", language="C++", info={"err": None, "skipped": []},
+                                      result=JudgeStatus.ACCEPTED if i % 3 else JudgeStatus.WRONG_ANSWER)
+        # 多个提交的提交时间相同时按id排序
+        Submission.objects.filter(id__in=["s2", "s3", "s4"]).update(
+            create_time=Submission.objects.get(id="s2").create_time)
+        self.url = reverse("problem_submissions", args=[self.problem.id])
+
+    def fetch_all(self, **params):
+        ids = []
+        cursor = None
+        while True:
+            query = {**params, "page_size": 2, **({"cursor": cursor} if cursor else {})}
+            data = self.client.get(self.url, query).data["data"]
+            self.assertLessEqual(len(data["submissions"]), 2)
+            ids += [submission["id"] for submission in data["submissions"]]
+            cursor = data["next"]
+            if not cursor:
+                return ids
+
+    def test_pages(self):
+        expected = list(Submission.objects.filter(problem=self.problem).order_by("-create_time", "-id")
+                        .values_list("id", flat=True))
+        self.assertEqual(self.fetch_all(), expected)
+
+        submission = self.client.get(self.url).data["data"]["submissions"][0]
+        self.assertNotIn("code", submission)
+        self.assertNotIn("info", submission)
+        self.assertEqual(submission["problem_id"], self.problem.id)
+
+    def test_filter(self):
+        self.assertEqual(set(self.fetch_all(user_id=self.user.id)), {"s1", "s3", "s5"})
+        self.assertEqual(set(self.fetch_all(result=JudgeStatus.WRONG_ANSWER)), {"s0", "s3", "s6"})
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(self.url, {"cursor": "invalid"}).data["msg"], "参数错误！")
 
-# Create your tests here.
+    def test_show_own_submissions(self):
+        SysConfigs.submission_list_show_all = False
+        self.assertEqual(self.client.get(self.url).data["msg"], "用户未登录！")
+        self.client.login(email="123@qq.com", password="password")
+        self.assertEqual(set(self.fetch_all(user_id=self.other.id)), {"s1", "s3", "s5"})
@@ -4,5 +4,6 @@ from ..views.oj import *
 
 urlpatterns = [
     path("problem/submit/", ProblemSubmitAPI.as_view(), name="problem_submit"),
-    path("problem/<int: problem_id>/submissions/", ProblemSubmissionsAPI.as_view(), name="problem_submissions")
-]
\ No newline at end of file
+    path("problem/<int:problem_id>/submissions/", ProblemSubmissionsAPI.as_view(), name="problem_submissions"),
+    path("submission/<str:submission_id>/events/", SubmissionEventsAPI.as_view(), name="submission_events"),
+]
@@ -1,11 +1,202 @@
+import json
+import logging
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.http import StreamingHttpResponse, HttpResponse, Http404
+from django.views import View
 from rest_framework.views import APIView
 
+from account.models import UserType
+from conf.conf import SysConfigs
+from judge.admission import AdmissionController, AdmissionRejected
+from judge.events import get_event_hub, Subscription, JudgeEventType
+from judge.pending import PendingQueue
+from problem.models import Problem
+from submission.idempotency import SubmitIdempotency, IN_PROGRESS_RETRY_AFTER
+from submission.models import Submission, JudgeStatus
+from submission.serializers import SubmitSerializer, SubmissionListSerializer, SUBMISSION_LIST_FIELDS
+from utils.api import success, fail, validate_serializer, paginate_keyset
+from utils.throttling import TokenBucketThrottle
+
+logger = logging.getLogger(__name__)
+
+# 每隔多少秒发送一次心跳注释，防止连接被代理断开
+EVENT_KEEPALIVE_INTERVAL = 15
+# 单个连接最长保持的秒数，超时后客户端可以重新连接
+EVENT_STREAM_TIMEOUT = 10 * 60
+# 每个进程最多同时保持的连接数，超过时返回503，客户端在Retry-After秒后重试或改为轮询提交详情
+EVENT_MAX_STREAMS = 1000
+EVENT_RETRY_AFTER = 5
+
+# 当前进程中正在推送的连接数，只在事件循环线程中修改
+_active_streams = 0
+
 
 class ProblemSubmissionsAPI(APIView):
     def get(self, request, problem_id):
-        pass
+        """
+        获取题目的提交列表，按提交时间从新到旧排列，可以按user_id、result筛选
+        使用游标分页：第一页不传cursor，之后传入上一页返回的next，next为None时没有下一页；每页page_size条，最多100条
+        submission_list_show_all关闭时普通用户只能看到自己的提交
+        """
+        submissions = Submission.objects.filter(problem_id=problem_id).only(*SUBMISSION_LIST_FIELDS)
+        user_id = request.GET.get("user_id")
+        if not SysConfigs.submission_list_show_all:
+            if not request.user.is_authenticated:
+                return fail('用户未登录！')
+            if request.user.user_type != UserType.ADMIN:
+                user_id = request.user.id
+        try:
+            if user_id:
+                submissions = submissions.filter(user_id=int(user_id))
+            if request.GET.get("result"):
+                submissions = submissions.filter(result=int(request.GET["result"]))
+            data, next_cursor = paginate_keyset(request, submissions, ["create_time", "id"],
+                                                SubmissionListSerializer)
+        except ValueError:
+            return fail('参数错误！')
+        return success({"submissions": data, "next": next_cursor})
+
+
+def _send_judge_task(submission_id, problem_id):
+    """
+    投递判题任务，消息队列不可用时放入等待队列，判题服务器下一次心跳时再投递
+    """
+    # judge.tasks引入时会定义actor，只在投递时引入，加载url时不依赖broker
+    from judge.tasks import judge_task
+    try:
+        judge_task.send(submission_id, problem_id)
+    except Exception:
+        logger.exception(f"Failed to send judge task of submission {submission_id}")
+        PendingQueue.push(submission_id, problem_id)
 
 
 class ProblemSubmitAPI(APIView):
+    throttle_classes = [TokenBucketThrottle]
+
+    @validate_serializer(SubmitSerializer)
     def post(self, request):
-        pass
+        """
+        提交代码，返回submission_id，判题任务在事务提交后投递；
+        客户端可以在Idempotency-Key头中传入本次提交的唯一标识，重试时不会重复创建提交：
+        第一次请求还没有完成时返回err为submission-in-progress的错误和Retry-After头，
+        同一个key用于不同的题目、语言或代码时返回err为idempotency-key-reused的错误
+        进行中的提交数超过上限时返回错误，并在Retry-After头中给出建议等待的秒数
+        """
+        if not request.user.is_authenticated:
+            return fail('用户未登录！')
+        if request.data["language"] not in SysConfigs.language_names:
+            return fail('不支持该语言！')
+
+        submission_id = str(uuid.uuid4())
+        idempotency_key = request.headers.get("Idempotency-Key")
+        finish = None
+        if idempotency_key:
+            user_id, data = request.user.id, request.data
+            fingerprint = SubmitIdempotency.fingerprint(data["problem_id"], data["language"], data["code"])
+            existing = SubmitIdempotency.claim(user_id, idempotency_key, fingerprint)
+            if existing:
+                if existing["fingerprint"] != fingerprint:
+                    return fail('Idempotency-Key已用于其它提交！', err="idempotency-key-reused")
+                if existing["submission_id"] is None:
+                    response = fail('提交正在处理中，请稍后再试！', err="submission-in-progress")
+                    response["Retry-After"] = str(IN_PROGRESS_RETRY_AFTER)
+                    return response
+                return success({"submission_id": existing["submission_id"]})
+
+            def finish():
+                SubmitIdempotency.finish(user_id, idempotency_key, fingerprint, submission_id)
+        try:
+            response = self._submit(request, submission_id, finish)
+        except Exception:
+            if idempotency_key:
+                SubmitIdempotency.forget(request.user.id, idempotency_key)
+            raise
+        if response.data["err"] and idempotency_key:
+            SubmitIdempotency.forget(request.user.id, idempotency_key)
+        return response
+
+    @staticmethod
+    def _submit(request, submission_id, on_commit=None):
+        data = request.data
+        if not Problem.objects.filter(id=data["problem_id"]).exists():
+            return fail('题目不存在！')
+        try:
+            AdmissionController.admit(submission_id, request.user.id)
+        except AdmissionRejected as e:
+            response = fail(e.msg, err="too-many-submissions")
+            response["Retry-After"] = str(e.retry_after)
+            return response
+        try:
+            with transaction.atomic():
+                Submission.objects.create(id=submission_id, problem_id=data["problem_id"], user_id=request.user.id,
+                                          username=request.user.username, code=data["code"],
+                                          language=data["language"], ip=request.META.get("REMOTE_ADDR"))
+                if on_commit:
+                    transaction.on_commit(on_commit)
+                # 事务回滚时不会投递，判题任务也不会读到还没有提交的提交
+                transaction.on_commit(lambda: _send_judge_task(submission_id, int(data["problem_id"])))
+        except Exception:
+            AdmissionController.release(submission_id)
+            raise
+        return success({"submission_id": submission_id})
+
+
+def _sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+class SubmissionEventsAPI(View):
+    """
+    通过Server-Sent Events推送提交的判题进度：PENDING -> JUDGING -> 各测试点结果 -> 最终结果，
+    客户端不再需要反复请求提交详情来轮询结果。需要以ASGI方式部署
+    可见范围与提交列表相同：submission_list_show_all关闭时只有提交者本人和管理员可以订阅
+    """
+    async def get(self, request, submission_id):
+        owner_id = await Submission.objects.filter(id=submission_id).values_list("user_id", flat=True).afirst()
+        if owner_id is None:
+            raise Http404()
+        if not await sync_to_async(lambda: SysConfigs.submission_list_show_all)():
+            user = await request.auser()
+            if not user.is_authenticated:
+                raise PermissionDenied('用户未登录！')
+            if user.user_type != UserType.ADMIN and user.id != owner_id:
+                raise PermissionDenied()
+        if _active_streams >= EVENT_MAX_STREAMS:
+            response = HttpResponse(status=503)
+            response["Retry-After"] = str(EVENT_RETRY_AFTER)
+            return response
+        response = StreamingHttpResponse(self.stream(submission_id), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    @staticmethod
+    async def stream(submission_id):
+        global _active_streams
+        _active_streams += 1
+        try:
+            # 先订阅再读取当前状态，避免漏掉两者之间发生的事件
+            async with Subscription(get_event_hub(), submission_id) as subscription:
+                submission = await Submission.objects.only("result", "statistic_info").aget(id=submission_id)
+                if submission.result not in (JudgeStatus.PENDING, JudgeStatus.JUDGING):
+                    yield _sse({"type": JudgeEventType.FINISHED, "result": submission.result,
+                                "statistic_info": submission.statistic_info})
+                    return
+                yield _sse({"type": JudgeEventType.STATUS, "result": submission.result})
+
+                deadline = time.monotonic() + EVENT_STREAM_TIMEOUT
+                while time.monotonic() < deadline:
+                    event = await subscription.get(timeout=EVENT_KEEPALIVE_INTERVAL)
+                    if event is None:
+                        yield ": keep-alive\n\n"
+                        continue
+                    yield _sse(event)
+                    if event["type"] == JudgeEventType.FINISHED:
+                        return
+        finally:
+            _active_streams -= 1
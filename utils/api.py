@@ -1,5 +1,7 @@
-import functools, os, base64, smtplib, random, string
+import functools, os, base64, json, smtplib, random, string
 
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 from rest_framework import status
 from rest_framework.response import Response
 from email.mime.multipart import MIMEMultipart
@@ -74,6 +76,7 @@ def validate_serializer(serializer):
     :return: 被装饰好的函数
     一个装饰器，用于简化重复的验证代码，对请求数据进行验证，如果验证通过则继续对请求进行处理，
     若验证失败，则不再继续处理请求，而是调用invalid_serializer返回验证失败的具体信息
+    验证通过的数据保存在request.validated_data中
     """
     def validate(view_method):
         @functools.wraps(view_method)
@@ -82,6 +85,7 @@ def validate_serializer(serializer):
             print(request.data)
             s = serializer(data=request.data)
             if s.is_valid():
+                request.validated_data = s.validated_data
                 return view_method(*args, **kwargs)
             else:
                 return _invalid_serializer(s)
@@ -116,6 +120,58 @@ def paginate_data(request, query_set, object_serializer=None):
     return results
 
 
+def _keyset_filter(fields, values):
+    """
+    (f1, f2, ...) < (v1, v2, ...)，即f1 < v1 or (f1 = v1 and f2 < v2) or ...
+    """
+    condition = Q()
+    for i in range(len(fields)):
+        lookups = dict(zip(fields[:i], values[:i]))
+        lookups[f"{fields[i]}__lt"] = values[i]
+        condition |= Q(**lookups)
+    return condition
+
+
+def paginate_keyset(request, query_set, fields, object_serializer=None, default_page_size=20, max_page_size=100):
+    """
+    :param request: django的request，cursor参数为上一页返回的next，第一页不传
+    :param query_set: django model的query set
+    :param fields: 排序字段，均按降序排列，最后一个字段必须唯一
+    :param object_serializer: 用来序列化当前页
+    :return: (当前页的数据, 下一页的cursor，没有下一页时为None)，cursor无效时抛出ValueError
+    游标分页：按上一页最后一行的排序键定位，不使用OFFSET，翻到多深都只读取page_size + 1行
+    """
+    try:
+        page_size = min(max(int(request.GET.get("page_size", default_page_size)), 1), max_page_size)
+    except ValueError:
+        page_size = default_page_size
+    meta = query_set.model._meta
+    cursor = request.GET.get("cursor")
+    if cursor:
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except ValueError:
+            raise ValueError("invalid cursor")
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError("invalid cursor")
+        try:
+            values = [meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+        except ValidationError:
+            raise ValueError("invalid cursor")
+        query_set = query_set.filter(_keyset_filter(fields, values))
+
+    results = list(query_set.order_by(*[f"-{field}" for field in fields])[:page_size + 1])
+    next_cursor = None
+    if len(results) > page_size:
+        results = results[:page_size]
+        # value_to_string保留完整的精度(如微秒)，与数据库中的值比较时不会跳过或重复行
+        last = [meta.get_field(field).value_to_string(results[-1]) for field in fields]
+        next_cursor = base64.urlsafe_b64encode(json.dumps(last).encode("utf-8")).decode("ascii")
+    if object_serializer:
+        results = object_serializer(results, many=True).data
+    return results, next_cursor
+
+
 class ImageCode:
     @staticmethod
     def image_base64(imagePath):
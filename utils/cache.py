@@ -0,0 +1,75 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def incr_or_init(key, delta=1, timeout=None, initial=0):
+    """
+    原子地把缓存中的计数器加上delta并返回新值；计数器不存在(第一次使用、过期或被淘汰)时先以initial创建，
+    timeout只在创建时设置。并发创建时只有一个add成功，之后的incr都作用在同一个计数器上
+    """
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, initial, timeout=timeout)
+        return cache.incr(key, delta)
+
+
+def get_version(key, timeout=None):
+    """
+    读取缓存中的版本号，不存在(第一次使用、缓存被清空或淘汰)时原子地创建一个，依赖它的快照都会重新加载一次
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=timeout)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(keys, timeout=None):
+    """
+    修改数据后调用，更新各个版本号使依赖它们的快照失效；
+    在事务中调用时提交后会再更新一次，提交前重新加载的进程不会一直使用旧的数据
+    """
+    keys = list(keys)
+
+    def bump():
+        cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=timeout)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+class VersionedSnapshots:
+    """
+    进程内缓存的快照，每个快照保存加载时缓存中的版本号
+    1. get先读版本号再调用loader读数据库，读到的快照不会比版本号旧；版本号改变后下一次get重新加载
+    2. 最多保存max_size个快照，按LRU淘汰
+    """
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, version_key, loader, max_age=None):
+        """
+        返回key对应的快照，版本号与version_key的不同或者加载超过max_age秒时调用loader重新加载
+        """
+        version = get_version(version_key)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version and (max_age is None or now - entry[1] <= max_age):
+                self.entries.move_to_end(key)
+                return entry[2]
+        value = loader()
+        with self.lock:
+            self.entries[key] = (version, now, value)
+            self.entries.move_to_end(key)
+            while self.max_size is not None and len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
@@ -1,4 +1,22 @@
 class CacheKey:
-    waiting_queue = "waiting_queue"
     contest_rank_cache = "contest_rank_cache"
-    website_config = "website_config"
\ No newline at end of file
+    website_config = "website_config"
+    sys_configs_version = "sys_configs_version"
+    judge_server_slots = "judge_server_slots"
+    judge_server = "judge_server"
+    judge_server_hostnames = "judge_server_hostnames"
+    judge_server_flush_lock = "judge_server_flush_lock"
+    judge_server_latency = "judge_server_latency"
+    verdict_cache = "verdict_cache"
+    verdict_cache_hits = "verdict_cache_hits"
+    verdict_cache_misses = "verdict_cache_misses"
+    judge_event = "judge_event"
+    problem_counter_flush_lock = "problem_counter_flush_lock"
+    judge_inflight = "judge_inflight"
+    judge_lease_sweep_lock = "judge_lease_sweep_lock"
+    submit_idempotency = "submit_idempotency"
+    throttling = "throttling"
+    problem_judge_info_version = "problem_judge_info_version"
+    user_problem_status = "user_problem_status"
+    problem_search_epoch = "problem_search_epoch"
+    problem_search_changes = "problem_search_changes"
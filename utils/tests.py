@@ -1,3 +1,145 @@
-from django.test import TestCase
+import unittest
 
-# Create your tests here.
+import dramatiq
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from dramatiq.brokers.stub import StubBroker
+
+from account.models import User
+from conf.conf import SysConfigs
+from problem.models import Problem
+from problem.tests import DEFAULT_PROBLEM_DATA
+from utils.cache import incr_or_init, get_version, bump_version, VersionedSnapshots
+from utils.throttling import TokenBucket, consume_tokens
+
+dramatiq.set_broker(StubBroker())
+
+
+class CacheHelpersTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_incr_or_init(self):
+        self.assertEqual(incr_or_init("counter"), 1)
+        self.assertEqual(incr_or_init("counter", 2), 3)
+        # 计数器被淘汰后从initial重新开始
+        cache.delete("counter")
+        self.assertEqual(incr_or_init("counter", initial=10), 11)
+
+    def test_versioned_snapshots(self):
+        snapshots = VersionedSnapshots(max_size=1)
+        loads = []
+
+        def loader(value):
+            def load():
+                loads.append(value)
+                return value
+            return load
+
+        self.assertEqual(snapshots.get("a", "version:a", loader(1)), 1)
+        self.assertEqual(snapshots.get("a", "version:a", loader(2)), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_version(["version:a"])
+        self.assertEqual(snapshots.get("a", "version:a", loader(3)), 3)
+        self.assertEqual(snapshots.get("a", "version:a", loader(4), max_age=-1), 4)
+        # 超过max_size时淘汰最久没有使用的快照
+        snapshots.get("b", "version:b", loader(5))
+        self.assertEqual(snapshots.get("a", "version:a", loader(6)), 6)
+        self.assertEqual(loads, [1, 3, 4, 5, 6])
+        self.assertEqual(get_version("version:a"), cache.get("version:a"))
+
+
+class TokenBucketTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.bucket = TokenBucket("bucket", capacity=3, fill_rate=0.5, default_capacity=2)
+
+    def test_consume(self):
+        now = 1_700_000_000
+        self.assertEqual(self.bucket.consume(now), (True, None))
+        self.assertEqual(self.bucket.consume(now), (True, None))
+        allowed, wait = self.bucket.consume(now)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 2)
+        # 被拒绝的请求不消耗令牌
+        self.assertAlmostEqual(self.bucket.tokens(now), 0)
+
+        self.assertTrue(self.bucket.consume(now + 2)[0])
+        self.assertFalse(self.bucket.consume(now + 2)[0])
+
+    def test_capacity(self):
+        """
+        长时间不访问时桶中的令牌数不超过capacity
+        """
+        now = 1_700_000_000
+        self.bucket.consume(now)
+        now += 100
+        self.assertAlmostEqual(self.bucket.tokens(now), 3)
+        for _ in range(3):
+            self.assertTrue(self.bucket.consume(now)[0])
+        self.assertFalse(self.bucket.consume(now)[0])
+
+
+    def test_consume_tokens(self):
+        """
+        任一个桶空了时其它桶的令牌也不消耗
+        """
+        now = 1_700_000_000
+        empty = TokenBucket("empty", capacity=1, fill_rate=0.5, default_capacity=0)
+        self.assertEqual(consume_tokens([self.bucket, empty], now), (False, 2))
+        self.assertAlmostEqual(self.bucket.tokens(now), 2)
+        self.assertEqual(consume_tokens([self.bucket, empty], now + 2), (True, None))
+        self.assertAlmostEqual(self.bucket.tokens(now + 2), 2)
+
+
+def _redis_available():
+    try:
+        import redis
+        return redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=0.2).ping()
+    except Exception:
+        return False
+
+
+@unittest.skipUnless(_redis_available(), "redis is not available")
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache",
+                                       "LOCATION": settings.REDIS_URL, "KEY_PREFIX": "test"}})
+class RedisTokenBucketTestCase(TokenBucketTestCase):
+    """
+    在redis中用Lua脚本执行相同的测试
+    """
+    def tearDown(self):
+        cache.delete_many(["bucket", "empty"])
+
+
+class TokenBucketThrottleTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username="test", email="123@qq.com", password="password")
+        self.problem = Problem.objects.create(**DEFAULT_PROBLEM_DATA)
+        self.url = reverse("problem_submit")
+        SysConfigs.throttling = {"ip": {"capacity": 100, "fill_rate": 0.1, "default_capacity": 50},
+                                 "user": {"capacity": 2, "fill_rate": 0.01, "default_capacity": 2}}
+
+    def submit(self):
+        return self.client.post(self.url, {"problem_id": self.problem.id, "language": "C++", "code": ""})
+
+    def test_throttle_user(self):
+        self.client.login(email="123@qq.com", password="password")
+        self.assertNotEqual(self.submit().status_code, 429)
+        self.assertNotEqual(self.submit().status_code, 429)
+        response = self.submit()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 0)
+
+        # 修改配置后立即生效(setter清除了缓存的配置)
+        SysConfigs.throttling = {"ip": {"capacity": 100, "fill_rate": 0.1, "default_capacity": 50},
+                                 "user": {"capacity": 2, "fill_rate": 1000, "default_capacity": 2}}
+        self.assertNotEqual(self.submit().status_code, 429)
+
+    def test_throttle_ip(self):
+        SysConfigs.throttling = {"ip": {"capacity": 1, "fill_rate": 0.01, "default_capacity": 1},
+                                 "user": {"capacity": 20, "fill_rate": 0.03, "default_capacity": 10}}
+        self.assertNotEqual(self.submit().status_code, 429)
+        self.assertEqual(self.submit().status_code, 429)
@@ -0,0 +1,174 @@
+import time
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.throttling import BaseThrottle
+
+from conf.conf import SysConfigs
+from utils.cache import incr_or_init
+from utils.constants import CacheKey
+
+# 令牌数以千分之一为单位保存为整数，才能使用缓存的原子incr/decr
+SCALE = 1000
+
+# 在redis中原子地从多个桶中各取一个令牌，任一个桶空了时都不修改，返回{空了的桶的序号(从1开始，成功时为0), 缺少的令牌数}
+# ARGV[1]为SCALE，之后每个桶依次是generated、桶不存在时的used、取完令牌后最多剩下的令牌数、过期秒数(0表示不过期)
+_CONSUME_SCRIPT = """
+local scale = tonumber(ARGV[1])
+local function save(i, value)
+    local timeout = tonumber(ARGV[i * 4 + 1])
+    if timeout > 0 then
+        redis.call("SET", KEYS[i], string.format("%d", value), "EX", timeout)
+    else
+        redis.call("SET", KEYS[i], string.format("%d", value))
+    end
+end
+local used = {}
+local created = {}
+for i = 1, #KEYS do
+    local generated = tonumber(ARGV[i * 4 - 2])
+    local value = tonumber(redis.call("GET", KEYS[i]))
+    if value == nil then
+        value = tonumber(ARGV[i * 4 - 1])
+        created[i] = value
+    end
+    local tokens = generated - value - scale
+    if tokens < 0 then
+        -- 与incr的实现一致，被拒绝时桶也从这时开始积累令牌
+        for j = 1, i do
+            if created[j] then
+                save(j, created[j])
+            end
+        end
+        return {i, -tokens}
+    end
+    used[i] = value + scale + math.max(tokens - tonumber(ARGV[i * 4]), 0)
+end
+for i = 1, #KEYS do
+    save(i, used[i])
+end
+return {0, 0}
+"""
+# 每个redis服务器的(客户端, 注册的脚本)；RedisCache每次操作都创建一个新的客户端，开销比一次请求还大
+_consume_scripts = {}
+
+
+class TokenBucket:
+    """
+    保存在共享缓存中的令牌桶，多进程共享，不需要加锁
+    缓存中只保存一个整数used：从纪元开始累计生成的令牌数fill_rate * now减去used就是桶中当前的令牌数，
+    1. 取令牌时used加一个令牌，加完后令牌数小于0说明桶空了，减回去并拒绝
+    2. 令牌数超过capacity时把多出的部分也加到used上(丢弃)；并发丢弃时最多多丢一些令牌，只会更严格
+    3. 桶在capacity / fill_rate秒没有被访问后一定是满的，这时缓存过期，重新以default_capacity个令牌开始
+    缓存后端是redis时以上步骤在一个Lua脚本中原子地执行，见consume_tokens；其它后端只使用原子的add/incr/decr
+    """
+    def __init__(self, key, capacity, fill_rate, default_capacity):
+        self.key = key
+        self.capacity = capacity
+        self.fill_rate = fill_rate
+        self.default_capacity = default_capacity
+        self.timeout = max(int(capacity / fill_rate), 1) if fill_rate > 0 else None
+
+    def _generated(self, now):
+        return int(self.fill_rate * now * SCALE)
+
+    def _wait(self, shortage):
+        return shortage / (self.fill_rate * SCALE) if self.fill_rate > 0 else None
+
+    def consume(self, now=None):
+        """
+        取一个令牌，返回(是否成功, 失败时需要等待的秒数)
+        """
+        return consume_tokens([self], now)
+
+    def _consume(self, now):
+        generated = self._generated(now)
+        used = incr_or_init(self.key, SCALE, timeout=self.timeout, initial=generated - self.default_capacity * SCALE)
+        tokens = generated - used
+        if tokens < 0:
+            cache.decr(self.key, SCALE)
+            return False, self._wait(-tokens)
+        excess = tokens - (self.capacity - 1) * SCALE
+        if excess > 0:
+            cache.incr(self.key, excess)
+        cache.touch(self.key, self.timeout)
+        return True, None
+
+    def _refund(self):
+        try:
+            cache.decr(self.key, SCALE)
+        except ValueError:
+            # 桶已经过期，重新创建时是满的
+            pass
+
+    def tokens(self, now=None):
+        """
+        桶中当前的令牌数，不存在时为default_capacity
+        """
+        now = time.time() if now is None else now
+        used = cache.get(self.key)
+        if used is None:
+            return self.default_capacity
+        return min((self.fill_rate * now * SCALE - used) / SCALE, self.capacity)
+
+
+def _redis_consume_tokens(buckets, now):
+    backend = caches["default"]
+    servers = tuple(backend._servers)
+    if servers not in _consume_scripts:
+        # 写操作都在第一个redis服务器上，所有的桶在同一个服务器中；客户端是线程安全的
+        client = backend._cache.get_client(write=True)
+        _consume_scripts[servers] = client, client.register_script(_CONSUME_SCRIPT)
+    client, script = _consume_scripts[servers]
+    args = [SCALE]
+    for bucket in buckets:
+        generated = bucket._generated(now)
+        args += [generated, generated - bucket.default_capacity * SCALE, (bucket.capacity - 1) * SCALE,
+                 bucket.timeout or 0]
+    index, shortage = script(keys=[backend.make_and_validate_key(bucket.key) for bucket in buckets],
+                            args=args, client=client)
+    if index:
+        return False, buckets[index - 1]._wait(shortage)
+    return True, None
+
+
+def consume_tokens(buckets, now=None):
+    """
+    从每个桶中各取一个令牌，任一个桶空了时都不取，返回(是否成功, 失败时需要等待的秒数)
+    缓存后端是redis时一次请求原子地检查并修改所有的桶；其它后端依次取令牌，失败时退还之前的桶中取到的令牌
+    """
+    now = time.time() if now is None else now
+    if isinstance(caches["default"], RedisCache):
+        return _redis_consume_tokens(buckets, now)
+    consumed = []
+    for bucket in buckets:
+        allowed, wait = bucket._consume(now)
+        if not allowed:
+            for item in consumed:
+                item._refund()
+            return False, wait
+        consumed.append(bucket)
+    return True, None
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    按SysConfigs.throttling中的配置限制请求频率：登录用户使用user桶，所有请求都使用按IP区分的ip桶，
+    配置修改后立即生效。超出频率时返回429和Retry-After
+    用法：在需要限流的APIView上设置throttle_classes = [TokenBucketThrottle]
+    """
+    def __init__(self):
+        self.wait_time = None
+
+    def buckets(self, request):
+        config = SysConfigs.throttling
+        if request.user.is_authenticated:
+            yield TokenBucket(f"{CacheKey.throttling}:user:{request.user.id}", **config["user"])
+        yield TokenBucket(f"{CacheKey.throttling}:ip:{self.get_ident(request)}", **config["ip"])
+
+    def allow_request(self, request, view):
+        allowed, self.wait_time = consume_tokens(list(self.buckets(request)))
+        return allowed
+
+    def wait(self):
+        return self.wait_time